@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""A local HTTP and FTP server for the benchmarks.
+
+The servers serve virtual files with deterministic content (see
+get_data), so no disk space is needed and the downloaded files can be
+verified. HTTP supports Range requests, FTP supports REST. Both can
+simulate bad networks and servers with a Profile:
+- a bandwidth cap per connection
+- a latency before the response
+- a limit of parallel connections (HTTP 503 / FTP 421)
+- resets of the connection after a number of bytes
+
+The servers are usually started in a child process (see ServerProcess),
+so they do not disturb the CPU and memory measurements of the client.
+
+Usage (run by ServerProcess):
+$ python bench/benchserver.py '<profile as JSON>'
+The ports are printed as JSON. The servers stop when stdin is closed.
+"""
+
+import SocketServer
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+from os.path import dirname, realpath, join
+from random import Random
+import re
+import socket
+import struct
+import subprocess
+import sys
+from threading import Lock, Thread
+from time import sleep, time
+
+BLOCK_SIZE = 65536
+_block = ''.join(chr(Random(0).randint(0, 255)) for i in xrange(BLOCK_SIZE))
+_block2 = _block * 2
+
+
+def get_data(offset, length):
+    """Returns length bytes of the virtual files starting at offset.
+
+    All virtual files have the same content: a pseudo-random block of
+    BLOCK_SIZE bytes which is repeated.
+    """
+    parts = []
+    while length > 0:
+        start = offset % BLOCK_SIZE
+        n = min(length, BLOCK_SIZE)
+        parts.append(_block2[start:start + n])
+        offset += n
+        length -= n
+    return ''.join(parts)
+
+
+class Profile:
+    """The behaviour of a server.
+
+    Public instance variables:
+    files -- a dict filename --> size of the virtual files
+    rate -- the bandwidth cap of each connection in bytes per second.
+            0 means unlimited.
+    latency -- the seconds to wait before a response is sent
+    max_connections -- the maximum number of parallel connections of
+                       both servers. 0 means unlimited.
+    reset_after -- the number of bytes after which a data connection is
+                   reset. 0 means never.
+    """
+
+    def __init__(self, files, rate=0, latency=0, max_connections=0,
+                 reset_after=0):
+        self.files = files
+        self.rate = rate
+        self.latency = latency
+        self.max_connections = max_connections
+        self.reset_after = reset_after
+
+    @staticmethod
+    def create_from_dict(dict):
+        return Profile(dict['files'], dict['rate'], dict['latency'],
+                       dict['max_connections'], dict['reset_after'])
+
+    def get_as_dict(self):
+        return {
+            'files': self.files,
+            'rate': self.rate,
+            'latency': self.latency,
+            'max_connections': self.max_connections,
+            'reset_after': self.reset_after
+        }
+
+
+class _ConnectionCounter:
+
+    def __init__(self, limit):
+        self._lock = Lock()
+        self._limit = limit
+        self._count = 0
+
+    def acquire(self):
+        """Returns False if the limit is reached."""
+        with self._lock:
+            if self._limit > 0 and self._count >= self._limit:
+                return False
+            self._count += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._count -= 1
+
+
+def _send_data(sock_file, sock, profile, offset, length):
+    """Send the data with the bandwidth cap and resets of the profile.
+
+    Returns False if the connection was reset or closed by the client.
+    """
+    block = 16384
+    if profile.rate > 0:
+        # about 20 writes per second
+        block = max(1024, min(block, profile.rate // 20))
+    start = time()
+    sent = 0
+    try:
+        while sent < length:
+            n = min(block, length - sent)
+            if profile.reset_after > 0 and sent + n > profile.reset_after:
+                n = profile.reset_after - sent
+                if n > 0:
+                    sock_file.write(get_data(offset + sent, n))
+                    sock_file.flush()
+                # close with RST instead of FIN
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                struct.pack('ii', 1, 0))
+                return False
+            sock_file.write(get_data(offset + sent, n))
+            sent += n
+            if profile.rate > 0:
+                ahead = start + sent / float(profile.rate) - time()
+                if ahead > 0:
+                    sleep(ahead)
+        sock_file.flush()
+    except socket.error:
+        return False
+    return True
+
+
+class _HTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        profile = self.server.profile
+        if not self.server.connections.acquire():
+            self.send_error(503, 'Too many connections')
+            return
+        try:
+            self._send_file(profile)
+        finally:
+            self.server.connections.release()
+
+    def _send_file(self, profile):
+        name = self.path.lstrip('/')
+        if name not in profile.files:
+            self.send_error(404)
+            return
+        size = profile.files[name]
+        start, end = 0, size - 1
+        if profile.latency > 0:
+            sleep(profile.latency)
+        range = self.headers.get('Range')
+        m = range and re.match(r'bytes=(\d+)-(\d*)$', range)
+        if m:
+            start = int(m.group(1))
+            if m.group(2):
+                end = min(int(m.group(2)), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes {0}-{1}/{2}'.format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        _send_data(self.wfile, self.connection, profile, start,
+                   end - start + 1)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _handle_error(server, request, client_address):
+    # clients close connections early, e.g. at the end of a chunk
+    if not isinstance(sys.exc_info()[1], socket.error):
+        SocketServer.BaseServer.handle_error(server, request, client_address)
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    handle_error = _handle_error
+
+
+class _FTPHandler(SocketServer.StreamRequestHandler):
+    """A minimal FTP server for anonymous passive downloads."""
+
+    def reply(self, line):
+        self.wfile.write(line + '\r\n')
+
+    def handle(self):
+        profile = self.server.profile
+        if not self.server.connections.acquire():
+            self.reply('421 Too many users, try again in 1 seconds')
+            return
+        try:
+            self._handle(profile)
+        except socket.error:
+            pass
+        finally:
+            self.server.connections.release()
+
+    def _handle(self, profile):
+        self.reply('220 Benchmark FTP server')
+        rest = 0
+        data_server = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            cmd, sep, arg = line.strip().partition(' ')
+            cmd = cmd.upper()
+            if cmd == 'USER':
+                self.reply('331 Password required')
+            elif cmd == 'PASS':
+                self.reply('230 Logged in')
+            elif cmd == 'SYST':
+                self.reply('215 UNIX Type: L8')
+            elif cmd == 'TYPE':
+                self.reply('200 Type set')
+            elif cmd == 'PWD':
+                self.reply('257 "/"')
+            elif cmd == 'CWD':
+                self.reply('250 Directory changed')
+            elif cmd == 'SIZE':
+                if arg in profile.files:
+                    self.reply('213 {0}'.format(profile.files[arg]))
+                else:
+                    self.reply('550 No such file')
+            elif cmd == 'REST':
+                rest = int(arg)
+                self.reply('350 Restarting at {0}'.format(rest))
+            elif cmd in ('PASV', 'EPSV'):
+                if data_server is not None:
+                    data_server.close()
+                data_server = socket.socket()
+                data_server.bind(('127.0.0.1', 0))
+                data_server.listen(1)
+                port = data_server.getsockname()[1]
+                if cmd == 'PASV':
+                    self.reply('227 Entering Passive Mode '
+                               '(127,0,0,1,{0},{1})'.format(port >> 8,
+                                                            port & 255))
+                else:
+                    self.reply('229 Entering Extended Passive Mode '
+                               '(|||{0}|)'.format(port))
+            elif cmd == 'RETR':
+                if arg not in profile.files:
+                    self.reply('550 No such file')
+                elif data_server is None:
+                    self.reply('425 Use PASV first')
+                else:
+                    self._retrieve(profile, profile.files[arg], rest,
+                                   data_server)
+                    data_server = None
+                rest = 0
+            elif cmd == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+        if data_server is not None:
+            data_server.close()
+
+    def _retrieve(self, profile, size, rest, data_server):
+        if profile.latency > 0:
+            sleep(profile.latency)
+        length = max(size - rest, 0)
+        self.reply('150 Opening BINARY mode data connection '
+                   '({0} bytes)'.format(length))
+        data_server.settimeout(10)
+        try:
+            data, address = data_server.accept()
+        except socket.error:
+            self.reply('425 Can not open data connection')
+            return
+        finally:
+            data_server.close()
+        data_file = data.makefile('wb')
+        complete = _send_data(data_file, data, profile, rest, length)
+        try:
+            data_file.close()
+        except socket.error:
+            complete = False
+        data.close()
+        if complete:
+            self.reply('226 Transfer complete')
+        else:
+            self.reply('426 Connection closed; transfer aborted')
+
+
+class _FTPServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+    handle_error = _handle_error
+
+
+def serve(profile):
+    """Start the HTTP and FTP server in this process.
+
+    Returns a dict with the ports.
+    """
+    # the limit is shared by both servers like by the servers of a host
+    connections = _ConnectionCounter(profile.max_connections)
+    servers = []
+    for server_class, handler in ((_HTTPServer, _HTTPRequestHandler),
+                                  (_FTPServer, _FTPHandler)):
+        server = server_class(('127.0.0.1', 0), handler)
+        server.profile = profile
+        server.connections = connections
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+    return {'http': servers[0].server_address[1],
+            'ftp': servers[1].server_address[1]}
+
+
+class ServerProcess:
+    """A child process running the servers of a Profile.
+
+    Public instance variables:
+    http_url -- the url of the HTTP server, e.g. 'http://127.0.0.1:1234/'
+    ftp_url -- the url of the FTP server
+    """
+
+    def __init__(self, profile):
+        script = join(dirname(realpath(__file__)), 'benchserver.py')
+        self._process = subprocess.Popen(
+                            [sys.executable, script,
+                             json.dumps(profile.get_as_dict())],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        ports = json.loads(self._process.stdout.readline())
+        self.http_url = 'http://127.0.0.1:{0}/'.format(ports['http'])
+        self.ftp_url = 'ftp://127.0.0.1:{0}/'.format(ports['ftp'])
+
+    def stop(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+
+def main():
+    profile = Profile.create_from_dict(json.loads(sys.argv[1]))
+    print(json.dumps(serve(profile)))
+    sys.stdout.flush()
+    # run until the parent closes stdin
+    sys.stdin.read()
+
+
+if __name__ == '__main__':
+    main()
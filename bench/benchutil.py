@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Helpers shared by the benchmarks which write JSON reports.
+
+A report is a JSON object with the environment (commit, Python version,
+platform) and a list of results. bench/compare.py compares two reports.
+"""
+
+import json
+import os
+from os.path import dirname, realpath
+import platform
+import subprocess
+from time import time
+
+
+def get_environment():
+    """Returns a dict describing the commit and the machine."""
+    try:
+        commit = subprocess.check_output(
+                        ['git', 'rev-parse', '--short', 'HEAD'],
+                        cwd=dirname(realpath(__file__)),
+                        stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time()
+    }
+
+
+def write_report(results, output=None):
+    """Write the report of the results to the file output or stdout."""
+    report = json.dumps({'environment': get_environment(),
+                         'results': results}, indent=2, sort_keys=True)
+    if output is None:
+        print(report)
+    else:
+        with open(output, 'w') as f:
+            f.write(report + '\n')
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Measure importing many saved downloads into the Manager.
+
+The downloads are created from dicts like MainWindow.start does with
+the downloads file. Then they are added one by one (add_download) and
+all at once (add_downloads). The downloads are paused, so no network is
+used.
+
+Usage (from the repository root):
+$ python bench/bulk_add.py [number of downloads]
+"""
+
+from os.path import dirname, join, realpath
+import sys
+from time import time
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+from dlm.download import Download, DownloadState
+from dlm.manager import Manager
+from dlm.source import Source
+
+
+def create_dicts(count):
+    download = Download(1, Source('http://localhost/file', 0, 0, 0), '.')
+    template = download.get_as_dict()
+    template['state'] = DownloadState.paused
+    dicts = []
+    for i in range(count):
+        d = dict(template)
+        source = dict(template['sources'][0])
+        source['original_url'] = source['url'] = \
+                                    'http://localhost/file{0}'.format(i)
+        d['sources'] = [source]
+        dicts.append(d)
+    return dicts
+
+
+def measure(count, bulk):
+    manager = Manager()
+    manager.set_max_parallel_downloads(4)
+    events = [0]
+
+    def on_downloads_added(downloads):
+        events[0] += 1
+    manager.downloads_added_event.add_listener(on_downloads_added)
+
+    dicts = create_dicts(count)
+    start = time()
+    downloads = manager.create_downloads_from_list(dicts)
+    create_time = time() - start
+
+    start = time()
+    if bulk:
+        manager.add_downloads(downloads)
+    else:
+        for download in downloads:
+            manager.add_download(download)
+    add_time = time() - start
+
+    manager.quit()
+    return create_time, add_time, events[0]
+
+
+def main():
+    count = 20000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    print('downloads: {0}'.format(count))
+    for name, bulk in (('add_download', False), ('add_downloads', True)):
+        create_time, add_time, events = measure(count, bulk)
+        print('{0:<14} create: {1:.3f} s, add: {2:.3f} s, events: {3}'.format(
+                                    name, create_time, add_time, events))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Compare two result files of the benchmarks, e.g. of two commits.
+
+The results are matched by their scenario (or name) and each numeric
+value is printed with its relative change.
+
+Usage (from the repository root):
+$ python bench/compare.py OLD.json NEW.json
+"""
+
+import json
+import sys
+
+
+def _load(path):
+    with open(path) as f:
+        report = json.load(f)
+    results = {}
+    for result in report['results']:
+        results[result.get('scenario', result.get('name'))] = result
+    return report.get('environment', {}), results
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    old_environment, old = _load(sys.argv[1])
+    new_environment, new = _load(sys.argv[2])
+    print('old: {0}   new: {1}'.format(old_environment.get('commit'),
+                                       new_environment.get('commit')))
+    for name in sorted(set(old) & set(new)):
+        print('')
+        print(name)
+        for key in sorted(old[name]):
+            a = old[name][key]
+            b = new[name].get(key)
+            if (isinstance(a, bool) or not isinstance(a, (int, long, float))
+                    or not isinstance(b, (int, long, float))):
+                continue
+            change = ''
+            if a:
+                change = '{0:+.1f} %'.format((b - a) * 100.0 / a)
+            print('  {0:<16} {1:>16.6g} {2:>16.6g} {3:>10}'.format(
+                                                    key, a, b, change))
+    for name in sorted(set(old) ^ set(new)):
+        print('')
+        print('{0}: only in one file'.format(name))
+
+
+if __name__ == '__main__':
+    main()
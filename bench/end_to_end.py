@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Run end-to-end download scenarios against local servers.
+
+Each scenario starts the HTTP/FTP servers of bench/benchserver.py with
+a Profile (bandwidth caps, latency, connection limits, resets, slow
+mirrors) and lets a Manager load the downloads headlessly. Every
+scenario runs in its own child process, so the CPU time and the peak
+RSS belong to the scenario alone and the servers are not measured.
+
+Reported per scenario:
+- bytes, wall_time -- from the start of the first download to the end
+                      of the last one
+- throughput -- bytes per second
+- cpu_time, cpu_per_gb -- CPU seconds (user + system) of the client
+- peak_rss -- the peak resident set size in KB
+- ttfb_p50, ttfb_max -- the time from the start of a download until the
+                        first data was received
+- completion_p50, completion_p90, completion_max -- the times when the
+                        downloads were finished (tail completion time)
+- finished, failed, verified -- verified is True if all finished files
+                                have the expected content
+
+The results are printed as JSON (one object with the environment and
+a list of the results). Use bench/compare.py to compare two result
+files, e.g. of two commits.
+
+Usage (from the repository root):
+$ python bench/end_to_end.py [--scale FACTOR] [--output FILE] [scenario ...]
+$ python bench/end_to_end.py --list
+"""
+
+import json
+import os
+from os.path import dirname, join, realpath
+import resource
+import shutil
+import subprocess
+import sys
+from tempfile import mkdtemp
+from threading import Condition
+from time import time
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+from benchserver import Profile, ServerProcess, get_data
+from benchutil import write_report
+from dlm.download import Download, DownloadState
+from dlm.manager import Manager
+from dlm.source import Source
+
+MB = 1024 * 1024
+
+# name --> scenario
+#   servers -- a list of the Profile arguments of each server. The files
+#              (name --> size in MB) are scaled with --scale.
+#   downloads -- a list of downloads, each a list of sources
+#                (server index, 'http' or 'ftp', file name)
+#   slots -- the maximum number of slots of each download
+#   parallel -- the maximum number of parallel downloads
+#   retries, wait -- max_retries and wait_time of the sources
+SCENARIOS = {
+    'http_single': {
+        'servers': [{'files': {'file.bin': 64}}],
+        'downloads': [[(0, 'http', 'file.bin')]],
+        'slots': 4, 'parallel': 1, 'retries': 3, 'wait': 1
+    },
+    'http_capped': {
+        'servers': [{'files': {'file.bin': 16}, 'rate': 2 * MB}],
+        'downloads': [[(0, 'http', 'file.bin')]],
+        'slots': 4, 'parallel': 1, 'retries': 3, 'wait': 1
+    },
+    'http_latency': {
+        'servers': [{'files': dict(('file{0}.bin'.format(i), 1)
+                                   for i in range(16)),
+                     'latency': 0.2}],
+        'downloads': [[(0, 'http', 'file{0}.bin'.format(i))]
+                      for i in range(16)],
+        'slots': 2, 'parallel': 4, 'retries': 3, 'wait': 1
+    },
+    'http_connection_limit': {
+        'servers': [{'files': {'file.bin': 16}, 'rate': 2 * MB,
+                     'max_connections': 2}],
+        'downloads': [[(0, 'http', 'file.bin')]],
+        'slots': 6, 'parallel': 1, 'retries': 20, 'wait': 0.5
+    },
+    'http_resets': {
+        # without a bandwidth cap the client loses most of the data in
+        # the socket buffers when the connection is reset
+        'servers': [{'files': {'file.bin': 16}, 'rate': 8 * MB,
+                     'reset_after': 2 * MB}],
+        'downloads': [[(0, 'http', 'file.bin')]],
+        'slots': 4, 'parallel': 1, 'retries': 100, 'wait': 0.2
+    },
+    'http_slow_mirror': {
+        'servers': [{'files': {'file.bin': 32}, 'rate': 4 * MB},
+                    {'files': {'file.bin': 32}, 'rate': 256 * 1024}],
+        'downloads': [[(0, 'http', 'file.bin'), (1, 'http', 'file.bin')]],
+        'slots': 4, 'parallel': 1, 'retries': 3, 'wait': 1
+    },
+    'ftp_single': {
+        'servers': [{'files': {'file.bin': 32}}],
+        'downloads': [[(0, 'ftp', 'file.bin')]],
+        'slots': 4, 'parallel': 1, 'retries': 3, 'wait': 1
+    },
+    'ftp_capped_limit': {
+        'servers': [{'files': {'file.bin': 16}, 'rate': 2 * MB,
+                     'max_connections': 3}],
+        'downloads': [[(0, 'ftp', 'file.bin')]],
+        'slots': 4, 'parallel': 1, 'retries': 20, 'wait': 0.5
+    }
+}
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def _verify(path, size):
+    """Returns True if the file has the content of the virtual files."""
+    if os.path.getsize(path) != size:
+        return False
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset < size:
+            data = f.read(MB)
+            if data != get_data(offset, len(data)):
+                return False
+            offset += len(data)
+    return True
+
+
+def run_scenario(name, scale):
+    """Run a scenario in this process and return the result dict."""
+    scenario = SCENARIOS[name]
+    servers = []
+    for arguments in scenario['servers']:
+        arguments = dict(arguments)
+        arguments['files'] = dict((f, int(size * MB * scale))
+                                  for f, size in arguments['files'].items())
+        arguments.setdefault('rate', 0)
+        arguments.setdefault('latency', 0)
+        arguments.setdefault('max_connections', 0)
+        arguments.setdefault('reset_after', 0)
+        servers.append((ServerProcess(Profile.create_from_dict(arguments)),
+                        arguments['files']))
+
+    folder = mkdtemp()
+    condition = Condition()
+    started = {}
+    first_data = {}
+    done = {}
+
+    def on_status_changed(download):
+        with condition:
+            if (download.state == DownloadState.fetching_info and
+                    download not in started):
+                started[download] = time()
+            elif download.state in (DownloadState.finished,
+                                    DownloadState.failed,
+                                    DownloadState.cancelled):
+                done[download] = time()
+                condition.notifyAll()
+
+    def on_slots_changed(download):
+        if download.active_slot > 0 and download not in first_data:
+            first_data[download] = time()
+
+    downloads = []
+    sizes = {}
+    for i, sources in enumerate(scenario['downloads']):
+        download = None
+        for server, scheme, filename in sources:
+            process, files = servers[server]
+            url = process.http_url if scheme == 'http' else process.ftp_url
+            source = Source(url + filename, 0, scenario['retries'],
+                            scenario['wait'])
+            if download is None:
+                # each download gets its own folder, the files may have
+                # the same name
+                target_folder = join(folder, str(i))
+                os.mkdir(target_folder)
+                download = Download(scenario['slots'], source, target_folder)
+            else:
+                download.add_source(source)
+            sizes[download] = files[filename]
+        download.status_changed_event.add_listener(on_status_changed)
+        download.slots_changed_event.add_listener(on_slots_changed)
+        downloads.append(download)
+
+    manager = Manager()
+    manager.set_max_parallel_downloads(scenario['parallel'])
+    cpu_start = sum(os.times()[:2])
+    start = time()
+    manager.add_downloads(downloads)
+    with condition:
+        while len(done) < len(downloads):
+            condition.wait()
+    end = time()
+    cpu_time = sum(os.times()[:2]) - cpu_start
+    manager.quit()
+    for process, files in servers:
+        process.stop()
+
+    finished = [d for d in downloads if d.state == DownloadState.finished]
+    verified = all(_verify(join(d.target_folder, d.filename), sizes[d])
+                   for d in finished)
+    shutil.rmtree(folder)
+
+    total = sum(sizes[d] for d in finished)
+    wall_time = end - start
+    ttfb = [first_data[d] - started[d] for d in downloads
+            if d in first_data and d in started]
+    completion = [done[d] - start for d in finished]
+    return {
+        'scenario': name,
+        'scale': scale,
+        'bytes': total,
+        'wall_time': wall_time,
+        'throughput': total / wall_time if wall_time > 0 else None,
+        'cpu_time': cpu_time,
+        'cpu_per_gb': cpu_time / (total / 1e9) if total else None,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'ttfb_p50': _percentile(ttfb, 0.5),
+        'ttfb_max': max(ttfb) if ttfb else None,
+        'completion_p50': _percentile(completion, 0.5),
+        'completion_p90': _percentile(completion, 0.9),
+        'completion_max': max(completion) if completion else None,
+        'finished': len(finished),
+        'failed': len(downloads) - len(finished),
+        'verified': verified
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    if '--list' in args:
+        for name in sorted(SCENARIOS):
+            print(name)
+        return
+    scale = 1.0
+    output = None
+    if '--scale' in args:
+        i = args.index('--scale')
+        scale = float(args[i + 1])
+        del args[i:i + 2]
+    if '--output' in args:
+        i = args.index('--output')
+        output = args[i + 1]
+        del args[i:i + 2]
+    if '--run-one' in args:
+        # internal: run one scenario in this child process
+        print(json.dumps(run_scenario(args[args.index('--run-one') + 1],
+                                      scale)))
+        return
+
+    names = args or sorted(SCENARIOS)
+    results = []
+    for name in names:
+        if name not in SCENARIOS:
+            sys.exit('Unknown scenario: {0}'.format(name))
+        sys.stderr.write('{0}... '.format(name))
+        line = subprocess.check_output([sys.executable, realpath(__file__),
+                                        '--scale', str(scale),
+                                        '--run-one', name])
+        result = json.loads(line.strip().splitlines()[-1])
+        results.append(result)
+        sys.stderr.write('{0:.1f} MB/s, {1:.2f} s CPU/GB, {2} KB RSS, '
+                         'verified: {3}\n'.format(
+                                    (result['throughput'] or 0) / MB,
+                                    result['cpu_per_gb'] or 0,
+                                    result['peak_rss'], result['verified']))
+
+    write_report(results, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Measure the scheduling overhead of the Manager.
+
+Many downloads are enqueued. Then the active downloads are finished one
+after another, so each state change makes the Manager start the next
+ready download. No network is used: the downloads only change their
+state.
+
+Usage (from the repository root):
+$ python bench/manager_scheduling.py [number of downloads]
+"""
+
+from os.path import dirname, join, realpath
+import sys
+from time import time
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+from dlm.download import Download, DownloadState
+from dlm.manager import Manager
+from dlm.source import Source
+
+PARALLEL_DOWNLOADS = 4
+
+
+class SimulatedDownload(Download):
+    """A download which does not load anything."""
+
+    def start(self):
+        self._set_state(DownloadState.loading)
+
+    def finish_now(self):
+        # Download._set_state would clean up in another thread
+        self.state = DownloadState.finished
+        self.status_changed_event.signal(self)
+
+
+def main():
+    count = 50000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    manager = Manager()
+    manager.set_max_parallel_downloads(PARALLEL_DOWNLOADS)
+
+    downloads = []
+    for i in range(count):
+        source = Source('http://localhost/file{0}'.format(i), 0, 0, 0)
+        downloads.append(SimulatedDownload(1, source, '.'))
+
+    start = time()
+    for download in downloads:
+        manager.add_download(download)
+    add_time = time() - start
+
+    start = time()
+    finished = 0
+    while finished < count:
+        for download in list(manager._active):
+            download.finish_now()
+            finished += 1
+    run_time = time() - start
+
+    manager.quit()
+
+    print('downloads:           {0}'.format(count))
+    print('add all:             {0:.3f} s ({1:.1f} us per download)'.format(
+                                        add_time, add_time / count * 1e6))
+    print('finish/start all:    {0:.3f} s ({1:.1f} us per state change)'.format(
+                                        run_time, run_time / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Micro-benchmarks of the hot primitives.
+
+Measured:
+- TargetFile.write of 4 KB blocks by N concurrent writers
+- EventListener.signal with many listeners, from several threads at
+  once and with listeners called by a Dispatcher (coalesced or not)
+- Download.get_bytes_loaded and Download._new_chunk with many chunks
+- Log.add_log_entry with and without a listener: unique messages,
+  repeated messages (Log.add_repeated_log_entry, see
+  Log.repeat_window) and messages below the threshold
+- SettingsFile.save and SettingsFile.load of large downloads files
+  (skipped if PyYAML is not installed)
+
+Each benchmark runs a fixed number of operations several times with
+the garbage collector disabled. The best run is reported as ops/sec.
+Allocations are reported as gc_objects_per_op, the net number of
+objects tracked by the garbage collector which an operation leaves
+behind (Python 2 has no tracemalloc). If tracemalloc is available, the
+allocated bytes per operation are reported as alloc_bytes_per_op.
+
+The results are printed as JSON like the results of end_to_end.py, so
+two runs can be compared with bench/compare.py.
+
+Usage (from the repository root):
+$ python bench/micro.py [--quick] [--output FILE] [name prefix ...]
+"""
+
+import gc
+import imp
+import os
+from os.path import dirname, join, realpath
+import shutil
+import sys
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import sleep, time
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from benchutil import write_report
+from dlm.chunk import Chunk
+from dlm.download import Download, DownloadState
+from dlm.log import Log, MessageType
+from dlm.source import Source
+from dlm.targetfile import TargetFile
+from event.dispatcher import Dispatcher
+from event.eventlistener import EventListener
+
+REPEAT = 5
+
+
+def measure(name, setup, ops, repeat=REPEAT):
+    """Run a benchmark and return its result dict.
+
+    name -- the name of the benchmark including its parameters
+    setup -- a function returning a function which runs ops operations.
+             It is called before each run, so every run starts with the
+             same state.
+    ops -- the number of operations of one run
+    """
+    best = None
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(repeat):
+            run = setup()
+            start = time()
+            run()
+            seconds = time() - start
+            if best is None or seconds < best:
+                best = seconds
+
+        # the allocations are counted in an extra run, because counting
+        # slows down the operations
+        run = setup()
+        gc.collect()
+        objects = gc.get_count()[0]
+        if tracemalloc is not None:
+            tracemalloc.start()
+        run()
+        if tracemalloc is not None:
+            allocated = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+        objects = gc.get_count()[0] - objects
+    finally:
+        gc.enable()
+
+    result = {
+        'name': name,
+        'ops': ops,
+        'seconds': best,
+        'ops_per_sec': ops / best if best > 0 else None,
+        'gc_objects_per_op': float(objects) / ops
+    }
+    if tracemalloc is not None:
+        result['alloc_bytes_per_op'] = float(allocated) / ops
+    sys.stderr.write('{0:<44} {1:>14,.0f} ops/sec {2:>8.2f} objects/op\n'
+                     .format(name, result['ops_per_sec'] or 0,
+                             result['gc_objects_per_op']))
+    return result
+
+
+def bench_targetfile_write(writers, ops, folder):
+    path = join(folder, 'target_file')
+    block = os.urandom(4096)
+    per_writer = ops // writers
+
+    def setup():
+        target_file = TargetFile(path)
+        target_file.open()
+        go = Event()
+
+        def write(region):
+            go.wait()
+            offset = region * per_writer * len(block)
+            for i in xrange(per_writer):
+                target_file.write(offset, block)
+                offset += len(block)
+
+        threads = [Thread(target=write, args=(i,)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+
+        def run():
+            go.set()
+            for thread in threads:
+                thread.join()
+            target_file.close()
+        return run
+
+    return measure('targetfile.write[writers={0}]'.format(writers), setup,
+                   per_writer * writers)
+
+
+def bench_eventlistener_signal(listeners, ops):
+    def setup():
+        event = EventListener()
+        for i in range(listeners):
+            event.add_listener(lambda *args, **kwargs: None)
+
+        def run():
+            signal = event.signal
+            for i in xrange(ops):
+                signal(i, data_received=True)
+        return run
+
+    return measure('eventlistener.signal[listeners={0}]'.format(listeners),
+                   setup, ops)
+
+
+def bench_eventlistener_threads(threads, ops):
+    def setup():
+        event = EventListener()
+        event.add_listener(lambda *args, **kwargs: None)
+
+        def signal():
+            for i in xrange(ops // threads):
+                event.signal(i, data_received=True)
+
+        def run():
+            workers = [Thread(target=signal) for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        return run
+
+    return measure('eventlistener.signal[threads={0}]'.format(threads),
+                   setup, ops)
+
+
+def bench_eventlistener_dispatcher(coalesce, ops):
+    # the first argument is the same for all signals like the download
+    # of a download event
+    dispatcher = Dispatcher('Benchmark Dispatcher')
+
+    def setup():
+        # the calls of the previous run are made before
+        while dispatcher.get_count() > 0:
+            sleep(0.01)
+        event = EventListener()
+        event.add_listener(lambda *args, **kwargs: None, dispatcher, coalesce)
+
+        def run():
+            signal = event.signal
+            for i in xrange(ops):
+                signal(None, i)
+        return run
+
+    name = 'coalesced' if coalesce else 'queued'
+    return measure('eventlistener.signal[dispatcher={0}]'.format(name),
+                   setup, ops)
+
+
+def _create_download(chunks, folder):
+    """Returns a loading Download with the given number of chunks.
+
+    All chunks but the last one are finished, the last one is large, so
+    it can always be split.
+    """
+    chunk_size = 65536
+    filesize = chunk_size * chunks * 1024
+    download = Download(chunks + 1024, Source('http://localhost/file', 0, 0,
+                                              0), folder)
+    download.filesize = filesize
+    download.chunk_size = chunk_size
+    download.slots_supported = True
+    root = Chunk(None, 0, filesize)
+    download.chunks = [root]
+    offset = 0
+    for i in range(chunks - 1):
+        chunk = Chunk(root, offset, chunk_size)
+        chunk.loaded = chunk_size
+        root.childs.append(chunk)
+        download.chunks.append(chunk)
+        offset += chunk_size
+    # the root chunk covers the rest of the file
+    root.offset = offset
+    root.length = filesize - offset
+    root.loaded = 1
+    download.state = DownloadState.loading
+    return download
+
+
+def bench_get_bytes_loaded(chunks, ops, folder):
+    def setup():
+        download = _create_download(chunks, folder)
+
+        def run():
+            get_bytes_loaded = download.get_bytes_loaded
+            for i in xrange(ops):
+                get_bytes_loaded()
+        return run
+
+    return measure('download.get_bytes_loaded[chunks={0}]'.format(chunks),
+                   setup, ops)
+
+
+def bench_new_chunk(chunks, ops, folder):
+    def setup():
+        download = _create_download(chunks, folder)
+
+        def run():
+            new_chunk = download._new_chunk
+            for i in xrange(ops):
+                new_chunk()
+        return run
+
+    return measure('download._new_chunk[chunks={0}]'.format(chunks), setup,
+                   ops)
+
+
+def bench_log(listeners, kind, ops):
+    def setup():
+        log = Log()
+        for i in range(listeners):
+            log.message_added_event.add_listener(lambda log, message: None)
+        # unique messages are not deduplicated
+        Log.repeat_window = 0 if kind == 'unique' else 10
+        type = MessageType.debug if kind == 'filtered' else MessageType.info
+
+        def run():
+            if kind == 'repeated':
+                add_log_entry = log.add_repeated_log_entry
+            else:
+                add_log_entry = log.add_log_entry
+            for i in xrange(ops):
+                add_log_entry(type, 'Slot 0', 'Got new chunk-job (offset={0})!',
+                              i)
+        return run
+
+    try:
+        return measure('log.add_log_entry[{0},listeners={1}]'.format(
+                                                        kind, listeners),
+                       setup, ops)
+    finally:
+        Log.repeat_window = 10
+
+
+def bench_settings_file(downloads, folder):
+    from settings.settings import SettingsFile, SettingsFileType
+
+    class TempSettingsFile(SettingsFile):
+        def _get_settings_folder(self):
+            return folder
+
+    download = _create_download(16, folder)
+    download.state = DownloadState.paused
+    # separate dicts, otherwise YAML would write references
+    data = [download.get_as_dict() for i in range(downloads)]
+
+    def setup_save():
+        settings_file = TempSettingsFile(SettingsFileType.user_settings,
+                                         'mkdlm', 'downloads')
+        settings_file.set('downloads', data)
+        return settings_file.save
+
+    def setup_load():
+        return TempSettingsFile(SettingsFileType.user_settings, 'mkdlm',
+                                'downloads').load
+
+    return [measure('settings.save[downloads={0}]'.format(downloads),
+                    setup_save, 1, repeat=3),
+            measure('settings.load[downloads={0}]'.format(downloads),
+                    setup_load, 1, repeat=3)]
+
+
+def main():
+    args = sys.argv[1:]
+    scale = 1
+    if '--quick' in args:
+        args.remove('--quick')
+        scale = 10
+    output = None
+    if '--output' in args:
+        i = args.index('--output')
+        output = args[i + 1]
+        del args[i:i + 2]
+    prefixes = args
+
+    def enabled(name):
+        return not prefixes or any(name.startswith(p) for p in prefixes)
+
+    folder = mkdtemp()
+    results = []
+    try:
+        if enabled('targetfile'):
+            for writers in (1, 2, 4, 8):
+                results.append(bench_targetfile_write(writers,
+                                                      40000 // scale, folder))
+        if enabled('eventlistener'):
+            for listeners in (1, 10, 100, 1000):
+                results.append(bench_eventlistener_signal(
+                        listeners, max(100, 200000 // listeners // scale)))
+            results.append(bench_eventlistener_threads(4, 200000 // scale))
+            for coalesce in (False, True):
+                results.append(bench_eventlistener_dispatcher(coalesce,
+                                                        100000 // scale))
+        if enabled('download'):
+            for chunks in (10, 100, 1000, 10000):
+                ops = max(10, 200000 // chunks // scale)
+                results.append(bench_get_bytes_loaded(chunks, ops, folder))
+                results.append(bench_new_chunk(chunks, ops, folder))
+        if enabled('log'):
+            for listeners in (0, 1):
+                for kind in ('unique', 'repeated', 'filtered'):
+                    results.append(bench_log(listeners, kind,
+                                             100000 // scale))
+        if enabled('settings'):
+            try:
+                imp.find_module('yaml')
+            except ImportError, e:
+                sys.stderr.write('settings: skipped ({0})\n'.format(e))
+            else:
+                for downloads in (100, 1000):
+                    results.extend(bench_settings_file(downloads // scale,
+                                                       folder))
+    finally:
+        shutil.rmtree(folder)
+
+    write_report(results, output)
+
+
+if __name__ == '__main__':
+    main()
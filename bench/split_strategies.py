@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Simulate a download using each split strategy.
+
+No network is used. The slots are simulated in virtual time, each
+connection to a mirror loads with the fixed speed of the mirror. The
+mirrors are used round-robin like Download.get_next_source does.
+The completion time of the download is printed for each strategy.
+
+Usage (from the repository root):
+$ python bench/split_strategies.py
+"""
+
+from os.path import dirname, join, realpath
+import sys
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+from dlm.chunk import Chunk
+from dlm.download import Download, DownloadState
+from dlm.source import Source
+from dlm.splitstrategy import split_strategies
+
+MB = 1024 * 1024
+
+FILESIZE = 512 * MB
+CHUNK_SIZE = 2 * MB
+SLOTS = 4
+# bytes per second of one connection to each mirror (skewed)
+MIRROR_SPEEDS = [4 * MB, 2 * MB, MB / 2, MB / 8]
+STEP = 0.05
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def simulate(strategy_class):
+    """Simulate the download and return (completion time, chunk-jobs)."""
+    clock = VirtualClock()
+    download = Download(SLOTS, Source('http://localhost/file', 0, 0, 0),
+                        '.')
+    download.filesize = FILESIZE
+    download.chunk_size = CHUNK_SIZE
+    download.slots_supported = True
+    download.split_strategy = strategy_class(clock)
+    download.chunks = [Chunk(None, 0, FILESIZE)]
+    download.state = DownloadState.loading
+
+    mirror = [0]
+    def next_speed():
+        speed = MIRROR_SPEEDS[mirror[0] % len(MIRROR_SPEEDS)]
+        mirror[0] += 1
+        return speed
+
+    # each slot is None (idle) or a [chunk, speed]-list
+    slots = [None] * SLOTS
+    slots[0] = [download.chunks[0], next_speed()]
+    download._new_chunk()
+    jobs = 0
+
+    while True:
+        for i in range(SLOTS):
+            if slots[i] is None and not download.chunk_queue.empty():
+                slots[i] = [download.chunk_queue.get_nowait(), next_speed()]
+                jobs += 1
+                download._new_chunk()
+
+        finished = False
+        for i in range(SLOTS):
+            if slots[i] is None:
+                continue
+            chunk, speed = slots[i]
+            bytes = min(long(speed * STEP), chunk.bytes_left(True))
+            chunk.loaded += bytes
+            if chunk.is_finished(True):
+                slots[i] = None
+                download._coalesce_chunks()
+                if download._unfinished_chunks_count() == 0:
+                    finished = True
+                    break
+                download._new_chunk()
+
+        clock.now += STEP
+        if finished:
+            return (clock.now, jobs)
+
+
+def main():
+    print('file size: {0} MB, slots: {1}, mirror speeds (KB/s): {2}'.format(
+            FILESIZE / MB, SLOTS, ', '.join(str(s / 1024)
+                                            for s in MIRROR_SPEEDS)))
+    for strategy_class in split_strategies:
+        seconds, jobs = simulate(strategy_class)
+        print('{0:<14} {1:>9.1f} s {2:>6} chunk-jobs'.format(
+                                        strategy_class.name, seconds, jobs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Measure the startup time and memory of the daemon and the GTK user
+interface.
+
+Each mode is run in a new process several times:
+- daemon -- python src/mkdlm.py --daemon with a temporary home folder
+            holding the given number of saved (paused) downloads. The
+            startup time is the time until the control API answers.
+            The RSS is read from /proc at that moment. Then the daemon
+            is asked to quit, which saves the downloads.
+- daemon_import -- python imports the modules of the daemon and exits
+- gui_import -- python imports the modules of the user interface (GTK,
+                cairo, the main window) and exits. The window is not
+                shown, so no display is needed. This is a lower bound
+                of the startup of the user interface.
+
+Reported per mode:
+- startup_p50, startup_max -- the seconds from starting the process to
+                              the control API answering (daemon) or to
+                              the imports being done
+- rss_kb -- the resident memory of the process in KiB (the maximum RSS
+            for the import modes)
+- shutdown_p50 -- the seconds from the quit request to the exit of the
+                  daemon
+A mode which cannot be run (e.g. PyGTK is not installed) reports its
+error.
+
+Usage (from the repository root):
+$ python bench/startup.py [--rounds N] [--downloads N] [--output FILE]
+                          [mode ...]
+"""
+
+from os.path import dirname, join, realpath
+import os
+import shutil
+import socket
+import subprocess
+import sys
+from tempfile import mkdtemp
+from time import sleep, time
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+from benchutil import write_report
+from bulk_add import create_dicts
+from control import ControlClient
+
+_src = join(dirname(dirname(realpath(__file__))), 'src')
+
+_import_script = '''
+import resource, sys
+sys.path.insert(0, {src!r})
+import {module}
+sys.stdout.write('%d\\n' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+_import_modules = {'daemon_import': 'daemon, control',
+                   'gui_import': 'gui.main_window'}
+
+
+def get_rss(pid):
+    """Returns the resident memory of the process in KiB."""
+    with open('/proc/{0}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return None
+
+
+def write_downloads(home, count):
+    """Write count paused downloads to the downloads file in home."""
+    # the settings folder is in the home folder
+    old_home = os.environ.get('HOME')
+    os.environ['HOME'] = home
+    try:
+        from globals import downloads_file
+        downloads_file.set('downloads', create_dicts(count))
+        downloads_file.save()
+    finally:
+        if old_home is not None:
+            os.environ['HOME'] = old_home
+
+
+def run_daemon(home):
+    """Start the daemon, wait for its control API and quit it.
+
+    Returns (startup time, RSS, shutdown time).
+    """
+    address = 'unix:' + join(home, 'control.sock')
+    client = ControlClient(address)
+    env = dict(os.environ, HOME=home)
+    start = time()
+    process = subprocess.Popen([sys.executable, join(_src, 'mkdlm.py'),
+                                '--daemon', '--control', address],
+                               env=env, stderr=open(os.devnull, 'w'))
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError('The daemon exited with {0}.'
+                                   .format(process.returncode))
+            try:
+                status, result = client.request('GET', '/status')
+                break
+            except socket.error:
+                sleep(0.005)
+        startup = time() - start
+        rss = get_rss(process.pid)
+
+        start = time()
+        client.request('POST', '/quit')
+        process.wait()
+        shutdown = time() - start
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return (startup, rss, shutdown)
+
+
+def run_import(mode):
+    """Import the modules of the mode in a new process.
+
+    Returns (time, maximum RSS).
+    """
+    script = _import_script.format(src=_src, module=_import_modules[mode])
+    start = time()
+    process = subprocess.Popen([sys.executable, '-c', script],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    elapsed = time() - start
+    if process.returncode != 0:
+        raise RuntimeError(err.strip().splitlines()[-1])
+    return (elapsed, int(out))
+
+
+def run_mode(mode, rounds, downloads):
+    result = {'mode': mode, 'rounds': rounds}
+    times = []
+    rss = []
+    shutdowns = []
+    try:
+        for i in range(rounds):
+            if mode == 'daemon':
+                home = mkdtemp(prefix='mkdlm-startup-')
+                try:
+                    write_downloads(home, downloads)
+                    startup, memory, shutdown = run_daemon(home)
+                finally:
+                    shutil.rmtree(home)
+                shutdowns.append(shutdown)
+                result['downloads'] = downloads
+            else:
+                startup, memory = run_import(mode)
+            times.append(startup)
+            rss.append(memory)
+    except RuntimeError, e:
+        result['error'] = str(e)
+        return result
+    times.sort()
+    result['startup_p50'] = times[len(times) // 2]
+    result['startup_max'] = times[-1]
+    result['rss_kb'] = max(rss)
+    if shutdowns:
+        shutdowns.sort()
+        result['shutdown_p50'] = shutdowns[len(shutdowns) // 2]
+    return result
+
+
+def main():
+    args = sys.argv[1:]
+    options = {'--rounds': 5, '--downloads': 100, '--output': None}
+    for option in options:
+        if option in args:
+            i = args.index(option)
+            value = args[i + 1]
+            options[option] = value if option == '--output' else int(value)
+            del args[i:i + 2]
+    modes = args or ['daemon', 'daemon_import', 'gui_import']
+
+    results = []
+    for mode in modes:
+        sys.stderr.write(mode + '... ')
+        result = run_mode(mode, options['--rounds'], options['--downloads'])
+        if 'error' in result:
+            sys.stderr.write('failed: {0}\n'.format(result['error']))
+        else:
+            sys.stderr.write('{0:.3f} s, {1} KiB\n'.format(
+                                    result['startup_p50'], result['rss_kb']))
+        results.append(result)
+    write_report(results, options['--output'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Measure the overhead of the slot tracer (see dlm.tracer).
+
+A file is served by a local HTTP server and downloaded several times
+with tracing disabled and enabled. The CPU time of the process is
+compared, because the wall time is dominated by the network and the
+teardown of the connections.
+
+Usage (from the repository root):
+$ python bench/tracer_overhead.py [file size in MB] [rounds]
+"""
+
+from BaseHTTPServer import HTTPServer
+from os.path import dirname, join, realpath
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+import os
+import shutil
+import sys
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import clock
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+from dlm.download import Download, DownloadState
+from dlm.source import Source
+from dlm.tracer import tracer
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def download_once(url, folder):
+    """Download url into folder and return the CPU time."""
+    done = Event()
+
+    def on_status_changed(download):
+        if download.state in (DownloadState.finished, DownloadState.failed):
+            done.set()
+
+    download = Download(1, Source(url, 0, 0, 0), folder)
+    download.status_changed_event.add_listener(on_status_changed)
+    start = clock()
+    download.start()
+    done.wait()
+    cpu_time = clock() - start
+    if download.state != DownloadState.finished:
+        raise RuntimeError('The download failed.')
+    os.remove(join(folder, download.filename))
+    return cpu_time
+
+
+def main():
+    size = 64
+    rounds = 5
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+
+    served = mkdtemp()
+    target = mkdtemp()
+    with open(join(served, 'file.bin'), 'wb') as f:
+        f.write(os.urandom(1024 * 1024) * size)
+    os.chdir(served)
+    server = HTTPServer(('127.0.0.1', 0), _QuietHandler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:{0}/file.bin'.format(server.server_address[1])
+
+    disabled = []
+    enabled = []
+    spans = 0
+    for i in range(rounds):
+        tracer.stop()
+        disabled.append(download_once(url, target))
+        tracer.start()
+        enabled.append(download_once(url, target))
+        spans = tracer.get_span_count()
+    tracer.stop()
+
+    server.shutdown()
+    shutil.rmtree(served)
+    shutil.rmtree(target)
+
+    best_disabled = min(disabled)
+    best_enabled = min(enabled)
+    print('file size:       {0} MB, {1} rounds'.format(size, rounds))
+    print('tracing off:     {0:.3f} s CPU (best)'.format(best_disabled))
+    print('tracing on:      {0:.3f} s CPU (best), {1} spans'.format(
+                                                    best_enabled, spans))
+    print('overhead:        {0:+.2f} %'.format(
+                        (best_enabled / best_disabled - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
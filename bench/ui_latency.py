@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Measure how quickly the download list follows the changes of many
+loading downloads.
+
+A producer thread changes the rows of a download store like the one of
+the main window at a fixed rate (like the DownloadMeter and the state
+events of thousands of active downloads). The changes are applied in
+two ways:
+- per_event -- every change schedules its own idle callback, which
+               looks for the row by iterating the store (the old way of
+               the main window)
+- batched -- the changes are collected by a gui.batchupdater.BatchUpdater
+             and applied once per frame to rows found by an index
+
+Reported per mode:
+- events, applied -- the number of changes and of applied row updates
+- latency_p50, latency_p90, latency_max -- the seconds from a change to
+                                           the update of its row
+- probe_p50, probe_p99, probe_max -- how late a timer of the main loop
+                                     which should run every 10 ms is
+                                     called. This is the delay the user
+                                     feels, e.g. when clicking.
+- cpu_time -- the CPU seconds of the process
+
+PyGTK and a display are needed, e.g. use xvfb-run on a server.
+
+Usage (from the repository root):
+$ python bench/ui_latency.py [--rows N] [--rate EVENTS] [--seconds S]
+                             [--output FILE] [mode ...]
+"""
+
+import os
+from os.path import dirname, join, realpath
+import sys
+from threading import Lock, Thread
+from time import sleep, time
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+import pygtk
+pygtk.require('2.0')
+import gobject
+import gtk
+
+from benchutil import write_report
+from gui.batchupdater import BatchUpdater
+
+PROBE_INTERVAL = 0.01
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def _create_view(rows):
+    """Returns a window with a view of a store like the download store
+    of the main window, the store and the keys of the rows.
+    """
+    store = gtk.ListStore(object, str, long, object, int, int, int, int,
+                          int, int, int, int)
+    keys = [object() for i in range(rows)]
+    for i, key in enumerate(keys):
+        store.append([key, 'file{0}.bin'.format(i), 0L, 100 * 1024 * 1024,
+                      0, 2, 0, 5, 1, 4, 0, 0])
+    view = gtk.TreeView(store)
+    for column, title in ((1, 'Filename'), (2, 'Loaded'), (10, 'Speed')):
+        cell = gtk.CellRendererText()
+        view.append_column(gtk.TreeViewColumn(title, cell, text=column))
+    scrolled = gtk.ScrolledWindow()
+    scrolled.add(view)
+    window = gtk.Window()
+    window.set_default_size(800, 600)
+    window.add(scrolled)
+    window.show_all()
+    return window, store, keys
+
+
+def run_mode(mode, rows, rate, seconds):
+    window, store, keys = _create_view(rows)
+    latencies = []
+    probes = []
+    lock = Lock()
+    # key --> the time of the first change which was not applied yet. It
+    # is passed with the changes as column 'posted'.
+    posted = {}
+    done = [False]
+
+    def apply_per_event(key, bytes, speed, posted_time):
+        for row in store:
+            if row[0] is key:
+                row[2] = bytes
+                row[10] = speed
+                break
+        latencies.append(time() - posted_time)
+        return False
+
+    iters = dict((row[0], row.iter) for row in store)
+
+    def apply_batch(changes):
+        now = time()
+        for key, columns in changes.iteritems():
+            posted_time = columns.pop('posted')
+            values = []
+            for column, value in columns.iteritems():
+                values.append(column)
+                values.append(value)
+            store.set(iters[key], *values)
+            latencies.append(now - posted_time)
+            with lock:
+                if posted.get(key) == posted_time:
+                    del posted[key]
+
+    updater = BatchUpdater(apply_batch)
+
+    def post(key, bytes, speed):
+        if mode == 'per_event':
+            gobject.idle_add(apply_per_event, key, bytes, speed, time())
+        else:
+            with lock:
+                posted_time = posted.setdefault(key, time())
+            updater.update(key, {2: bytes, 10: speed, 'posted': posted_time})
+
+    def produce():
+        # post the changes in steps of 10 ms
+        per_step = max(int(rate * 0.01), 1)
+        events = 0
+        start = time()
+        while time() - start < seconds:
+            for i in range(per_step):
+                key = keys[events % rows]
+                post(key, long(events), events % 1000)
+                events += 1
+            sleep(0.01)
+        done[0] = events
+
+    def probe(expected):
+        now = time()
+        probes.append(max(now - expected, 0))
+        if done[0] is not False and (mode == 'batched' and not posted or
+                mode == 'per_event' and len(latencies) >= done[0]):
+            gtk.main_quit()
+            return False
+        gobject.timeout_add(int(PROBE_INTERVAL * 1000), probe,
+                            now + PROBE_INTERVAL)
+        return False
+
+    cpu_start = sum(os.times()[:2])
+    producer = Thread(target=produce)
+    producer.start()
+    gobject.timeout_add(int(PROBE_INTERVAL * 1000), probe,
+                        time() + PROBE_INTERVAL)
+    gtk.main()
+    producer.join()
+    cpu_time = sum(os.times()[:2]) - cpu_start
+    window.destroy()
+
+    return {
+        'name': '{0}[rows={1},rate={2}]'.format(mode, rows, rate),
+        'events': done[0],
+        'applied': len(latencies),
+        'latency_p50': _percentile(latencies, 0.5),
+        'latency_p90': _percentile(latencies, 0.9),
+        'latency_max': max(latencies) if latencies else None,
+        'probe_p50': _percentile(probes, 0.5),
+        'probe_p99': _percentile(probes, 0.99),
+        'probe_max': max(probes) if probes else None,
+        'cpu_time': cpu_time
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    options = {'--rows': 2000, '--rate': 4000, '--seconds': 10,
+               '--output': None}
+    for option in options:
+        if option in args:
+            i = args.index(option)
+            value = args[i + 1]
+            options[option] = value if option == '--output' else int(value)
+            del args[i:i + 2]
+    modes = args or ['per_event', 'batched']
+
+    gobject.threads_init()
+    results = []
+    for mode in modes:
+        sys.stderr.write(mode + '... ')
+        result = run_mode(mode, options['--rows'], options['--rate'],
+                          options['--seconds'])
+        sys.stderr.write('latency p90 {0:.3f} s, probe p99 {1:.3f} s\n'.format(
+                                result['latency_p90'], result['probe_p99']))
+        results.append(result)
+    write_report(results, options['--output'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Measure the churn of many short downloads.
+
+Downloads which do not use the network are started and stopped. Each
+stop runs a clean-up task and each start of a resumed download runs
+DataSlot tasks (which exit at once, because the download is paused
+again). The run time and the statistics of the worker pools are
+printed, including the number of threads created.
+
+Usage (from the repository root):
+$ python bench/worker_pool.py [number of start/stop cycles]
+"""
+
+from os.path import dirname, join, realpath
+import sys
+from tempfile import mkdtemp
+from threading import Event
+from time import sleep, time
+
+sys.path.insert(0, join(dirname(dirname(realpath(__file__))), 'src'))
+
+from dlm.chunk import Chunk
+from dlm.download import Download, DownloadState
+from dlm.source import Source
+from dlm.workerpool import slot_pool, clean_up_pool
+
+SLOTS = 4
+
+
+def main():
+    cycles = 200
+    if len(sys.argv) > 1:
+        cycles = int(sys.argv[1])
+
+    folder = mkdtemp()
+    # nothing listens on the discard port, so a slot which connects
+    # before the download is paused fails at once
+    source = Source('http://127.0.0.1:9/file', 0, -1, 0)
+    source.filesize = 1024
+    download = Download(SLOTS, source, folder)
+    download.filesize = 1024
+    download._infos_fetched = True
+    download.chunks = [Chunk(None, 0, 1024)]
+    open(join(folder, download.filename + '.dl'), 'wb').close()
+
+    paused = Event()
+
+    def on_status_changed(download):
+        if download.state == DownloadState.paused:
+            paused.set()
+    download.status_changed_event.add_listener(on_status_changed)
+
+    start = time()
+    for i in range(cycles):
+        paused.clear()
+        download.start()
+        download.pause()
+        # wait for the clean-up
+        paused.wait()
+        download.ready()
+    run_time = time() - start
+
+    # let the workers finish before the interpreter shuts down
+    for pool in (slot_pool, clean_up_pool):
+        while pool.get_stats()['busy'] > 0:
+            sleep(0.01)
+
+    print('cycles:          {0}'.format(cycles))
+    print('run time:        {0:.3f} s ({1:.1f} us per cycle)'.format(
+                                    run_time, run_time / cycles * 1e6))
+    for pool in (slot_pool, clean_up_pool):
+        stats = pool.get_stats()
+        print('{0:<16} created threads: {1}, tasks: {2}, cancelled: {3}, '
+              'max queued: {4}'.format(stats['name'] + ':', stats['created'],
+                                       stats['submitted'], stats['cancelled'],
+                                       stats['max_queued']))
+
+
+if __name__ == '__main__':
+    main()
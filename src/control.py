@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The control-module contains the classes ControlServer and
+ControlClient.
+
+The ControlServer lets other programs control the downloads of a
+Manager through a local HTTP API with JSON bodies, e.g. the daemon (see
+daemon.py) is controlled with mkdlmctl.py. The ControlClient sends the
+requests.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from httplib import HTTPConnection
+from threading import Lock, Thread
+import json
+import os
+import socket
+
+import core
+from dlm.localserver import create_server, state_names
+from event.eventlistener import EventListener
+
+
+class ControlError(Exception):
+    """Raised if a request cannot be handled. status is the HTTP status
+    code of the response.
+    """
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        try:
+            # Web pages may send requests to local addresses. Browsers
+            # add an Origin header to them and cannot send JSON without
+            # asking first (CORS preflight), which is never allowed.
+            if self.headers.get('Origin') is not None:
+                raise ControlError(403, 'Requests of web pages are not '
+                                        'allowed.')
+            content_type = self.headers.get('Content-Type') or ''
+            if (method == 'POST' and
+                    content_type.split(';')[0].strip() != 'application/json'):
+                raise ControlError(415, 'The Content-Type must be '
+                                        'application/json.')
+            length = int(self.headers.get('Content-Length') or 0)
+            body = None
+            if length > 0:
+                try:
+                    body = json.loads(self.rfile.read(length))
+                except ValueError:
+                    raise ControlError(400, 'The body is not valid JSON.')
+            status, result = self.server.control_server.handle(method,
+                                                               self.path, body)
+        except ControlError, e:
+            status, result = e.status, {'error': str(e)}
+        data = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ControlServer:
+    """The ControlServer answers the requests of the control API.
+
+    The downloads get an id when they are listed or added. The ids do
+    not change while the server is running, but they are not saved.
+
+    GET /status -- the number of downloads in each state, the speed and
+                   the number of parallel downloads
+    GET /downloads -- a list of all downloads
+    GET /downloads/<id> -- one download
+    GET /downloads/<id>/log?start=<index>&count=<n> -- messages of the
+                   log of the download (see dlm.log.Log.get_messages).
+                   By default the last 100 messages are returned.
+    POST /downloads -- add a download. The body is an object with the
+                   url and optional target_folder, slots, priority and
+                   paused (see core.create_download).
+    POST /downloads/<id>/start, pause, cancel or remove
+    POST /downloads/<id>/priority -- the body is {"priority": <n>}
+    POST /parallel_downloads -- the body is {"value": <n>}
+    POST /quit -- signals quit_event
+
+    The server is bound to a TCP address ('host:port') or to a unix
+    socket ('unix:/path'). There is no authentication, so a unix socket
+    or a TCP address which is only reachable from localhost should be
+    used. Requests with an Origin header (sent by browsers) are
+    rejected and POST requests must have the Content-Type
+    application/json, so web pages cannot use the API.
+
+    Public instance variables:
+    address -- the address of the server
+
+    downloads_changed_event -- An event.eventlistener.EventListener
+                               object. The event is signalled when a
+                               download was added or removed. The
+                               listener is called without parameters.
+    quit_event -- An event.eventlistener.EventListener object. The event
+                  is signalled when a client asks to quit. The listener
+                  is called without parameters.
+    """
+
+    def __init__(self, manager, address):
+        """Initialize the ControlServer.
+
+        manager -- the Manager whose downloads are controlled
+        address -- 'host:port' or 'unix:/path/to/socket'
+        """
+        self.downloads_changed_event = EventListener()
+        self.quit_event = EventListener()
+
+        self._manager = manager
+        self.address = address
+        # download <--> id
+        self._ids = {}
+        self._downloads = {}
+        self._next_id = 1
+        self._ids_lock = Lock()
+        self._server, self._unix_path = create_server(address,
+                                                      _RequestHandler)
+        self._server.control_server = self
+        self._thread = Thread(target=self._server.serve_forever,
+                              name='Control Server')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._unix_path is not None and os.path.exists(self._unix_path):
+            os.remove(self._unix_path)
+
+    def handle(self, method, path, body):
+        """Handle a request and return a (status, result)-tuple. result
+        is converted to JSON.
+
+        Raises ControlError if the request is invalid.
+        """
+        path, sep, query = path.partition('?')
+        parts = [part for part in path.split('/') if part]
+        if method == 'GET' and parts == ['status']:
+            return (200, self._get_status())
+        elif method == 'GET' and parts == ['downloads']:
+            return (200, [self._get_download_info(download) for download
+                          in self._manager.get_download_list_copy()])
+        elif method == 'POST' and parts == ['downloads']:
+            return (201, self._get_download_info(self._add_download(body)))
+        elif method == 'POST' and parts == ['parallel_downloads']:
+            self._manager.set_max_parallel_downloads(
+                                        self._get_int(body, 'value', 1))
+            return (200, self._get_status())
+        elif method == 'POST' and parts == ['quit']:
+            self.quit_event.signal()
+            return (200, {})
+        elif len(parts) >= 2 and parts[0] == 'downloads':
+            download = self._get_download(parts[1])
+            if method == 'GET' and len(parts) == 2:
+                return (200, self._get_download_info(download))
+            elif method == 'GET' and parts[2:] == ['log']:
+                return (200, self._get_log(download, query))
+            elif method == 'POST' and len(parts) == 3:
+                return self._change_download(download, parts[2], body)
+        raise ControlError(404, 'Unknown request: {0} {1}'.format(method,
+                                                                  path))
+
+    def _get_status(self):
+        states = dict((name, 0) for name in state_names.values())
+        for download in self._manager.get_download_list_copy():
+            state = state_names.get(download.state, str(download.state))
+            states[state] = states.get(state, 0) + 1
+        snapshot = self._manager.download_meter.last_snapshot
+        return {'downloads': states,
+                'speed': snapshot.speed if snapshot is not None else 0,
+                'parallel_downloads': self._manager.max_parallel_downloads}
+
+    def _get_id(self, download):
+        with self._ids_lock:
+            id = self._ids.get(download)
+            if id is None:
+                id = self._next_id
+                self._next_id += 1
+                self._ids[download] = id
+                self._downloads[id] = download
+            return id
+
+    def _get_download(self, id):
+        try:
+            id = int(id)
+        except ValueError:
+            raise ControlError(404, 'Unknown download: ' + id)
+        with self._ids_lock:
+            download = self._downloads.get(id)
+        if (download is None or
+                download not in self._manager.get_download_list_copy()):
+            raise ControlError(404, 'Unknown download: {0}'.format(id))
+        return download
+
+    def _get_download_info(self, download):
+        snapshot = self._manager.download_meter.last_snapshot
+        if snapshot is not None and download in snapshot.downloads:
+            loaded, speed = snapshot.downloads[download]
+        else:
+            loaded, speed = download.get_bytes_loaded(), 0
+        sources = download.get_copy_of_sources()
+        return {'id': self._get_id(download),
+                'filename': download.filename,
+                'url': sources[0].original_url if sources else None,
+                'target_folder': download.target_folder,
+                'state': state_names.get(download.state,
+                                          str(download.state)),
+                'loaded': loaded,
+                'size': download.filesize,
+                'speed': speed,
+                'priority': download.priority,
+                'slots': download.active_slot,
+                'max_slots': download.max_slot,
+                'retries': download.get_retries()}
+
+    def _get_log(self, download, query):
+        options = dict(option.partition('=')[::2]
+                       for option in query.split('&') if option)
+        try:
+            count = int(options.get('count', 100))
+            if 'start' in options:
+                start = int(options['start'])
+            else:
+                start = download.log.get_message_count() - count
+        except ValueError:
+            raise ControlError(400, 'start and count must be numbers.')
+        return [{'type': type, 'time': str(time), 'name': name,
+                 'message': message} for (type, time, name, message)
+                in download.log.get_messages(start, count)]
+
+    def _get_int(self, body, name, default=None):
+        if not isinstance(body, dict):
+            body = {}
+        value = body.get(name, default)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ControlError(400, '{0} must be a number.'.format(name))
+
+    def _add_download(self, body):
+        if not isinstance(body, dict) or not body.get('url'):
+            raise ControlError(400, 'The url of the download is missing.')
+        slots = None
+        if body.get('slots') is not None:
+            slots = self._get_int(body, 'slots')
+        download = core.create_download(body['url'],
+                                        body.get('target_folder'), slots,
+                                        self._get_int(body, 'priority', 0))
+        if body.get('paused', False):
+            download.pause()
+        self._manager.add_download(download)
+        self.downloads_changed_event.signal()
+        return download
+
+    def _change_download(self, download, action, body):
+        if action == 'start':
+            download.ready()
+        elif action == 'pause':
+            download.pause()
+        elif action == 'cancel':
+            download.cancel()
+        elif action == 'priority':
+            download.set_priority(self._get_int(body, 'priority'))
+        elif action == 'remove':
+            if not self._manager.remove_download(download):
+                raise ControlError(409, 'The download is running.')
+            with self._ids_lock:
+                del self._downloads[self._ids.pop(download)]
+            self.downloads_changed_event.signal()
+            return (200, {})
+        else:
+            raise ControlError(404, 'Unknown action: ' + action)
+        return (200, self._get_download_info(download))
+
+
+class _UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, path, timeout):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class ControlClient:
+    """The ControlClient sends requests to a ControlServer."""
+
+    def __init__(self, address, timeout=10):
+        """Initialize the ControlClient.
+
+        address -- the address of the server: 'host:port' or
+                   'unix:/path/to/socket'
+        timeout -- the timeout of a request in seconds
+        """
+        self.address = address
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        """Send a request and return a (status, result)-tuple.
+
+        Raises socket.error if the server cannot be reached.
+        """
+        if self.address.startswith('unix:'):
+            conn = _UnixHTTPConnection(self.address[len('unix:'):],
+                                       self.timeout)
+        else:
+            host, sep, port = self.address.rpartition(':')
+            conn = HTTPConnection(host or '127.0.0.1', int(port),
+                                  timeout=self.timeout)
+        try:
+            headers = {}
+            data = None
+            if method == 'POST':
+                data = json.dumps(body if body is not None else {})
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, data, headers)
+            response = conn.getresponse()
+            return (response.status, json.loads(response.read()))
+        finally:
+            conn.close()
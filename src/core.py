@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The core-module connects the Manager with the settings.
+
+It contains what the GTK user interface and the daemon (see daemon.py)
+share and does not import any GUI module:
+apply_settings: applies the core.* settings to a Manager
+create_retry_policy: creates the RetryPolicy of new sources
+create_download: creates a Download with the default settings of new
+                 downloads
+load_downloads: creates the downloads of the downloads file
+save_downloads: writes the downloads of a Manager to the downloads file
+save_trace: stops the tracer and saves its spans
+get_control_address: returns the address of the control API
+lock_downloads_file: makes sure only one process uses the downloads file
+"""
+
+from os import makedirs, path
+from os.path import expanduser
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+from dlm.download import Download
+from dlm.log import Log, MessageType
+from dlm.retrypolicy import RetryPolicy
+from dlm.source import Source
+from dlm.splitstrategy import create_split_strategy, default_split_strategy
+from dlm.tracer import tracer
+from dlm.workerpool import slot_pool, clean_up_pool
+from globals import settings, downloads_file
+
+
+def apply_settings(manager):
+    """Apply the core.* settings to the manager.
+
+    The settings are applied to the logs, the worker pools, the
+    DownloadMeter and the tracer as well. The metrics server is started
+    last.
+
+    Raises socket.error or ValueError if the metrics server cannot be
+    started.
+    """
+    manager.set_preemption(settings.get('core.manager.preemption', False))
+
+    budget = manager.connection_budget
+    budget.set_weighted(settings.get('core.manager.weighted_connections',
+                                     False))
+    budget.set_limit(settings.get_int('core.manager.max_connections', 0))
+    manager.host_limits.set_limit_string(
+                            settings.get('core.manager.host_limits', ''))
+
+    prefetcher = manager.info_prefetcher
+    prefetcher.count = settings.get_int('core.manager.prefetch_downloads', 2)
+    prefetcher.max_age = settings.get_int('core.manager.prefetch_max_age',
+                                          300)
+
+    slot_pool.set_size(settings.get_int('core.workers.slots', 0))
+    clean_up_pool.set_size(settings.get_int('core.workers.clean_up', 16))
+
+    levels = {'debug': MessageType.debug, 'info': MessageType.info,
+              'warning': MessageType.warning, 'error': MessageType.error}
+    Log.set_threshold(levels.get(settings.get('core.log.level', 'info'),
+                                 MessageType.info))
+    Log.repeat_window = settings.get_float('core.log.repeat_window', 10)
+    Log.default_capacity = settings.get_int('core.log.max_entries', 1000)
+    if settings.get('core.log.spill', False):
+        Log.spill_folder = expanduser(settings.get('core.log.spill_folder',
+                                                   '~/.mkdlm/logs'))
+    else:
+        Log.spill_folder = None
+    for download in manager.get_download_list_copy():
+        download.log.set_capacity(Log.default_capacity)
+
+    meter = manager.download_meter
+    meter.set_interval(settings.get_float('core.meter.interval', 1))
+    meter.smoothing = settings.get_float('core.meter.smoothing', 3)
+
+    if settings.get('core.trace.enabled', False):
+        if not tracer.enabled:
+            tracer.start()
+    else:
+        tracer.stop()
+
+    if settings.get('core.metrics.enabled', False):
+        address = settings.get('core.metrics.address', '127.0.0.1:9464')
+    else:
+        address = None
+    manager.set_metrics_address(address)
+
+
+def create_retry_policy():
+    """Returns a RetryPolicy with the settings of new sources. The wait
+    time grows with each error in a row.
+    """
+    return RetryPolicy(
+            settings.get_float('core.new_source.retry_factor', 2),
+            settings.get_float('core.new_source.max_wait', 300),
+            settings.get('core.new_source.retry_jitter', True))
+
+
+def create_download(url, target_folder=None, slots=None, priority=0):
+    """Create a Download of url with the defaults of new downloads and
+    sources (core.new_download.* and core.new_source.*).
+
+    The download is not added to a Manager.
+
+    url -- the url of the first Source
+    target_folder -- the folder of the file or None to use the default
+                     folder (the home folder if there is none)
+    slots -- the maximum number of slots or None to use the default
+    priority -- the priority of the download
+    """
+    source = Source(url=url,
+                    max_redirects=settings.get_int('core.new_source.redirects',
+                                                   3),
+                    max_retries=settings.get_int('core.new_source.retries', 5),
+                    wait_time=settings.get_float('core.new_source.wait', 10))
+    source.timeout = settings.get_float('core.new_source.timeout', 5)
+    source.user_agent = settings.get('core.new_source.user_agent',
+                        'Mozilla/5.0 (X11; U; Linux i686; de; rv:1.9.2.13) ' +
+                        'Gecko/20101203 Firefox/3.6.13')
+    source.retry_policy = create_retry_policy()
+
+    if target_folder is None:
+        target_folder = settings.get('core.new_download.target_folder',
+                                     expanduser('~'))
+    if slots is None:
+        slots = settings.get_int('core.new_download.slots', 3)
+    download = Download(slots, source, target_folder)
+    download.chunk_size = settings.get_int('core.new_download.chunksize',
+                                           2097152)
+    download.split_strategy = create_split_strategy(
+                    settings.get('core.new_download.split_strategy',
+                                 default_split_strategy))
+    download.set_priority(priority)
+    return download
+
+
+def load_downloads(manager):
+    """Returns the downloads of the downloads file.
+
+    The downloads are not added to the manager yet, so listeners can be
+    added before they start.
+    """
+    return manager.create_downloads_from_list(
+                                    downloads_file.get('downloads', []))
+
+
+def save_downloads(manager):
+    """Write the downloads of the manager to the downloads file."""
+    downloads_file.set('downloads', manager.get_downloads_as_list())
+    downloads_file.save()
+
+
+def save_trace():
+    """Stop the tracer and save the spans of the slots (see dlm.tracer)
+    to core.trace.file if there are any.
+    """
+    tracer.stop()
+    if tracer.get_span_count() > 0:
+        tracer.save(expanduser(settings.get('core.trace.file',
+                                            '~/mkdlm-trace.json')))
+
+
+def get_control_address():
+    """Returns the address of the control API of the daemon (see
+    control.ControlServer) from core.control.address. By default it is
+    a unix socket in the settings folder.
+    """
+    address = settings.get('core.control.address',
+                           'unix:~/.mkdlm/control.sock')
+    if address.startswith('unix:'):
+        address = 'unix:' + expanduser(address[len('unix:'):])
+    return address
+
+
+# the open lock file of this process (see lock_downloads_file)
+_lock_file = None
+
+
+def lock_downloads_file():
+    """Take the lock of the downloads file for this process.
+
+    The user interface and the daemon both load the downloads at start
+    and save them later, so only one of them may run. The lock is held
+    until the process exits.
+
+    Returns False if another process holds the lock, otherwise True.
+    Without fcntl (on Windows) True is returned.
+    """
+    global _lock_file
+    if fcntl is None or _lock_file is not None:
+        return True
+    folder = expanduser('~/.mkdlm')
+    if not path.exists(folder):
+        makedirs(folder)
+    lock_file = open(path.join(folder, 'lock'), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The daemon-module contains the Daemon-class.
+
+The Daemon runs the downloads without a user interface, e.g. on a
+server. It does not import GTK. It is started with
+$ python mkdlm.py --daemon [--control ADDRESS]
+and controlled through the control API (see control.ControlServer and
+mkdlmctl.py).
+"""
+
+from os import makedirs, path
+from threading import Event
+import signal
+import socket
+import sys
+
+import core
+from control import ControlServer
+from dlm.manager import Manager
+from globals import settings, downloads_file
+
+
+class Daemon:
+    """The Daemon loads the saved downloads, serves the control API and
+    saves the downloads when they are added or removed, every
+    core.daemon.save_interval seconds (so the progress survives a crash)
+    and when it quits.
+
+    It quits on SIGINT, SIGTERM or a quit request of the control API.
+    It does not start if the user interface or another daemon uses the
+    downloads file (see core.lock_downloads_file).
+    """
+
+    def __init__(self, address=None):
+        """Initialize the Daemon.
+
+        address -- the address of the control API or None to use
+                   core.control.address (see core.get_control_address)
+        """
+        self._address = address
+        self._wake_up = Event()
+        self._quitting = False
+
+    def start(self):
+        """Run the daemon until it is asked to quit.
+
+        Returns the exit status: 0 or 1 if the daemon could not start.
+        """
+        if not core.lock_downloads_file():
+            sys.stderr.write('mkdlm is already running. It may be the '
+                             'user interface or another daemon.\n')
+            return 1
+        manager = Manager()
+        settings.load()
+        downloads_file.load()
+
+        manager.set_max_parallel_downloads(
+                    settings.get_int('core.manager.parallel_downloads', 1))
+        try:
+            core.apply_settings(manager)
+        except (socket.error, ValueError), e:
+            sys.stderr.write('Could not start the metrics server: {0}\n'
+                             .format(e))
+
+        address = self._address or core.get_control_address()
+        if address.startswith('unix:'):
+            folder = path.dirname(address[len('unix:'):])
+            if folder and not path.exists(folder):
+                makedirs(folder)
+        try:
+            control = ControlServer(manager, address)
+        except (socket.error, ValueError), e:
+            sys.stderr.write('Could not start the control server: {0}\n'
+                             .format(e))
+            manager.quit()
+            return 1
+        control.downloads_changed_event.add_listener(self._wake_up.set)
+        control.quit_event.add_listener(self.quit)
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+
+        manager.add_downloads(core.load_downloads(manager))
+        control.start()
+        sys.stderr.write('mkdlm daemon listening on {0}\n'.format(address))
+
+        save_interval = settings.get_float('core.daemon.save_interval', 60)
+        while not self._quitting:
+            # Event.wait with a timeout, so the signals are handled
+            self._wake_up.wait(save_interval)
+            self._wake_up.clear()
+            core.save_downloads(manager)
+
+        control.stop()
+        manager.quit()
+        core.save_trace()
+        core.save_downloads(manager)
+        return 0
+
+    def quit(self):
+        """Ask the daemon to quit. The downloads are paused and saved."""
+        self._quitting = True
+        self._wake_up.set()
+
+    def _on_signal(self, signum, frame):
+        self.quit()
@@ -16,11 +16,26 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
-"""This module contains the Chunk-class.
+"""This module contains the classes Chunk and ChunkState.
 
 The Chunk-class represents a part of a download-file.
 """
 
+
+class ChunkState:
+    """Used to describe the loaded bytes of a chunk (see
+    Chunk.get_state).
+
+    active -- the chunk is not finished yet
+    stolen -- the chunk was split off another chunk and is finished
+    finished -- the chunk is finished
+    """
+
+    active = 0
+    stolen = 1
+    finished = 2
+
+
 class Chunk:
     """A chunk is a part of a download-file.
 
@@ -54,6 +69,50 @@ class Chunk:
         chunk.childs = childs
         return chunk
 
+    @staticmethod
+    def create_merged(first, second):
+        """Create a new finished chunk covering the two adjacent finished
+        chunks first and second.
+
+        The new chunk takes the place of first in the chunk tree. The
+        childs of both chunks become childs of the new chunk and second
+        is removed from the childs of its parent.
+        Note: first and second themselves are not modified, so a slot
+        which still holds one of them is not affected.
+
+        first -- the chunk with the lower offset
+        second -- the chunk starting at first.offset + first.length
+        """
+        length = first.length + second.length
+        chunk = Chunk(first.parent, first.offset, length)
+        chunk.loaded = length
+
+        if second.parent is not None:
+            second.parent.childs.remove(second)
+        if first.parent is not None:
+            siblings = first.parent.childs
+            siblings[siblings.index(first)] = chunk
+
+        for child in first.childs + second.childs:
+            if child is not second:
+                child.parent = chunk
+                chunk.childs.append(child)
+        return chunk
+
+    def remove_from_tree(self):
+        """Remove the chunk from the chunk tree.
+
+        The childs of the chunk become childs of its parent. This is used
+        to drop chunks which do not contain any bytes (length == 0).
+        """
+        if self.parent is None:
+            return
+        self.parent.childs.remove(self)
+        for child in self.childs:
+            child.parent = self.parent
+            self.parent.childs.append(child)
+        self.childs = []
+
     def get_as_dict(self):
         childs = []
         for child in self.childs:
@@ -99,3 +158,12 @@ class Chunk:
             return self.length
         else:
             return self.loaded
+
+    def get_state(self, slots_supported):
+        """Returns the ChunkState of the loaded bytes of the chunk."""
+        if not self.is_finished(slots_supported):
+            return ChunkState.active
+        elif self.parent is not None:
+            return ChunkState.stolen
+        else:
+            return ChunkState.finished
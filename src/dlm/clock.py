@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The clock-module contains the function monotonic.
+
+monotonic returns the time in seconds of a clock which never goes back,
+even if the system time is changed. It should be used to measure time
+spans, e.g. speeds. Only differences of its values are meaningful.
+"""
+
+import ctypes
+import ctypes.util
+from threading import Lock
+import time
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _get_clock_gettime():
+    """Returns a function calling clock_gettime(CLOCK_MONOTONIC) or None
+    if the C library does not provide it.
+    """
+    for name in ('rt', 'c'):
+        path = ctypes.util.find_library(name)
+        if path is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+
+        def monotonic():
+            t = _Timespec()
+            # 1 is CLOCK_MONOTONIC on Linux
+            if clock_gettime(1, ctypes.byref(t)) != 0:
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        try:
+            monotonic()
+        except OSError:
+            continue
+        return monotonic
+    return None
+
+
+def _clamped_time():
+    """Returns time.time(), but never a smaller value than before.
+
+    This is used if there is no monotonic clock. If the system time is
+    set back, the clock stands still until it has caught up.
+    """
+    with _last_lock:
+        now = time.time()
+        if now > _last[0]:
+            _last[0] = now
+        return _last[0]
+
+
+_last = [0.0]
+_last_lock = Lock()
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    monotonic = _get_clock_gettime() or _clamped_time
@@ -23,12 +23,13 @@ a server specified by the url in a Source-object.
 """
 
 from urllib2 import HTTPRedirectHandler, HTTPError, URLError, Request, \
-                    build_opener, FTPHandler, HTTPCookieProcessor
+                    build_opener, FTPHandler, HTTPCookieProcessor, HTTPHandler
 from urlparse import urlparse
 from urllib import splitport, splituser, splitpasswd, splitattr, unquote, \
                     addclosehook, addinfourl
 import urllib
 import ftplib
+import httplib
 import socket
 import sys
 import mimetypes
@@ -39,7 +40,14 @@ try:
 except ImportError:
     from StringIO import StringIO
 
+from clock import monotonic
+from counter import Counter
 from event.eventlistener import EventListener
+from tracer import tracer
+
+
+# the number of bytes received by all connections
+bytes_received = Counter()
 
 
 class _LimitedHTTPRedirectHandler(HTTPRedirectHandler):
@@ -64,13 +72,86 @@ class _LimitedHTTPRedirectHandler(HTTPRedirectHandler):
 
 
 
+class _TracedHTTPConnection(httplib.HTTPConnection):
+    """A HTTPConnection which records the DNS lookup and connecting as
+    spans of tracer.tracer.
+    """
+
+    trace_args = None
+    connected = None
+
+    def connect(self):
+        # like socket.create_connection, but the DNS lookup is timed
+        # separately
+        start = monotonic()
+        infos = socket.getaddrinfo(self.host, self.port, 0,
+                                   socket.SOCK_STREAM)
+        resolved = monotonic()
+        tracer.add_span('dns', start, resolved, self.trace_args)
+        error = socket.error('getaddrinfo returns an empty list')
+        for af, socktype, proto, canonname, address in infos:
+            sock = None
+            try:
+                sock = socket.socket(af, socktype, proto)
+                if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(self.timeout)
+                if self.source_address:
+                    sock.bind(self.source_address)
+                sock.connect(address)
+                break
+            except socket.error, e:
+                error = e
+                if sock is not None:
+                    sock.close()
+                    sock = None
+        if sock is None:
+            raise error
+        self.sock = sock
+        self.connected = monotonic()
+        tracer.add_span('connect', resolved, self.connected, self.trace_args)
+        if self._tunnel_host:
+            self._tunnel()
+
+
+class _TracedHTTPHandler(HTTPHandler):
+    """This HTTPHandler is used instead of the default one while tracing
+    is enabled (see tracer.tracer).
+    """
+
+    def __init__(self, trace_args):
+        HTTPHandler.__init__(self)
+        self._trace_args = trace_args
+        self._connection = None
+
+    def http_open(self, req):
+        return self.do_open(self._create_connection, req)
+
+    def _create_connection(self, host, **kwargs):
+        self._connection = _TracedHTTPConnection(host, **kwargs)
+        self._connection.trace_args = self._trace_args
+        return self._connection
+
+    def add_first_byte_span(self):
+        """Record the time between connecting and receiving the
+        response of the last request.
+        """
+        if self._connection is not None and self._connection.connected:
+            tracer.add_span('first byte', self._connection.connected,
+                            monotonic(), self._trace_args)
+
+
 class FTPChunkHandler(FTPHandler):
     """The code was taken from urllib2.py.
 
     The only difference is that offsets are supported by this class
     using the REST-command. Offsets are needed for chunked loading.
+    While tracing is enabled, the DNS lookup, connecting and waiting
+    for the first byte are recorded as spans (see tracer.tracer).
     """
 
+    def __init__(self, trace_args=None):
+        self._trace_args = trace_args
+
     def ftp_open(self, req):
         import mimetypes
         host = req.get_host()
@@ -92,10 +173,16 @@ class FTPChunkHandler(FTPHandler):
         user = unquote(user or '')
         passwd = unquote(passwd or '')
 
+        traced = tracer.enabled
+        if traced:
+            start = monotonic()
         try:
             host = socket.gethostbyname(host)
         except socket.error, msg:
             raise URLError(msg)
+        if traced:
+            resolved = monotonic()
+            tracer.add_span('dns', start, resolved, self._trace_args)
         path, attrs = splitattr(req.get_selector())
         dirs = path.split('/')
         dirs = map(unquote, dirs)
@@ -104,6 +191,10 @@ class FTPChunkHandler(FTPHandler):
             dirs = dirs[1:]
         try:
             fw = self.connect_ftp(user, passwd, host, port, dirs, req.timeout)
+            if traced:
+                connected = monotonic()
+                tracer.add_span('connect', resolved, connected,
+                                self._trace_args)
             type = file and 'I' or 'D'
             for attr in attrs:
                 attr, value = splitvalue(attr)
@@ -120,6 +211,9 @@ class FTPChunkHandler(FTPHandler):
             # EDIT END
 
             fp, retrlen = fw.retrfile(file, type, rest)
+            if traced:
+                tracer.add_span('first byte', connected, monotonic(),
+                                self._trace_args)
             headers = ""
             mtype = mimetypes.guess_type(req.get_full_url())[0]
             if mtype:
@@ -211,6 +305,11 @@ class Connection:
     source -- the source to use
     url -- the url used for the request
     url_parts -- the parts of the url as dict
+    ranges_supported -- True if the server announced that it supports
+                        partial requests (Accept-Ranges), False if not
+                        and None if unknown. It is set by fetch_infos.
+    trace_args -- a dict which is added to the spans recorded while
+                  tracing is enabled (see tracer.tracer) or None
 
     data_received_event -- An event.eventlistener.EventListener object.
                            The event is signalled when data is received.
@@ -230,6 +329,8 @@ class Connection:
         self.data_received_event = EventListener()
         self._signaled_data_received = False
         self._response = None
+        self.ranges_supported = None
+        self.trace_args = None
 
     def _signal_data_received(self):
         """Signal data_received_event if not already done."""
@@ -252,7 +353,7 @@ class Connection:
         return (real_url, filename, filesize)
 
 
-    def fetch_data(self, chunk, target_file, download):
+    def fetch_data(self, chunk, target_file, download, slot=None):
         """Fetch the data.
 
         The connection will be closed automatically!
@@ -261,8 +362,10 @@ class Connection:
         target_file -- the TargetFile-object which is used to store the
                        data on disk
         download -- the Download-object holding this connection
+        slot -- the DataSlot using this connection or None. The received
+                bytes are added to its bytes_received.
         """
-        self._request_data(chunk, target_file, download)
+        self._request_data(chunk, target_file, download, slot)
 
     def close(self):
         """Close the connection."""
@@ -309,9 +412,15 @@ class Connection:
                 start_offset = chunk.offset + chunk.loaded
                 req.add_header('Range', 'bytes=' + str(start_offset) + '-')
 
-            opener = build_opener(_LimitedHTTPRedirectHandler(max_redirects),
-                                    cookie_processor)
+            handlers = [_LimitedHTTPRedirectHandler(max_redirects),
+                        cookie_processor]
+            traced = tracer.enabled
+            if traced:
+                handlers.append(_TracedHTTPHandler(self.trace_args))
+            opener = build_opener(*handlers)
             self._response = opener.open(req, timeout=self.source.timeout)
+            if traced:
+                handlers[-1].add_first_byte_span()
 
             if self.source.cookie_objects is None:
                 # save cookie objects for later use (e.g. DataSlots)
@@ -327,7 +436,7 @@ class Connection:
             if chunk is not None:
                 start_offset = chunk.offset + chunk.loaded
                 req.add_header('Offset', str(start_offset))
-            opener = build_opener(FTPChunkHandler())
+            opener = build_opener(FTPChunkHandler(self.trace_args))
             self._response = opener.open(req, timeout=self.source.timeout)
             return self._response
         else:
@@ -360,6 +469,10 @@ class Connection:
             if 'content-length' in headers:
                 filesize = long(headers['content-length'].strip())
 
+            if 'accept-ranges' in headers:
+                self.ranges_supported = (
+                        headers['accept-ranges'].strip().lower() == 'bytes')
+
             return (real_url, filename, filesize)
 
         elif self.url_parts.scheme == 'ftp':
@@ -377,7 +490,7 @@ class Connection:
             return (None, None, None)
 
 
-    def _request_data(self, chunk, target_file, download):
+    def _request_data(self, chunk, target_file, download, slot=None):
         """Fetch the data using _request.
 
         The connection will be closed automatically!
@@ -386,6 +499,7 @@ class Connection:
         target_file -- the TargetFile-object which is used to store the
                        data on disk
         download -- the Download-object holding this connection
+        slot -- the DataSlot using this connection or None
         """
         response = None
         try:
@@ -394,6 +508,11 @@ class Connection:
             self.close()
             raise e
 
+        traced = tracer.enabled
+        if traced:
+            transfer_start = monotonic()
+            transfer_bytes = 0
+            write_time = 0
         try:
             if self.url_parts.scheme == 'http':
                 headers = response.info()
@@ -405,10 +524,22 @@ class Connection:
                     raise URLError('The server does not support partial/' +
                                     'resume downloads.')
 
+            budget = download.connection_budget
+
             # download is not paused/failed/finished/...
             # there are still bytes which need to be loaded.
             while (download.is_loading() and
                    not chunk.is_finished(download.slots_supported)):
+                if budget is not None and budget.should_release(download):
+                    # another download needs the connection
+                    raise ChunkNotFinishedError(critical=False,
+                            reason='Chunk not finished. Connection was ' +
+                                    'released for another download.')
+                if download.retire_slot():
+                    # the number of slots was reduced
+                    raise ChunkNotFinishedError(critical=False,
+                            reason='Chunk not finished. The slot retired.',
+                            retired=True)
                 # TODO: Speed Limit !!
                 to_load = chunk.bytes_left(download.slots_supported)
                 if to_load is None or to_load > 4096:
@@ -420,8 +551,17 @@ class Connection:
                     break
                 self._signal_data_received()
                 file_offset = chunk.offset + chunk.loaded
-                target_file.write(file_offset, data)
+                if traced:
+                    write_time += target_file.write(file_offset, data)
+                    transfer_bytes += len(data)
+                else:
+                    target_file.write(file_offset, data)
                 chunk.loaded += len(data)
+                # counters for the DownloadMeter and the metrics
+                bytes_received.add(len(data))
+                self.source.bytes_received.add(len(data))
+                if slot is not None:
+                    slot.bytes_received += len(data)
 
             if (not download.is_loading() and
                     not chunk.is_finished(download.slots_supported)):
@@ -437,9 +577,19 @@ class Connection:
                             reason='Chunk not finished.')
 
         finally:
+            if traced:
+                teardown_start = monotonic()
+                args = dict(self.trace_args or {})
+                args['bytes'] = transfer_bytes
+                args['disk_write_seconds'] = write_time
+                tracer.add_span('transfer', transfer_start, teardown_start,
+                                args)
             self.close()
             from time import sleep
             sleep(1)  # wait while connection is being closed
+            if traced:
+                tracer.add_span('teardown', teardown_start, monotonic(),
+                                self.trace_args)
             # TODO: Any chance to force close connection to avoid
             #       waiting a "random" time?
             #       We need to know that connection is closed, because
@@ -452,6 +602,8 @@ class Connection:
 
 
 class ChunkNotFinishedError(URLError):
-    def __init__(self, critical, reason):
+    def __init__(self, critical, reason, retired=False):
         self.critical = critical
+        # True if the slot has to exit (see Download.retire_slot)
+        self.retired = retired
         URLError.__init__(self, reason)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The connectionbudget-module contains the ConnectionBudget-class.
+
+The ConnectionBudget limits the number of data connections of all
+downloads together.
+"""
+
+from math import ceil
+from threading import Condition
+
+from event.eventlistener import EventListener
+
+
+class ConnectionBudget:
+    """The ConnectionBudget limits the number of connections which are
+    opened by the DataSlots of all downloads.
+
+    A DataSlot acquires a connection before it opens a Connection and
+    releases it when the chunk-job is done. The limit is shared between
+    the downloads which want connections: each download gets an equal
+    share or, if weighted is True, a share proportional to its priority
+    (a download gets priority - lowest priority + 1 parts). Shares which
+    are not needed by a download are given to the other downloads.
+
+    If a download uses more connections than its share while another
+    download is waiting, it is asked to release connections (see
+    should_release). So downloads grow and shrink within the budget.
+
+    Public instance variables:
+    limit -- the maximum number of connections. 0 means unlimited.
+    weighted -- True, if the shares are weighted by priority
+    used -- the number of connections currently in use
+
+    changed_event -- An event.eventlistener.EventListener object. The
+                     event is signalled when the number of used
+                     connections or the limit has changed. The listener
+                     is called with the ConnectionBudget as argument.
+    """
+
+    def __init__(self, limit=0, weighted=False):
+        """Initialize the ConnectionBudget.
+
+        limit -- the maximum number of connections (0 = unlimited)
+        weighted -- if True, the shares are weighted by priority
+        """
+        self._condition = Condition()
+        # download --> number of connections in use
+        self._used = {}
+        # download --> number of slots waiting for a connection
+        self._waiting = {}
+        # download --> number of connections which should be released
+        self._to_release = {}
+        # download --> number of connections which are being released
+        self._releasing = {}
+        # download --> number of connections the download may use
+        self._shares = {}
+
+        self.changed_event = EventListener()
+        self.limit = int(limit)
+        self.weighted = weighted
+        self.used = 0
+
+    def set_limit(self, limit):
+        """Set the maximum number of connections (0 = unlimited)."""
+        with self._condition:
+            self.limit = int(limit)
+            self._update_shares()
+            self._condition.notifyAll()
+        self.changed_event.signal(self)
+
+    def set_weighted(self, weighted):
+        """Set if the shares are weighted by the download priorities."""
+        with self._condition:
+            self.weighted = bool(weighted)
+            self._update_shares()
+            self._condition.notifyAll()
+
+    def acquire(self, download):
+        """Wait until the download may open another connection.
+
+        Returns True if the connection was acquired. If the download
+        stops loading while waiting, False is returned. Then nothing
+        needs to be released.
+
+        download -- the Download which wants to open a connection
+        """
+        with self._condition:
+            self._waiting[download] = self._waiting.get(download, 0) + 1
+            self._update_shares()
+            try:
+                while not self._may_acquire(download):
+                    if not download.is_loading():
+                        return False
+                    self._condition.wait()
+                if not download.is_loading():
+                    return False
+            finally:
+                self._waiting[download] -= 1
+                if self._waiting[download] == 0:
+                    del self._waiting[download]
+
+            self._used[download] = self._used.get(download, 0) + 1
+            self.used += 1
+            self._update_shares()
+        self.changed_event.signal(self)
+        return True
+
+    def try_acquire(self, download):
+        """Acquire a connection for the download without waiting, e.g.
+        to prefetch its information while it is not loading.
+
+        Returns True if the connection was acquired. False is returned
+        if the limit is reached or another download is waiting for a
+        connection, so the free connections are left to loading
+        downloads.
+
+        download -- the Download which wants to open a connection
+        """
+        with self._condition:
+            if self.limit > 0 and (self.used >= self.limit or
+                                   len(self._waiting) > 0):
+                return False
+            self._used[download] = self._used.get(download, 0) + 1
+            self.used += 1
+            self._update_shares()
+        self.changed_event.signal(self)
+        return True
+
+    def release(self, download):
+        """Release a connection acquired by acquire or try_acquire.
+
+        download -- the Download which has closed the connection
+        """
+        with self._condition:
+            used = self._used.get(download, 0) - 1
+            if used <= 0:
+                self._used.pop(download, None)
+            else:
+                self._used[download] = used
+            releasing = self._releasing.get(download, 0) - 1
+            if releasing <= 0:
+                self._releasing.pop(download, None)
+            else:
+                self._releasing[download] = releasing
+            self.used -= 1
+            self._update_shares()
+            self._condition.notifyAll()
+        self.changed_event.signal(self)
+
+    def should_release(self, download):
+        """Returns True if a connection of the download should be closed
+        to make room for another download, otherwise False.
+
+        It is called by a Connection while loading data. If True is
+        returned, the caller has to stop loading and release the
+        connection.
+        """
+        # fast path without locking, this is called for each block
+        if self._to_release.get(download, 0) <= 0:
+            return False
+        with self._condition:
+            to_release = self._to_release.get(download, 0)
+            if to_release <= 0:
+                return False
+            self._to_release[download] = to_release - 1
+            self._releasing[download] = self._releasing.get(download, 0) + 1
+            return True
+
+    def get_share(self, download):
+        """Returns the number of connections the download may use at the
+        moment or None if the budget is unlimited.
+        """
+        with self._condition:
+            if self.limit <= 0:
+                return None
+            return self._shares.get(download, 0)
+
+    def wake_up(self):
+        """Let waiting slots check their download again.
+
+        This should be called when the state or the priority of a
+        download has changed.
+        """
+        with self._condition:
+            self._update_shares()
+            self._condition.notifyAll()
+
+    def _may_acquire(self, download):
+        if self.limit <= 0:
+            return True
+        if self.used >= self.limit:
+            return False
+        return self._used.get(download, 0) < self._shares.get(download, 0)
+
+    def _update_shares(self):
+        """Calculate the shares of all downloads which use or want
+        connections and decide which downloads should release
+        connections.
+
+        The limit is divided by "water-filling": downloads which want
+        less than their part get what they want, the rest is divided
+        between the other downloads.
+        Must be called while self._condition is held.
+        """
+        self._shares = {}
+        self._to_release = {}
+        if self.limit <= 0:
+            return
+
+        demands = {}
+        for download, used in self._used.iteritems():
+            demands[download] = used
+        for download, waiting in self._waiting.iteritems():
+            demands[download] = demands.get(download, 0) + waiting
+        if len(demands) == 0:
+            return
+
+        if self.weighted:
+            lowest = min(d.priority for d in demands)
+            weights = dict((d, d.priority - lowest + 1) for d in demands)
+        else:
+            weights = dict((d, 1) for d in demands)
+
+        remaining = float(self.limit)
+        pending = set(demands)
+        while len(pending) > 0:
+            total_weight = sum(weights[d] for d in pending)
+            satisfied = [d for d in pending if
+                         demands[d] <= remaining * weights[d] / total_weight]
+            if len(satisfied) == 0:
+                for download in pending:
+                    self._shares[download] = (remaining * weights[download] /
+                                              total_weight)
+                break
+            for download in satisfied:
+                self._shares[download] = demands[download]
+                remaining -= demands[download]
+                pending.discard(download)
+
+        # Ask downloads above their share to release connections, but only
+        # if another download is waiting and may use them.
+        starving = False
+        for download in self._waiting:
+            if self._used.get(download, 0) < self._shares[download]:
+                starving = True
+                break
+        if not starving:
+            return
+        for download, used in self._used.iteritems():
+            excess = (used - self._releasing.get(download, 0) -
+                      int(ceil(self._shares[download])))
+            if excess > 0:
+                self._to_release[download] = excess
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The counter-module contains the classes Counter and Histogram.
+
+Counters and Histograms are written by many threads (e.g. the slots) and
+read by others (e.g. metrics.MetricsServer) without locks: each thread
+adds to its own cell and a reader sums up the cells. Reading a cell and
+replacing a list or dict entry are atomic in CPython, so a reader never
+blocks a writer. The value read may miss an addition which happens at
+the same time, but it is never corrupted.
+"""
+
+from bisect import bisect_left
+from thread import get_ident
+
+
+class Counter:
+    """A Counter is a number which only grows, e.g. the number of
+    received bytes.
+    """
+
+    def __init__(self):
+        # thread identifier --> [value]
+        self._cells = {}
+
+    def add(self, value=1):
+        """Add value to the Counter."""
+        cell = self._cells.get(get_ident())
+        if cell is None:
+            # only this thread uses this identifier
+            cell = self._cells[get_ident()] = [0]
+        cell[0] += value
+
+    def get_value(self):
+        return sum(cell[0] for cell in self._cells.values())
+
+
+class Histogram:
+    """A Histogram counts observed values, e.g. durations, in buckets.
+
+    Public instance variables:
+    buckets -- a sorted tuple of the upper bounds of the buckets. A value
+               is counted in the first bucket whose bound is not less
+               than the value or in the overflow bucket.
+    """
+
+    def __init__(self, buckets):
+        """Initialize the Histogram.
+
+        buckets -- the upper bounds of the buckets
+        """
+        self.buckets = tuple(sorted(buckets))
+        # thread identifier --> [count of each bucket, overflow, sum]
+        self._cells = {}
+
+    def observe(self, value):
+        """Count value in its bucket."""
+        cell = self._cells.get(get_ident())
+        if cell is None:
+            cell = [0] * (len(self.buckets) + 1) + [0]
+            self._cells[get_ident()] = cell
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def get_value(self):
+        """Returns a (cumulative counts, sum, count)-tuple.
+
+        The cumulative counts contain the number of values which are not
+        greater than the bound of each bucket.
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0
+        for cell in self._cells.values():
+            for i in xrange(len(counts)):
+                counts[i] += cell[i]
+            total += cell[-1]
+        cumulative = []
+        count = 0
+        for c in counts[:-1]:
+            count += c
+            cumulative.append(count)
+        count += counts[-1]
+        return (cumulative, total, count)
@@ -25,16 +25,19 @@ chunks etc..
 
 from datetime import datetime
 from os import path, rename, remove
-from Queue import Queue
-import thread
+from Queue import Queue, Empty
 from threading import Lock, RLock, Condition
 
 from chunk import Chunk
+from clock import monotonic
 from event.eventlistener import EventListener
 from log import Log, MessageType
 from slot import InfoSlot, DataSlot
 from source import Source
+from splitstrategy import HalveStrategy, create_split_strategy
 from targetfile import TargetFile
+from timerwheel import timer_wheel
+from workerpool import clean_up_pool
 
 
 class DownloadState:
@@ -63,13 +66,29 @@ class Download:
                        True automatically if a second slot receives
                        data.
     log -- the download-log where errors etc. will be logged
-    chunks -- all chunks of the download (unfinished and finished)
+    chunks -- all chunks of the download (unfinished and finished).
+              Adjacent finished chunks are merged.
     chunk_queue -- the current chunk-todo-list. A DataSlot will take
-                   a chunk from this queue and load it.
+                   a chunk from this queue and load it (see
+                   get_chunk_job).
     active_slot -- the number of currently loading slots
-    max_slot -- the maximum number of slots to use
+    max_slot -- the maximum number of slots to use. It can be changed
+                while the download is loading (see set_max_slot).
     chunk_size --
+    split_strategy -- the splitstrategy.SplitStrategy which decides how
+                      chunks are split up
+    priority -- the priority of the download. Downloads with a higher
+                priority are started first by the Manager. The default
+                is 0.
+    connection_budget -- the connectionbudget.ConnectionBudget which
+                         limits the connections of all downloads or None
+                         (unlimited). It is set by the Manager.
+    host_limits -- the hostlimits.HostLimits which limits the
+                   connections to each host or None (unlimited). It is
+                   set by the Manager.
     source_condition --
+    slot_condition -- the Condition the slots wait on for new chunks,
+                      retry deadlines and state changes
 
     status_changed_event   -- An event.eventlistener.EventListener
                               object. The event is signalled when the
@@ -94,6 +113,10 @@ class Download:
                               retries has changed. The listener is
                               called with the download as argument.
     source_added_event     --
+    priority_changed_event -- An event.eventlistener.EventListener
+                              object. The event is signalled when the
+                              priority has changed. The listener is
+                              called with the download as argument.
     """
 
 
@@ -111,6 +134,7 @@ class Download:
         self._chunk_lock = RLock()
 
         self.source_condition = Condition()
+        self.slot_condition = Condition()
 
         self.status_changed_event = EventListener()
         self.filename_changed_event = EventListener()
@@ -118,8 +142,19 @@ class Download:
         self.slots_changed_event = EventListener()
         self.retries_changed_event = EventListener()
         self.source_added_event = EventListener()
+        self.priority_changed_event = EventListener()
 
         self.chunk_size = 2097152
+        self.split_strategy = HalveStrategy()
+        self.priority = 0
+        self.connection_budget = None
+        self.host_limits = None
+        # the number of slots of the current run which are not retiring,
+        # the number of slots which still need to retire and the number
+        # of slots started in the current run (for their names)
+        self._slot_count = 0
+        self._slots_to_retire = 0
+        self._slot_number = 0
         self.set_max_slot(max_slot)
         self.active_slot = 0
         self._slots = []
@@ -160,20 +195,49 @@ class Download:
 
         dl = Download(dict['max_slot'], sources[0], dict['target_folder'])
         dl.chunk_size = dict['chunk_size']
+        dl.split_strategy = create_split_strategy(
+                                            dict.get('split_strategy'))
+        dl.priority = dict.get('priority', 0)
         dl.filesize = dict['filesize']
         dl._infos_fetched = dict['infos_fetched']
         dl.slots_supported = dict['slots_supported']
         dl._last_used_source = dict['last_used_source']
         dl._original_filename = dict['original_filename']
         dl.filename = dict['filename']
-        dl._set_state(dict['state'])
+        # The download has never been started, so there is nothing to
+        # clean up. _set_state would run a clean-up task for stopped
+        # states, which is slow when many downloads are loaded.
+        # Active, stopping and unknown states are not restored, the
+        # download is ready then.
+        if dict.get('state') in (DownloadState.paused,
+                                 DownloadState.cancelled,
+                                 DownloadState.failed,
+                                 DownloadState.finished):
+            dl.state = dict['state']
         dl._sources = sources
         dl.chunks = chunks
+        # downloads saved by older versions may contain many chunks
+        dl._coalesce_chunks()
         return dl
 
     def get_as_dict(self):
+        """Returns the download as a dict which can be saved and passed
+        to create_from_dict.
+
+        The saved state is the state the download resumes with: an
+        active download is saved as ready and a stopping download as
+        paused, so the state is valid even if the program is not closed
+        properly, e.g. when the daemon saves while loading.
+        """
+        state = self.state
+        if (state == DownloadState.fetching_info or
+                state == DownloadState.loading):
+            state = DownloadState.ready
+        elif state == DownloadState.stopping:
+            state = DownloadState.paused
         root_chunk = None
         with self._chunk_lock:
+            self._coalesce_chunks()
             if len(self.chunks) >= 1:
                 root_chunk = self.chunks[0].get_as_dict()
         sources = []
@@ -182,6 +246,8 @@ class Download:
                 sources.append(source.get_as_dict())
         download = {
             'chunk_size': self.chunk_size,
+            'split_strategy': self.split_strategy.name,
+            'priority': self.priority,
             'max_slot': self.max_slot,
             'filesize': self.filesize,
             'infos_fetched': self._infos_fetched,
@@ -190,7 +256,7 @@ class Download:
             'target_folder': self.target_folder,
             'original_filename': self._original_filename,
             'filename': self.filename,
-            'state': self.state,
+            'state': state,
             'sources': sources,
             'root_chunk': root_chunk
         }
@@ -222,6 +288,9 @@ class Download:
         Usually this method is called by a DataSlot.
         It searches for a Source that can be used to load data from.
         So the returned Source does not have reached max_retries.
+        Sources whose host does not accept another connection at the
+        moment (see host_limits) are only used if there is no other
+        Source.
 
         If a Source was found a tuple is returned containing the Source
         and the time until the slot should wait (if an error happend
@@ -244,6 +313,8 @@ class Download:
 
         source = None
         wait_until = None
+        # sources whose host has reached its connection limit
+        busy_sources = []
         start = self._last_used_source
         length = len(self._sources)
         for i in [i%length for i in range(start, length+start)]:
@@ -262,6 +333,10 @@ class Download:
                     cur_source.running_slots >= cur_source.max_active_slots):
                 error = False
                 continue
+            if (self.host_limits is not None and
+                    not self.host_limits.has_capacity(cur_source.url)):
+                busy_sources.append(cur_source)
+                continue
             # check if source reached max. retries
             tmp = cur_source.is_retry_allowed()
             if tmp >= 0:
@@ -272,6 +347,18 @@ class Download:
             else:
                 cur_source.valid = False
 
+        if source is None:
+            # the slot will wait for the host (see DataSlot)
+            for cur_source in busy_sources:
+                tmp = cur_source.is_retry_allowed()
+                if tmp >= 0:
+                    error = False
+                    source = cur_source
+                    wait_until = tmp
+                    break
+                else:
+                    cur_source.valid = False
+
         download_failed = all_source_invalid or error
         if download_failed:
             # reached max. retries on each source
@@ -287,13 +374,55 @@ class Download:
         return (source, wait_until)
 
     def get_chunk_data(self):
+        """Returns a list of (offset, loaded bytes, chunk.ChunkState)-
+        tuples of the chunks.
+        """
         chunks = []
         with self._chunk_lock:
             for chunk in self.chunks:
                 chunks.append((chunk.offset,
-                                chunk.bytes_loaded(self.slots_supported)))
+                                chunk.bytes_loaded(self.slots_supported),
+                                chunk.get_state(self.slots_supported)))
         return chunks
 
+    def get_chunk_job(self):
+        """Wait for a chunk on the chunk_queue and return it.
+
+        Usually this method is called by a DataSlot. If the download
+        stops loading or a slot has to retire while waiting, None is
+        returned.
+        """
+        with self.slot_condition:
+            while self.is_loading() and self._slots_to_retire == 0:
+                try:
+                    return self.chunk_queue.get_nowait()
+                except Empty:
+                    self.slot_condition.wait()
+        return None
+
+    def wait_until(self, deadline, is_running):
+        """Wait until the deadline (see clock.monotonic) has passed.
+
+        Usually this method is called by a slot which has to wait
+        between retries. The slot is woken up by the timer wheel at the
+        deadline or immediately when the state of the download changes.
+
+        deadline -- the time until the slot waits
+        is_running -- a parameter less function, e.g. is_loading. The
+                      slot stops waiting when it returns False.
+
+        Returns True if the deadline has passed and is_running still
+        returns True, otherwise False.
+        """
+        timer = timer_wheel.schedule(deadline, self._wake_up_slots)
+        try:
+            with self.slot_condition:
+                while is_running() and monotonic() < deadline:
+                    self.slot_condition.wait()
+        finally:
+            timer.cancel()
+        return is_running()
+
     def is_loading(self):
         """Returns True if the Download is loading, otherwise False."""
         return self.state == DownloadState.loading
@@ -304,11 +433,85 @@ class Download:
         """
         return self.state == DownloadState.fetching_info
 
+    def needs_infos(self):
+        """Returns True if the information (filename, size) needs to be
+        fetched before loading data, otherwise False.
+
+        The information is not needed, if it was fetched before or the
+        first Source has fresh prefetched information.
+        """
+        return (not self._infos_fetched and
+                not self._sources[0].has_fresh_infos())
+
     def set_max_slot(self, num):
-        """Set the maximum number of slots."""
+        """Set the maximum number of slots.
+
+        If the download is loading, the slots are changed at once. New
+        slots are started and chunks are split for them. If there are
+        too many slots, the next slots waiting for a chunk or loading
+        a chunk retire (see retire_slot). The rest of a chunk is put
+        back on the chunk_queue.
+        If the file size is unknown, only one slot is used anyway.
+        """
         self.max_slot = int(num)
+        added = 0
+        with self.slot_condition:
+            if (self._slot_count > 0 and self.is_loading() and
+                    self.filesize is not None):
+                diff = max(self.max_slot, 1) - self._slot_count
+                if diff < 0:
+                    self._slots_to_retire -= diff
+                    self.slot_condition.notifyAll()
+                elif diff > 0:
+                    # slots which have not retired yet can stay
+                    kept = min(diff, self._slots_to_retire)
+                    self._slots_to_retire -= kept
+                    added = diff - kept
+                    for i in range(added):
+                        self._start_slot(DataSlot('Slot ' +
+                                str(self._slot_number), self,
+                                self._target_file))
+                self._slot_count += diff
+        # New chunks for the new slots. If no slot has received data yet,
+        # the chunks are split when the first one does. As long as
+        # slots are not known to be supported, the root chunk may load
+        # more than its length, so only one chunk is split. The other
+        # chunks are split when the slots start receiving data (see
+        # _on_slot_started_chunk).
+        if added > 0 and self.active_slot > 0:
+            if not self.slots_supported:
+                added = 1
+            for i in range(added):
+                self._new_chunk()
         self.slots_changed_event.signal(self)
 
+    def get_slots(self):
+        """Returns a list of the DataSlots which have not exited."""
+        with self.slot_condition:
+            return [slot for slot in self._slots if not slot.is_done()]
+
+    def retire_slot(self):
+        """Returns True if the calling slot has to exit, because the
+        number of slots was reduced (see set_max_slot).
+
+        Usually this method is called by a DataSlot between two chunks
+        or by its Connection while loading a chunk. If True is returned,
+        the slot is not counted anymore and must exit.
+        """
+        if self._slots_to_retire == 0:
+            # fast path without locking
+            return False
+        with self.slot_condition:
+            if self._slots_to_retire > 0:
+                self._slots_to_retire -= 1
+                return True
+        return False
+
+    def set_priority(self, priority):
+        """Set the priority of the download."""
+        self.priority = int(priority)
+        self.priority_changed_event.signal(self)
+
     def fix_chunk(self, chunk):
         """This method is used to fix a chunk if it overlaps with its
         parent chunk. It is called by a DataSlot.
@@ -371,8 +574,11 @@ class Download:
         self._set_state(DownloadState.ready)
 
     def pause(self):
-        """Set the state of the download to DownloadState.paused."""
-        self._set_state(DownloadState.paused)
+        """Set the state of the download to DownloadState.paused.
+
+        Returns True if the state was changed, otherwise False.
+        """
+        return self._set_state(DownloadState.paused)
 
     def cancel(self):
         """Set the state of the download to DownloadState.cancelled."""
@@ -393,6 +599,13 @@ class Download:
             self.log.add_log_entry(MessageType.info, 'Download', 'Resuming')
             self._is_resuming = True
             self._resume()
+        elif not self.needs_infos():
+            self.log.add_log_entry(MessageType.info, 'Download', 'Starting')
+            self.log.add_log_entry(MessageType.info, 'Download',
+                                            'Using prefetched information')
+            # there is no connection which can be used by the first slot
+            self._info_slot = None
+            self._on_infos_fetched()
         else:
             self.log.add_log_entry(MessageType.info, 'Download', 'Starting')
             self.log.add_log_entry(MessageType.info, 'Download',
@@ -435,6 +648,30 @@ class Download:
             self.retries_changed_event.signal(self)
         return removed
 
+    def set_prefetched_infos(self, source, url, filename, filesize,
+                             ranges_supported, valid_until):
+        """Store information fetched by the InfoPrefetcher in a Source
+        of the download.
+
+        The Source is updated while the sources are locked. The
+        information is valid until valid_until is set, so a download
+        which is started meanwhile never sees half of it. Nothing is
+        stored if the information was already fetched by an InfoSlot.
+        """
+        with self._sources_lock:
+            if self._infos_fetched or source not in self._sources:
+                return
+            url_changed = source.url != url
+            source.url = url
+            if filename is not None:
+                source.filename = filename
+            if filesize is not None:
+                source.filesize = filesize
+            source.ranges_supported = ranges_supported
+            source.infos_valid_until = valid_until
+        if url_changed:
+            source.url_changed_event.signal(source)
+
     def get_copy_of_sources(self):
         with self._sources_lock:
             copy = self._sources[:]
@@ -548,15 +785,27 @@ class Download:
             def clean_up(self, state):
                 # maybe we need to wait for InfoSlot
                 if self._info_slot is not None:
+                    self._info_slot.cancel()
                     self._info_slot.join()
 
-                # dl should stop, so wait for slots
-                for slot in self._slots:
+                # no slots are started or retired anymore
+                with self.slot_condition:
+                    self._slot_count = 0
+                    self._slots_to_retire = 0
+                    slots = self._slots[:]
+
+                # dl should stop, so wait for slots. Slots which were not
+                # started by the slot pool yet are not needed anymore.
+                for slot in slots:
+                    slot.cancel()
                     slot.join()
 
                 if self._target_file is not None:
                     self._target_file.close()
 
+                # the slots have stopped, log their repeated messages
+                self.log.flush()
+
                 # clear chunk-todo-list
                 while not self.chunk_queue.empty():
                     self.chunk_queue.get_nowait()
@@ -583,28 +832,44 @@ class Download:
 
             self.state = DownloadState.stopping
             self.log.add_log_entry(MessageType.info, 'Download', 'Stopping')
-            # maybe there are slots waiting for a source which are
-            # interested in state-changes
+            # maybe there are slots waiting for a source, a chunk or a
+            # retry which are interested in state-changes
             with self.source_condition:
                 self.source_condition.notifyAll()
+            self._wake_up_slots()
             self.status_changed_event.signal(self)
             self._state_lock.release()
 
-            thread.start_new_thread(clean_up, (self, state, ))
+            clean_up_pool.run('Clean-up ' + self.filename, clean_up, self,
+                              state)
 
         else:
             self.state = state
             if state == DownloadState.ready:
                 self.log.add_log_entry(MessageType.info, 'Download', 'Ready')
-            # maybe there are slots waiting for a source which are
-            # interested in state-changes
+            # maybe there are slots waiting for a source, a chunk or a
+            # retry which are interested in state-changes
             with self.source_condition:
                 self.source_condition.notifyAll()
+            self._wake_up_slots()
             self.status_changed_event.signal(self)
             self._state_lock.release()
 
         return True
 
+    def _wake_up_slots(self):
+        """Wake up the slots waiting on slot_condition."""
+        with self.slot_condition:
+            self.slot_condition.notifyAll()
+
+    def _queue_chunk(self, chunk):
+        """Put the chunk on the chunk_queue and wake up the waiting
+        slots.
+        """
+        with self.slot_condition:
+            self.chunk_queue.put(chunk)
+            self.slot_condition.notifyAll()
+
     def _inc_active_slots(self, decrement=False):
         with self._active_slot_lock:
             if decrement:
@@ -626,6 +891,44 @@ class Download:
                     count += 1
         return count
 
+    def _coalesce_chunks(self):
+        """Merge adjacent finished chunks into single chunks.
+
+        Each split in _new_chunk adds a chunk. Without merging, the
+        number of chunks would grow with every split, so finished
+        neighbours are combined. Chunks which do not contain any bytes
+        anymore (see fix_chunk) are dropped.
+        The root chunk always stays at self.chunks[0].
+
+        Note: Chunks are only merged if slots are supported, because
+              otherwise the root chunk may load beyond its length.
+        """
+        if not self.slots_supported or self.filesize is None:
+            return
+
+        with self._chunk_lock:
+            if len(self.chunks) < 2:
+                return
+
+            root = self.chunks[0]
+            chunks = []
+            for chunk in self.chunks:
+                if chunk is not root and chunk.length == 0:
+                    chunk.remove_from_tree()
+                else:
+                    chunks.append(chunk)
+            chunks.sort(key=lambda c: (c.offset, c is not root))
+
+            merged = [chunks[0]]
+            for chunk in chunks[1:]:
+                last = merged[-1]
+                if (last.offset + last.length == chunk.offset and
+                        last.is_finished(True) and chunk.is_finished(True)):
+                    merged[-1] = Chunk.create_merged(last, chunk)
+                else:
+                    merged.append(chunk)
+            self.chunks = merged
+
     def _resume(self):
         """Resume downloading the file.
 
@@ -679,7 +982,7 @@ class Download:
             for chunk in to_enqueue:
                 if not chunk.is_finished(self.slots_supported):
                     filled_queue = True
-                    self.chunk_queue.put(chunk)
+                    self._queue_chunk(chunk)
 
         # Maybe all chunks were already loaded. This can happen when
         # download was paused and one slot still finished the last
@@ -695,22 +998,40 @@ class Download:
         else:
             slots_to_create = self.max_slot
 
-        for i in range(slots_to_create):
-            slot = None
-            if self._is_resuming or i > 0:
-                slot = DataSlot('Slot ' + str(i), self, self._target_file)
-            else:
-                # Use the connection of the InfoSlot to load the root
-                # chunk in the first slot.
-                slot = DataSlot('Slot ' + str(i), self, self._target_file,
-                                self.chunks[0], self._info_slot.connection)
-                self._sources[0].inc_running_slots()
-            self._slots.append(slot)
-            slot.chunk_started_event.add_listener(self._on_slot_started_chunk)
-            slot.chunk_finished_event.add_listener(
-                                                self._on_slot_finished_chunk)
-            slot.chunk_failed_event.add_listener(self._on_slot_failed_chunk)
-            slot.start()
+        with self.slot_condition:
+            self._slot_count = slots_to_create
+            self._slots_to_retire = 0
+            self._slot_number = 0
+            for i in range(slots_to_create):
+                slot = None
+                if self._is_resuming or i > 0:
+                    slot = DataSlot('Slot ' + str(i), self, self._target_file)
+                elif self._info_slot is None:
+                    # The information was prefetched, so there is no open
+                    # connection. The first slot loads the root chunk.
+                    slot = DataSlot('Slot ' + str(i), self, self._target_file,
+                                    self.chunks[0])
+                else:
+                    # Use the connection of the InfoSlot to load the root
+                    # chunk in the first slot.
+                    slot = DataSlot('Slot ' + str(i), self, self._target_file,
+                                    self.chunks[0], self._info_slot.connection)
+                    self._sources[0].inc_running_slots()
+                self._start_slot(slot)
+
+    def _start_slot(self, slot):
+        """Add the listeners to the DataSlot and start it.
+
+        Must be called while slot_condition is held.
+        """
+        # forget slots of previous runs and retired slots
+        self._slots = [s for s in self._slots if not s.is_done()]
+        self._slots.append(slot)
+        self._slot_number += 1
+        slot.chunk_started_event.add_listener(self._on_slot_started_chunk)
+        slot.chunk_finished_event.add_listener(self._on_slot_finished_chunk)
+        slot.chunk_failed_event.add_listener(self._on_slot_failed_chunk)
+        slot.start()
 
     def _get_max_supported_slots(self):
         max_slots = 0
@@ -730,6 +1051,7 @@ class Download:
 
         So the slot with the old chunk (parent) will load less data and
         the new chunk (child) will be loaded by another slot.
+        Which chunk is split and where is decided by split_strategy.
         """
         if not self.is_loading():
             return
@@ -743,27 +1065,17 @@ class Download:
                     (max_slots >= 0 and unfinished_chunks >= max_slots)):
                 return
 
-            chunk_to_split = None
-            chunk_to_load = 0
-            for chunk in self.chunks:
-                if not chunk.is_finished(self.slots_supported):
-                    bytes = chunk.bytes_left(self.slots_supported)
-                    # respect minimum chunk size, e.g. 2 MB
-                    if bytes >= self.chunk_size and bytes > chunk_to_load:
-                        chunk_to_split = chunk
-                        chunk_to_load = bytes
-
-            if chunk_to_split is not None:
-                old_length = chunk_to_split.length
-                chunk_to_split.length = old_length - (chunk_to_load / 2)
+            split = self.split_strategy.split(self)
+            if split is not None:
+                chunk_to_split, new_chunk_length = split
+                chunk_to_split.length -= new_chunk_length
                 new_chunk_offset = (chunk_to_split.offset +
                                     chunk_to_split.length)
-                new_chunk_length = old_length - chunk_to_split.length
                 new_chunk = Chunk(chunk_to_split,
                                   new_chunk_offset, new_chunk_length)
                 chunk_to_split.childs.append(new_chunk)
                 self.chunks.append(new_chunk)
-                self.chunk_queue.put(new_chunk)
+                self._queue_chunk(new_chunk)
 
     def _on_infos_fetched(self):
         """This method will be called if infos were fetched successfully
@@ -850,6 +1162,9 @@ class Download:
         with self.source_condition:
             self.source_condition.notifyAll()
 
+        # keep the chunk list small
+        self._coalesce_chunks()
+
         # loaded all chunks? (== download finished?)
         # If filesize is unknown, only 1 slot exist. So if this method
         # is called and self.filesize == None, the download is finished.
@@ -882,7 +1197,7 @@ class Download:
             self.source_condition.notifyAll()
 
         # chunk still needs to be loaded
-        self.chunk_queue.put(chunk)
+        self._queue_chunk(chunk)
 
     def _on_source_retries_changed(self, source):
         self.retries_changed_event.signal(self)
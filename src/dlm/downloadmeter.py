@@ -15,81 +15,225 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
-from threading import Thread
-from time import time, sleep
 
+"""The downloadmeter-module contains the classes DownloadMeter and
+MeterSnapshot.
+
+The DownloadMeter measures the speeds of all slots, sources and
+downloads of a Manager. The speeds of one measurement are passed to the
+listeners as a MeterSnapshot.
+"""
+
+from math import exp
+from threading import Condition, Thread
+
+from clock import monotonic
 from download import DownloadState
 from event.eventlistener import EventListener
+from timerwheel import timer_wheel
+from workerpool import clean_up_pool, slot_pool
+
+
+class MeterSnapshot:
+    """A MeterSnapshot contains the speeds measured in one tick of the
+    DownloadMeter. All speeds are smoothed and in bytes per second.
+
+    Public instance variables:
+    time -- the time of the tick (see clock.monotonic)
+    interval -- the number of seconds since the previous tick
+    speed -- the speed of all downloads
+    downloads -- a dict of the loading downloads. The values are
+                 (loaded bytes, speed)-tuples.
+    sources -- a dict source --> speed of the sources of the loading
+               downloads
+    slots -- a dict slot.DataSlot --> speed of the running slots of the
+             loading downloads
+    download_list -- a list of all downloads of the Manager
+    loaded -- a dict download --> loaded bytes of all downloads
+    download_sources -- a dict download --> list of the sources of all
+                        downloads
+    pools -- a list of the statistics of the worker pools (see
+             workerpool.WorkerPool.get_stats)
+    """
+
+    def __init__(self, time, interval):
+        self.time = time
+        self.interval = interval
+        self.speed = 0
+        self.downloads = {}
+        self.sources = {}
+        self.slots = {}
+        self.download_list = []
+        self.loaded = {}
+        self.download_sources = {}
+        self.pools = []
+
+
+class _Rate:
+    """The smoothed rate of a growing byte counter."""
+
+    def __init__(self, total, now):
+        self.total = total
+        self.time = now
+        self.speed = None
+
+    def update(self, total, now, smoothing):
+        """Add a sample of the counter and return the new speed.
+
+        smoothing -- the time constant of the EWMA in seconds. 0 means
+                     no smoothing.
+        """
+        elapsed = now - self.time
+        if elapsed <= 0:
+            return self.speed or 0
+        # the counter may be reset, e.g. when a download is cancelled
+        speed = max(total - self.total, 0) / float(elapsed)
+        if self.speed is not None and smoothing > 0:
+            # the weight of the old speed depends on the time which has
+            # passed, so the result does not depend on the tick rate
+            alpha = 1 - exp(-elapsed / smoothing)
+            speed = self.speed + alpha * (speed - self.speed)
+        self.total = total
+        self.time = now
+        self.speed = speed
+        return speed
 
 
 class DownloadMeter(Thread):
-    def __init__(self, manager):
-        self.download_bytes_changed_event = EventListener()
-        self.download_speed_changed_event = EventListener()
-        self.speed_changed_event = EventListener()
+    """The DownloadMeter measures the speeds of the loading downloads of
+    a Manager.
+
+    Every interval seconds the loaded bytes of each download, source and
+    slot are sampled on a monotonic clock (see clock.monotonic). The
+    speeds are smoothed with an exponentially weighted moving average
+    (EWMA) with the time constant smoothing: a change of the real speed
+    is reflected to about 63% after smoothing seconds.
+    Then snapshot_event is signalled once with a MeterSnapshot.
+    The snapshot contains all downloads and their loaded bytes and
+    sources as well, so readers like the metrics.MetricsServer need no
+    locks of the downloads. The loaded bytes of a download which is not
+    loading are only counted again when its state has changed.
+
+    The thread waits on a Condition which is notified by the timer wheel
+    (see timerwheel.timer_wheel), so stop returns at once.
+
+    Public instance variables:
+    interval -- the number of seconds between two ticks
+    smoothing -- the time constant of the EWMA in seconds. 0 disables
+                 smoothing.
+    last_snapshot -- the MeterSnapshot of the last tick or None. It is
+                     replaced, never changed, so it can be read without
+                     a lock.
+
+    snapshot_event -- An event.eventlistener.EventListener object. The
+                      event is signalled on every tick. The listener is
+                      called with a MeterSnapshot.
+    """
+
+    def __init__(self, manager, interval=1.0, smoothing=3.0):
+        """Initialize the DownloadMeter.
+
+        manager -- the Manager whose downloads are measured
+        interval -- the number of seconds between two ticks
+        smoothing -- the time constant of the EWMA in seconds
+        """
+        self.snapshot_event = EventListener()
 
         self._manager = manager
+        self.interval = interval
+        self.smoothing = smoothing
+        self.last_snapshot = None
+        self._condition = Condition()
         self._running = True
-        Thread.__init__(self)
+        Thread.__init__(self, name='Download Meter')
+
+    def set_interval(self, interval):
+        """Change the number of seconds between two ticks.
+
+        The new interval is used from the next tick on.
+        """
+        self.interval = max(float(interval), 0.05)
+        self._wake_up()
 
     def stop(self):
-        self._running = False
+        with self._condition:
+            self._running = False
+            self._condition.notifyAll()
         self.join()
 
     def run(self):
-        latest_bytes = {}
-        latest_speed = {}
-        changed_bytes = []
-        changed_speed = []
-
-        while self._running:
-            global_speed = 0
-            del changed_bytes[:]
-            del changed_speed[:]
-            downloads = self._manager.get_download_list_copy()
-
-            for download in downloads:
-                if download.state != DownloadState.loading:
-                    if download in latest_bytes:
-                        del latest_bytes[download]
-                    if download in latest_speed:
-                        del latest_speed[download]
-                    continue
-
-                # TODO: better use monotonic time
-                now = time()
-                if download in latest_bytes:
-                    t, bytes = latest_bytes[download]
-                    speed = None
-                    if download in latest_speed:
-                        speed = latest_speed[download]
-
-                    new_bytes = download.get_bytes_loaded()
-                    byte_diff = new_bytes - bytes
-                    time_diff = now - t
-                    new_speed = byte_diff / time_diff
-
-                    if new_bytes != bytes:
-                        changed_bytes.append((download, new_bytes))
-
-                    if speed is None or new_speed != speed:
-                        changed_speed.append((download, new_speed))
-
-                    latest_bytes[download] = (now, new_bytes)
-                    latest_speed[download] = new_speed
-                    global_speed += new_speed
+        # counted object --> _Rate
+        rates = {}
+        # download which is not loading --> (state, loaded bytes)
+        idle = {}
+        last_tick = monotonic()
+
+        while True:
+            # the deadline is monotonic, so setting the system time back
+            # does not stop the meter
+            deadline = monotonic() + self.interval
+            timer = timer_wheel.schedule(deadline, self._wake_up)
+            with self._condition:
+                while self._running and monotonic() < deadline:
+                    self._condition.wait()
+                running = self._running
+            timer.cancel()
+            if not running:
+                return
+
+            now = monotonic()
+            snapshot = MeterSnapshot(now, now - last_tick)
+            last_tick = now
+            rates, idle = self._measure(snapshot, rates, idle)
+            self.last_snapshot = snapshot
+            self.snapshot_event.signal(snapshot)
+
+    def _wake_up(self):
+        with self._condition:
+            self._condition.notifyAll()
+
+    def _measure(self, snapshot, rates, idle):
+        """Fill the snapshot with the speeds of the loading downloads
+        and the loaded bytes and sources of all downloads.
+
+        Returns the new rates and idle downloads. Objects which are not
+        loading (rates) or which were removed (idle) are dropped.
+        """
+        new_rates = {}
+        new_idle = {}
+
+        def update(counted, total):
+            rate = rates.get(counted)
+            if rate is None:
+                # the first sample, there is no speed yet
+                rate = _Rate(total, snapshot.time)
+                new_rates[counted] = rate
+                return 0
+            new_rates[counted] = rate
+            return rate.update(total, snapshot.time, self.smoothing)
+
+        snapshot.download_list = self._manager.get_download_list_copy()
+        for download in snapshot.download_list:
+            sources = download.get_copy_of_sources()
+            snapshot.download_sources[download] = sources
+            state = download.state
+            if state != DownloadState.loading:
+                cached = idle.get(download)
+                if cached is not None and cached[0] == state:
+                    new_idle[download] = cached
                 else:
-                    changed_bytes.append((download,
-                                                download.get_bytes_loaded()))
-                    latest_bytes[download] = (now,
-                                                download.get_bytes_loaded())
-
-            for (download, bytes) in changed_bytes:
-                self.download_bytes_changed_event.signal(download, bytes)
-
-            for (download, speed) in changed_speed:
-                self.download_speed_changed_event.signal(download, speed)
-
-            self.speed_changed_event.signal(global_speed)
-            sleep(1)
-
+                    new_idle[download] = (state, download.get_bytes_loaded())
+                snapshot.loaded[download] = new_idle[download][1]
+                continue
+            bytes = download.get_bytes_loaded()
+            speed = update(download, bytes)
+            snapshot.downloads[download] = (bytes, speed)
+            snapshot.loaded[download] = bytes
+            snapshot.speed += speed
+            for source in sources:
+                snapshot.sources[source] = update(
+                                    source, source.bytes_received.get_value())
+            for slot in download.get_slots():
+                snapshot.slots[slot] = update(slot, slot.bytes_received)
+        snapshot.pools = [slot_pool.get_stats(), clean_up_pool.get_stats()]
+        return new_rates, new_idle
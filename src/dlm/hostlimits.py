@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The hostlimits-module contains the HostLimits-class.
+
+HostLimits limits the number of parallel connections to each host. The
+limits are shared by all downloads and sources.
+
+is_refusal: returns True if an error means that the host refused
+            another connection
+"""
+
+from errno import ECONNREFUSED
+from re import search, match
+from threading import Condition
+from urllib2 import HTTPError
+from urlparse import urlparse
+
+from clock import monotonic
+
+
+def is_refusal(error):
+    """Returns True if the error means that the host refused another
+    connection: HTTP 429 (Too Many Requests) or 503 (Service
+    Unavailable), FTP 421 (too many users) or a refused TCP connection.
+    Other errors, e.g. 404 or a timeout, are no refusals.
+
+    error -- the exception raised by the Connection
+    """
+    if isinstance(error, HTTPError):
+        return error.code in (429, 503)
+    reason = getattr(error, 'reason', error)
+    if getattr(reason, 'errno', None) == ECONNREFUSED:
+        return True
+    reply = str(reason)
+    return 'ftp' in reply.lower() and search(r'\b421\b', reply) is not None
+
+
+class HostLimits:
+    """HostLimits is a registry of the connections to each host.
+
+    A DataSlot acquires a connection to the host of its Source before it
+    opens a Connection and waits if the limit of the host is reached.
+
+    The limit of a host is either set by the user (override) or learned:
+    if a host refuses a connection (see is_refusal) before any data was
+    received while other connections to the host are loading, the
+    number of these connections is the limit of the host. A learned
+    limit expires after learned_limit_time seconds, so the host is
+    probed again, e.g. when it was only overloaded for a while.
+    Hosts without a limit are not limited.
+
+    Public instance variables:
+    learned_limit_time -- the number of seconds a learned limit is kept
+    """
+
+    @staticmethod
+    def get_host(url):
+        """Returns the host name of the url in lower case."""
+        host = urlparse(url).hostname
+        if host is None:
+            return ''
+        return host.lower()
+
+    @staticmethod
+    def is_limit_string_valid(limit_string):
+        """Returns True if the string has the format
+        "host=limit;host=limit", otherwise False.
+        """
+        regex = r'^[^;=]+=\s*\d+\s*(;[^;=]+=\s*\d+\s*)*$'
+        return match(regex, limit_string) is not None
+
+    def __init__(self):
+        self._condition = Condition()
+        # host --> number of connections
+        self._active = {}
+        # host --> (limit, expiry time) learned from refused connections
+        self._learned = {}
+        self.learned_limit_time = 300
+        # host --> limit set by the user
+        self._overrides = {}
+
+    def set_limit_string(self, limit_string):
+        """Set the user limits from a "host=limit;host=limit" string.
+
+        An empty string removes all user limits. Invalid strings are
+        ignored. Limits of 0 are ignored, too.
+        """
+        overrides = {}
+        if limit_string.strip() != '':
+            if not HostLimits.is_limit_string_valid(limit_string):
+                return
+            items = limit_string.split(';')
+        else:
+            items = []
+        for item in items:
+            host, limit = item.split('=')
+            if int(limit) > 0:
+                overrides[host.strip().lower()] = int(limit)
+        with self._condition:
+            self._overrides = overrides
+            self._condition.notifyAll()
+
+    def get_limit(self, url):
+        """Returns the connection limit of the host of the url or None if
+        the host is not limited.
+        """
+        host = HostLimits.get_host(url)
+        with self._condition:
+            return self._get_limit(host)
+
+    def has_capacity(self, url):
+        """Returns True if another connection to the host of the url may
+        be opened without waiting.
+        """
+        host = HostLimits.get_host(url)
+        with self._condition:
+            return self._has_capacity(host)
+
+    def acquire(self, url, download):
+        """Wait until another connection to the host of the url may be
+        opened.
+
+        Returns True if the connection was acquired. If the download
+        stops loading while waiting, False is returned. Then nothing
+        needs to be released.
+
+        url -- the url which will be loaded
+        download -- the Download which wants to open the connection
+        """
+        host = HostLimits.get_host(url)
+        with self._condition:
+            while not self._has_capacity(host):
+                if not download.is_loading():
+                    return False
+                self._condition.wait()
+            if not download.is_loading():
+                return False
+            self._active[host] = self._active.get(host, 0) + 1
+        return True
+
+    def try_acquire(self, url):
+        """Acquire a connection to the host of the url without waiting.
+
+        Returns True if the connection was acquired, False if the limit
+        of the host is reached.
+        """
+        host = HostLimits.get_host(url)
+        with self._condition:
+            if not self._has_capacity(host):
+                return False
+            self._active[host] = self._active.get(host, 0) + 1
+        return True
+
+    def release(self, url):
+        """Release a connection acquired by acquire or try_acquire."""
+        host = HostLimits.get_host(url)
+        with self._condition:
+            active = self._active.get(host, 0) - 1
+            if active <= 0:
+                self._active.pop(host, None)
+            else:
+                self._active[host] = active
+            self._condition.notifyAll()
+
+    def report_refusal(self, url):
+        """Tell the registry that the host of the url refused a
+        connection (see is_refusal) before any data was received.
+
+        The connection must still be acquired. If other connections to
+        the host are open, the host is limited to their number for
+        learned_limit_time seconds and True is returned. Then the
+        failure was caused by the limit, so the slot should not count it
+        as a retry. Otherwise False is returned.
+        """
+        host = HostLimits.get_host(url)
+        with self._condition:
+            others = self._active.get(host, 0) - 1
+            if others <= 0 or host in self._overrides:
+                return False
+            self._learned[host] = (others,
+                                   monotonic() + self.learned_limit_time)
+            return True
+
+    def wake_up(self):
+        """Let waiting slots check their download again.
+
+        This should be called when the state of a download has changed.
+        """
+        with self._condition:
+            self._condition.notifyAll()
+
+    def _get_limit(self, host):
+        if host in self._overrides:
+            return self._overrides[host]
+        learned = self._learned.get(host)
+        if learned is None:
+            return None
+        limit, expiry = learned
+        if monotonic() >= expiry:
+            del self._learned[host]
+            return None
+        return limit
+
+    def _has_capacity(self, host):
+        limit = self._get_limit(host)
+        return limit is None or self._active.get(host, 0) < limit
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The localserver-module contains what the HTTP servers of mkdlm share,
+the MetricsServer (see metrics.py) and the ControlServer (see
+control.py).
+
+state_names: the names of the DownloadStates by value
+UnixHTTPServer: an HTTP server bound to a unix socket
+is_socket_in_use: checks if a server accepts connections on a unix socket
+create_server: binds an HTTP server to a TCP address or a unix socket
+"""
+
+from BaseHTTPServer import HTTPServer
+from SocketServer import UnixStreamServer
+import errno
+import os
+import socket
+
+from download import DownloadState
+
+
+state_names = dict((value, name) for name, value
+                   in vars(DownloadState).items()
+                   if not name.startswith('_'))
+
+
+class UnixHTTPServer(UnixStreamServer):
+
+    def get_request(self):
+        request, client_address = UnixStreamServer.get_request(self)
+        # BaseHTTPRequestHandler expects a (host, port)-tuple
+        return (request, ('', 0))
+
+
+def is_socket_in_use(path):
+    """Returns True if a server accepts connections on the unix socket
+    path.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def create_server(address, handler):
+    """Bind an HTTP server with the request handler class to the
+    address.
+
+    address -- 'host:port' (host defaults to 127.0.0.1) or
+               'unix:/path/to/socket'. An existing unix socket is only
+               replaced if no server accepts connections on it, e.g.
+               if it was left over by a process which was killed.
+
+    Returns a (server, unix path)-tuple. The unix path is None for a TCP
+    address.
+    Raises socket.error if the address cannot be bound or another
+    server uses the unix socket.
+    """
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if os.path.exists(path):
+            if is_socket_in_use(path):
+                raise socket.error(errno.EADDRINUSE,
+                                   'Another server uses ' + path)
+            os.remove(path)
+        return (UnixHTTPServer(path, handler), path)
+    host, sep, port = address.rpartition(':')
+    return (HTTPServer((host or '127.0.0.1', int(port)), handler), None)
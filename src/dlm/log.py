@@ -22,18 +22,45 @@ Log: This is a log for messages.
 MessageType: This class can be used to specify the type of a message.
 """
 
+from collections import deque
 from datetime import datetime
+import gzip
+import os
+from tempfile import mkstemp
 from threading import Lock
 
+from clock import monotonic
 from event.eventlistener import EventListener
 
 
 class MessageType:
-    """Used to specify the type of a message."""
+    """Used to specify the type of a message.
+
+    debug messages are details which are only needed to find problems,
+    e.g. each chunk a slot loads. They are not logged by default (see
+    Log.set_threshold).
+    """
 
     info = 0
     error = 1
     warning = 2
+    debug = 3
+
+
+# the severity of each MessageType, see Log.set_threshold
+_severity = {MessageType.debug: 0, MessageType.info: 1,
+             MessageType.warning: 2, MessageType.error: 3}
+
+
+def _get_key_args(type, args):
+    """Returns the part of the arguments of a message which is used to
+    detect repeats: the text of the arguments of warnings and errors
+    (exceptions are compared by their text, not by identity), None for
+    other messages.
+    """
+    if not args or _severity[type] < _severity[MessageType.warning]:
+        return None
+    return repr(args)
 
 
 class Log:
@@ -44,7 +71,40 @@ class Log:
     Listeners can be added that will be called when a new message was
     added.
 
+    Messages less severe than the threshold (see set_threshold) are
+    dropped at once. The message text may be a format string whose
+    arguments are passed to add_log_entry. It is only formatted if the
+    message is logged, so dropped messages cost almost nothing.
+
+    Messages of retry loops, e.g. when a slot retries a failing source
+    again and again, are added with add_repeated_log_entry. They are
+    logged only once within repeat_window seconds (see
+    clock.monotonic). Messages are repeated if they have the same
+    MessageType, name and format string. Warnings and errors must have
+    the same arguments too, so e.g. different errors are all logged. The
+    number of repeats is logged when the message occurs again after the
+    window or when flush is called. Messages added with add_log_entry
+    are always logged.
+
+    Only the last capacity messages are kept in memory (a ring buffer),
+    so the memory used by a log does not grow with the uptime. If
+    spill_folder is set, older messages are written compressed to a file
+    in this folder and can still be read with get_messages. Otherwise
+    they are dropped.
+    Each message has an index: the first message has the index 0, the
+    next one 1 etc.. The indexes do not change when older messages are
+    dropped, so the log can be read in pages.
+
+    Public class variables:
+    threshold -- the least severe MessageType which is logged
+    repeat_window -- the number of seconds in which repeated messages
+                     are logged only once. 0 logs all messages.
+    default_capacity -- the capacity of new logs
+    spill_folder -- the folder of the spill files of the logs or None.
+                    The files are removed by close.
+
     Public instance variables:
+    capacity -- the maximum number of messages kept in memory
     message_added_event -- An event.eventlistener.EventListener object.
                            The event is signalled when a new message was
                            added to the log.
@@ -55,25 +115,344 @@ class Log:
                            name and the message itself.
     """
 
-    def __init__(self):
-        """Initialize the Log."""
+    threshold = MessageType.info
+    _min_severity = _severity[MessageType.info]
+    repeat_window = 10
+    default_capacity = 1000
+    spill_folder = None
+
+    # the number of dropped messages written to the spill file at once
+    _spill_batch = 100
+    _time_format = '%Y-%m-%d %H:%M:%S.%f'
+
+    def __init__(self, capacity=None):
+        """Initialize the Log.
+
+        capacity -- the maximum number of messages kept in memory. The
+                    default is default_capacity.
+        """
         self._messages_lock = Lock()
-        self._messages = []
+        if capacity is None:
+            capacity = Log.default_capacity
+        self.capacity = max(int(capacity), 1)
+        self._messages = deque()
+        # the index of the next message
+        self._count = 0
         self.message_added_event = EventListener()
+        # the added messages whose message_added_event has not been
+        # signalled yet. They are signalled after the messages lock was
+        # released, so slow listeners do not block other threads.
+        self._unsignalled = []
 
-    def add_log_entry(self, type, name, message):
+        # held while the spill file is written or read. It is acquired
+        # before the messages lock is released, so the batches are
+        # written in order.
+        self._spill_lock = Lock()
+        self._spill_path = None
+        # the index of the first message in the spill file
+        self._spill_first = None
+        # the dropped messages which are not written yet
+        self._spill_buffer = []
+        # (type, name, message, key args) --> [time of the logged
+        # message, number of repeats, arguments of the last repeat]
+        self._repeats = {}
+
+    @staticmethod
+    def set_threshold(type):
+        """Change the least severe MessageType which is logged by all
+        logs.
+        """
+        Log.threshold = type
+        Log._min_severity = _severity[type]
+
+    def add_log_entry(self, type, name, message, *args):
         """Add a new message to the log.
 
+        If the log is full, the oldest message is dropped or spilled.
+
         type -- the MessageType of the log entry
         name -- the name of the owner of the message
-        message -- the message to add
+        message -- the message to add. If args are given, it is a format
+                   string (see str.format).
+        args -- the arguments of the format string
+        """
+        if _severity[type] < Log._min_severity:
+            return
+        if args:
+            message = message.format(*args)
+        with self._messages_lock:
+            batch = self._add_message((type, datetime.today(), name, message))
+            messages = self._take_unsignalled()
+        self._signal_messages(messages)
+        self._write_batch(batch)
+
+    def add_repeated_log_entry(self, type, name, message, *args):
+        """Add a message of a retry loop to the log.
+
+        The message is only logged once within repeat_window seconds,
+        the repeats are counted (see the class description). Otherwise
+        it is the same as add_log_entry.
+        """
+        if _severity[type] < Log._min_severity:
+            return
+        with self._messages_lock:
+            if Log.repeat_window > 0:
+                now = monotonic()
+                key = (type, name, message, _get_key_args(type, args))
+                repeat = self._repeats.get(key)
+                if repeat is not None and now - repeat[0] < Log.repeat_window:
+                    repeat[1] += 1
+                    repeat[2] = args
+                    return
+                if len(self._repeats) >= 256:
+                    self._flush_repeats(now)
+                elif repeat is not None and repeat[1] > 0:
+                    self._add_repeat_message(key, repeat, now)
+                self._repeats[key] = [now, 0, args]
+            if args:
+                message = message.format(*args)
+            batch = self._add_message((type, datetime.today(), name, message))
+            messages = self._take_unsignalled()
+        self._signal_messages(messages)
+        self._write_batch(batch)
+
+    def flush(self):
+        """Log the number of repeats of the repeated messages."""
+        with self._messages_lock:
+            self._flush_repeats(None)
+            batch = self._get_spill_batch()
+            messages = self._take_unsignalled()
+        self._signal_messages(messages)
+        self._write_batch(batch)
+
+    def set_capacity(self, capacity):
+        """Change the maximum number of messages kept in memory."""
+        batch = None
+        with self._messages_lock:
+            self.capacity = max(int(capacity), 1)
+            while len(self._messages) > self.capacity:
+                self._drop_message()
+            batch = self._get_spill_batch(1)
+        self._write_batch(batch)
+
+    def get_message_count(self):
+        """Returns the number of messages added to the log, including
+        the dropped ones. It is the index of the next message.
         """
-        new_message = (type, datetime.today(), name, message)
         with self._messages_lock:
-            self._messages.append(new_message)
-            self.message_added_event.signal(self, new_message)
+            return self._count
+
+    def get_first_index(self):
+        """Returns the index of the oldest message which can be read."""
+        with self._messages_lock:
+            if self._spill_first is not None:
+                return self._spill_first
+            return self._count - len(self._messages)
+
+    def get_messages(self, start, count):
+        """Returns a list of the messages with the indexes start to
+        start + count - 1. Messages which were dropped are left out.
+
+        Spilled messages are read from the spill file, which is slow for
+        old messages of long logs.
+        """
+        start = max(start, 0)
+        end = start + max(count, 0)
+        with self._messages_lock:
+            first = self._count - len(self._messages)
+            messages = [self._messages[i - first]
+                        for i in xrange(max(start, first),
+                                        min(end, self._count))]
+            if start >= first or self._spill_first is None:
+                return messages
+            # the buffered messages are the last spilled ones
+            buffer_first = first - len(self._spill_buffer)
+            buffered = [self._spill_buffer[i - buffer_first]
+                        for i in xrange(max(start, buffer_first),
+                                        min(end, first))]
+            self._spill_lock.acquire()
+        try:
+            spilled = self._read_spill(start, min(end, buffer_first))
+        finally:
+            self._spill_lock.release()
+        return spilled + buffered + messages
 
     def get_copy_of_messages(self):
+        """Returns a list of the messages kept in memory."""
         with self._messages_lock:
-            copy = self._messages[:]
+            copy = list(self._messages)
         return copy
+
+    def close(self):
+        """Remove the spill file. The spilled messages are lost."""
+        with self._messages_lock:
+            self._spill_buffer = []
+            self._spill_lock.acquire()
+            path = self._spill_path
+            self._spill_path = None
+            self._spill_first = None
+        try:
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        finally:
+            self._spill_lock.release()
+
+    def _add_message(self, message):
+        """Appends the message. The messages lock must be held.
+
+        Returns a batch of spilled messages which must be written by
+        _write_batch after the messages lock was released. The message
+        must be signalled by _signal_messages after the messages lock
+        was released, too (see _take_unsignalled).
+        """
+        self._messages.append(message)
+        self._count += 1
+        self._unsignalled.append(message)
+        while len(self._messages) > self.capacity:
+            self._drop_message()
+        return self._get_spill_batch()
+
+    def _take_unsignalled(self):
+        """Returns the messages which have not been signalled yet and
+        forgets them. The messages lock must be held.
+        """
+        if not self._unsignalled:
+            return None
+        messages = self._unsignalled
+        self._unsignalled = []
+        return messages
+
+    def _signal_messages(self, messages):
+        """Signals message_added_event for the messages returned by
+        _take_unsignalled. The messages lock must not be held.
+        """
+        if messages is None:
+            return
+        for message in messages:
+            self.message_added_event.signal(self, message)
+
+    def _add_repeat_message(self, key, repeat, now):
+        """Logs the number of repeats of a message. The messages lock
+        must be held.
+        """
+        type, name, message = key[:3]
+        start, repeats, args = repeat
+        if args:
+            message = message.format(*args)
+        message = '{0} (repeated {1} times in {2:.0f} seconds)'.format(
+                                            message, repeats, now - start)
+        batch = self._add_message((type, datetime.today(), name, message))
+        if batch is not None:
+            # the batch is written while the messages lock is held, but
+            # this happens only once per batch and window
+            self._write_batch(batch)
+
+    def _flush_repeats(self, now):
+        """Logs the repeats of all messages and forgets the messages
+        whose window has passed (all messages if now is None). The
+        messages lock must be held.
+        """
+        end = now if now is not None else monotonic()
+        for key, repeat in self._repeats.items():
+            if now is None or now - repeat[0] >= Log.repeat_window:
+                del self._repeats[key]
+                if repeat[1] > 0:
+                    self._add_repeat_message(key, repeat, end)
+
+    def _get_spill_batch(self, size=None):
+        """Returns the spill buffer if it has at least size messages
+        (the batch size by default) and acquires the spill lock, so the
+        batches are written in order. Otherwise None is returned. The
+        messages lock must be held.
+        """
+        if size is None:
+            size = Log._spill_batch
+        if not self._spill_buffer or len(self._spill_buffer) < size:
+            return None
+        batch = self._spill_buffer
+        self._spill_buffer = []
+        self._spill_lock.acquire()
+        return batch
+
+    def _write_batch(self, batch):
+        """Writes a batch returned by _get_spill_batch and releases the
+        spill lock.
+        """
+        if batch is None:
+            return
+        try:
+            self._write_spill(batch)
+        finally:
+            self._spill_lock.release()
+
+    def _drop_message(self):
+        """Drops the oldest message kept in memory. The messages lock
+        must be held.
+        """
+        message = self._messages.popleft()
+        if self._spill_first is None:
+            if Log.spill_folder is None:
+                return
+            # spill from this message on
+            self._spill_first = self._count - len(self._messages) - 1
+        self._spill_buffer.append(message)
+
+    def _write_spill(self, batch):
+        """Appends the messages to the spill file. Each batch is a
+        gzip member, so no compressor state must be kept between
+        batches. The spill lock must be held.
+        """
+        try:
+            if self._spill_path is None:
+                folder = Log.spill_folder
+                if not os.path.isdir(folder):
+                    os.makedirs(folder)
+                fd, self._spill_path = mkstemp(suffix='.log.gz', dir=folder)
+                os.close(fd)
+            lines = []
+            for type, stamp, name, message in batch:
+                lines.append('{0}\t{1}\t{2}\t{3}\n'.format(type,
+                                stamp.strftime(Log._time_format),
+                                self._escape(name), self._escape(message)))
+            with open(self._spill_path, 'ab') as f:
+                gz = gzip.GzipFile(fileobj=f, mode='wb')
+                gz.write(''.join(lines))
+                gz.close()
+        except (IOError, OSError):
+            # the log must not break the download. The messages are
+            # lost.
+            pass
+
+    def _read_spill(self, start, end):
+        """Returns the spilled messages with the indexes start to
+        end - 1. The spill lock must be held.
+        """
+        messages = []
+        if self._spill_path is None or start >= end:
+            return messages
+        index = self._spill_first
+        try:
+            with gzip.open(self._spill_path, 'rb') as f:
+                for line in f:
+                    if index >= end:
+                        break
+                    if index >= start:
+                        type, stamp, name, message = (line.rstrip('\n').
+                                                      split('\t'))
+                        messages.append((int(type),
+                                datetime.strptime(stamp, Log._time_format),
+                                name.decode('string_escape'),
+                                message.decode('string_escape')))
+                    index += 1
+        except (IOError, OSError, ValueError):
+            pass
+        return messages
+
+    @staticmethod
+    def _escape(text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return str(text).encode('string_escape')
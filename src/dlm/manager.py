@@ -15,24 +15,77 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
-from threading import Lock, RLock
-from time import sleep
+from heapq import heappush, heappop
+from threading import Condition, Lock, RLock
 
+from connectionbudget import ConnectionBudget
 from download import DownloadState, Download
 from downloadmeter import DownloadMeter
 from event.eventlistener import EventListener
+from hostlimits import HostLimits
+from prefetcher import InfoPrefetcher
+from log import MessageType
+from metrics import MetricsServer
+from timerwheel import timer_wheel
 
 
 class Manager:
+    """The Manager holds all downloads and starts ready downloads as long
+    as less than max_parallel_downloads downloads are active.
+
+    Ready downloads are started in order of their priority (highest
+    first). Downloads with the same priority are started in list order.
+    If preemption is enabled and all active "places" are taken, active
+    downloads with a lower priority than the next ready download are
+    paused. They are set to ready again automatically, once they are
+    paused.
+
+    To avoid scanning all downloads on every state change, the Manager
+    keeps two indexes which are updated by the status_changed_event of
+    the downloads:
+    _ready_queue -- a heap of ((-priority, order), download)-tuples. It
+                    may contain downloads which are not ready anymore or
+                    whose priority has changed. They are skipped when
+                    popped.
+    _active -- the set of downloads which are loading or fetching info
+
+    downloads_added_event is signalled with a list of the new downloads
+    whenever downloads are added.
+
+    The connections of all downloads are limited by connection_budget
+    (a connectionbudget.ConnectionBudget, unlimited by default) and the
+    connections to each host by host_limits (a hostlimits.HostLimits).
+    The information of the next ready downloads is fetched in the
+    background by info_prefetcher (a prefetcher.InfoPrefetcher).
+    metrics_server is the metrics.MetricsServer exposing the metrics of
+    the Manager or None if disabled (see set_metrics_address).
+    """
+
     def __init__(self):
         self._download_list_lock = RLock()
         self._downloads = []
-        self.download_added_event = EventListener()
+        # download --> position in the download list (add order)
+        self._order = {}
+        self._next_order = 0
+        self._ready_queue = []
+        # download --> key of its (valid) entry in the ready queue
+        self._queued = {}
+        self._active = set()
+        # downloads which were paused by preemption
+        self._preempted = set()
+        self.preemption = False
+        self.connection_budget = ConnectionBudget()
+        self.host_limits = HostLimits()
+        self.info_prefetcher = InfoPrefetcher()
+        self.downloads_added_event = EventListener()
         self.max_parallel_downloads_changed_event = EventListener()
         self.download_meter = DownloadMeter(self)
+        self.metrics_server = None
         self.download_meter.start()
         self._active_downloads = 0
         self._quit = False
+        # notified on every state change of a download (see quit)
+        self._state_condition = Condition()
         self.set_max_parallel_downloads(1)
 
     def create_downloads_from_list(self, list):
@@ -49,11 +102,34 @@ class Manager:
         return downloads
 
     def add_download(self, download):
-        download.status_changed_event.add_listener(
+        """Add a download. See add_downloads."""
+        self.add_downloads([download])
+
+    def add_downloads(self, downloads):
+        """Add many downloads at once.
+
+        The downloads are inserted while holding the lock of the download
+        list only once. Then downloads_added_event is signalled once with
+        all downloads and the ready downloads are started in a single
+        scheduling pass.
+
+        downloads -- an iterable of Download-objects
+        """
+        downloads = list(downloads)
+        for download in downloads:
+            download.status_changed_event.add_listener(
                                             self._on_download_status_changed)
+            download.priority_changed_event.add_listener(
+                                            self._on_download_priority_changed)
+            download.connection_budget = self.connection_budget
+            download.host_limits = self.host_limits
         with self._download_list_lock:
-            self._downloads.append(download)
-        self.download_added_event.signal(download)
+            for download in downloads:
+                self._downloads.append(download)
+                self._order[download] = self._next_order
+                self._next_order += 1
+                self._index_download(download)
+        self.downloads_added_event.signal(downloads)
         self._update_manager()
 
     def remove_download(self, download):
@@ -69,23 +145,46 @@ class Manager:
                 else:
                     download.status_changed_event.remove_listener(
                                             self._on_download_status_changed)
+                    download.priority_changed_event.remove_listener(
+                                            self._on_download_priority_changed)
+                    # entries in the ready queue are skipped lazily
+                    del self._order[download]
+                    self._queued.pop(download, None)
+                    self._preempted.discard(download)
+                    self._active.discard(download)
+                    self._active_downloads = len(self._active)
+                    download.connection_budget = None
+                    download.host_limits = None
+        if removed:
+            # remove the spill file of the log
+            download.log.close()
         return removed
 
     def quit(self):
+        """Pause all active downloads and wait until they are stopped."""
         with self._download_list_lock:
             self._quit = True
-            self.download_meter.stop()
-            for download in self._downloads:
-                while (download.state == DownloadState.fetching_info or
-                        download.state == DownloadState.loading):
-                    download.pause()
-            # wait for downloads
-            for download in self._downloads:
+            downloads = self._downloads[:]
+        self.download_meter.stop()
+        self.info_prefetcher.stop()
+        self.set_metrics_address(None)
+        for download in downloads:
+            while (download.state == DownloadState.fetching_info or
+                    download.state == DownloadState.loading):
+                download.pause()
+        # wait for downloads. The download list lock is not held, because
+        # the clean-ups signal the state changes.
+        with self._state_condition:
+            for download in downloads:
                 while (download.state == DownloadState.fetching_info or
                         download.state == DownloadState.loading or
                         download.state == DownloadState.stopping):
-                    sleep(0.2)
-
+                    self._state_condition.wait()
+        # the logs are not saved, so their spill files are not needed
+        for download in downloads:
+            download.log.close()
+        # the thread must not run while the interpreter shuts down
+        timer_wheel.stop()
 
     def get_download_list_copy(self):
         with self._download_list_lock:
@@ -97,41 +196,172 @@ class Manager:
         self.max_parallel_downloads_changed_event.signal()
         self._update_manager()
 
-    def _get_next_ready_download(self):
-        result = None
+    def set_metrics_address(self, address):
+        """Start, move or stop the MetricsServer.
+
+        address -- 'host:port', 'unix:/path/to/socket' or None to stop
+                   the server
+
+        Raises socket.error if the address cannot be bound.
+        """
+        if (self.metrics_server is not None and
+                self.metrics_server.address == address):
+            return
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if address:
+            self.metrics_server = MetricsServer(self, address)
+            self.metrics_server.start()
+
+    def set_preemption(self, preemption):
+        """Enable or disable pausing active downloads in favour of ready
+        downloads with a higher priority.
+        """
+        self.preemption = bool(preemption)
+        self._update_manager()
+
+    def _queue_key(self, download):
+        return (-download.priority, self._order[download])
+
+    def _index_download(self, download):
+        """Update the ready queue and the set of active downloads for the
+        current state of the download.
+
+        Must be called while _download_list_lock is held.
+        """
+        if download not in self._order:
+            # download was removed
+            return
+        state = download.state
+        if (state == DownloadState.loading or
+                state == DownloadState.fetching_info):
+            self._active.add(download)
+        else:
+            self._active.discard(download)
+            key = self._queue_key(download)
+            if (state == DownloadState.ready and
+                    self._queued.get(download) != key):
+                # a previous entry with another priority becomes stale
+                self._queued[download] = key
+                heappush(self._ready_queue, (key, download))
+        self._active_downloads = len(self._active)
+
+    def _get_next_ready_download(self, pop=True):
+        """Return the ready download with the highest priority.
+
+        Entries of downloads which are not ready anymore, which were
+        removed or whose priority has changed are dropped. If there is
+        no ready download, None is returned.
+
+        pop -- if True, the download is removed from the ready queue
+        """
         with self._download_list_lock:
-            for download in self._downloads:
+            while len(self._ready_queue) > 0:
+                key, download = self._ready_queue[0]
+                if self._queued.get(download) != key:
+                    # stale entry, e.g. the download was removed
+                    heappop(self._ready_queue)
+                    continue
+                if download.state != DownloadState.ready or pop:
+                    heappop(self._ready_queue)
+                    del self._queued[download]
                 if download.state == DownloadState.ready:
-                    result = download
-                    break
-        return result
+                    return download
+        return None
+
+    def _get_ready_downloads(self, count):
+        """Return up to count ready downloads in the order they will be
+        started. The downloads stay in the ready queue.
 
-    def _update_active_downloads(self):
-        active = 0
+        Only the top of the heap is visited, so this does not depend on
+        the number of queued downloads.
+        """
+        downloads = []
         with self._download_list_lock:
-            for download in self._downloads:
-                if (download.state == DownloadState.loading or
-                        download.state == DownloadState.fetching_info):
-                    active += 1
-        self._active_downloads = active
+            queue = self._ready_queue
+            # (entry, index in queue)-tuples; the children of an entry
+            # are the next candidates
+            candidates = []
+            if len(queue) > 0:
+                candidates.append((queue[0], 0))
+            while len(candidates) > 0 and len(downloads) < count:
+                (key, download), i = heappop(candidates)
+                if (self._queued.get(download) == key and
+                        download.state == DownloadState.ready):
+                    downloads.append(download)
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(queue):
+                        heappush(candidates, (queue[child], child))
+        return downloads
+
+    def _preempt(self):
+        """Pause active downloads with a lower priority than the next
+        ready download if there is no place for another active download.
+
+        The paused downloads will be set to ready again in
+        _on_download_status_changed.
+        """
+        with self._download_list_lock:
+            while (self.max_parallel_downloads > 0 and
+                    len(self._active) >= self.max_parallel_downloads):
+                download = self._get_next_ready_download(pop=False)
+                if download is None:
+                    return
+                lowest = min(self._active, key=lambda d: d.priority)
+                if download.priority <= lowest.priority:
+                    return
+                lowest.log.add_log_entry(MessageType.info, 'Manager',
+                        'Pausing for a download with a higher priority')
+                self._preempted.add(lowest)
+                if not lowest.pause():
+                    self._preempted.discard(lowest)
+                    return
 
     def _update_manager(self):
         with self._download_list_lock:
-            self._update_active_downloads()
-            if (not self._quit and
-                    self._active_downloads < self.max_parallel_downloads or
-                    self.max_parallel_downloads == 0):
-                # we can start more downloads
-                startable = (self.max_parallel_downloads -
-                                self._active_downloads)
-                while startable > 0 or startable < 0:
-                    download = self._get_next_ready_download()
-                    if download is None:
-                        # no more ready downloads exist
-                        break
-                    download.start()
-                    startable -= 1
+            # Starting a download changes its state. So the set of active
+            # downloads is updated while looping (see _index_download).
+            while (not self._quit and
+                    (len(self._active) < self.max_parallel_downloads or
+                     self.max_parallel_downloads == 0)):
+                download = self._get_next_ready_download()
+                if download is None:
+                    # no more ready downloads exist
+                    break
+                download.start()
+                if download.state == DownloadState.ready:
+                    # The state could not be changed, e.g. because a
+                    # clean-up holds the state lock. Queue the download
+                    # again, it is started on the next state change.
+                    self._index_download(download)
+                    break
+
+            if self.preemption and not self._quit:
+                self._preempt()
 
+            if self.info_prefetcher.count > 0 and not self._quit:
+                self.info_prefetcher.prefetch(
+                        self._get_ready_downloads(self.info_prefetcher.count))
 
     def _on_download_status_changed(self, download):
-        self._update_manager()
+        with self._state_condition:
+            self._state_condition.notifyAll()
+        with self._download_list_lock:
+            self._index_download(download)
+            # waiting slots of stopped downloads need to exit
+            self.connection_budget.wake_up()
+            self.host_limits.wake_up()
+            if (download.state == DownloadState.paused and
+                    download in self._preempted):
+                # queue the download again (see _preempt)
+                self._preempted.discard(download)
+                download.ready()
+            self._update_manager()
+
+    def _on_download_priority_changed(self, download):
+        with self._download_list_lock:
+            self._index_download(download)
+            # the shares may be weighted by priority
+            self.connection_budget.wake_up()
+            self._update_manager()
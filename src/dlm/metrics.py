@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The metrics-module contains the MetricsServer-class.
+
+The MetricsServer exposes the state of a Manager in the text format of
+Prometheus (see https://prometheus.io/docs/instrumenting/exposition_formats/)
+on a local HTTP endpoint.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from threading import Thread
+import os
+
+import connection
+from downloadmeter import MeterSnapshot
+from localserver import create_server, state_names
+import targetfile
+
+
+def _escape(value):
+    """Escape a label value. Byte strings, e.g. file names, are decoded
+    as UTF-8, invalid bytes are replaced.
+    """
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    else:
+        value = unicode(value)
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n').encode('utf-8'))
+
+
+class _Metrics:
+    """Collects the samples of the metrics in the exposition format."""
+
+    def __init__(self):
+        self._lines = []
+
+    def add(self, name, type, help, samples):
+        """Add a metric.
+
+        name -- the name of the metric
+        type -- 'counter', 'gauge' or 'histogram'
+        help -- the description of the metric
+        samples -- a list of (suffix, labels, value)-tuples. labels is a
+                   list of (name, value)-tuples.
+        """
+        self._lines.append('# HELP {0} {1}'.format(name, help))
+        self._lines.append('# TYPE {0} {1}'.format(name, type))
+        for suffix, labels, value in samples:
+            if labels:
+                labels = '{' + ','.join('{0}="{1}"'.format(n, _escape(v))
+                                        for n, v in labels) + '}'
+            else:
+                labels = ''
+            self._lines.append('{0}{1}{2} {3}'.format(name, suffix, labels,
+                                                      repr(float(value))))
+
+    def get_text(self):
+        return '\n'.join(self._lines) + '\n'
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics_server.get_metrics()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are not logged, the client address of a unix socket
+        # is empty anyway
+        pass
+
+
+class MetricsServer:
+    """The MetricsServer answers HTTP requests for /metrics with the
+    metrics of a Manager.
+
+    The metrics include per download the loaded bytes, speed, state,
+    slots and retries, per source the errors, received bytes and speed
+    and globally the throughput, the number of downloads in each state,
+    the queue lengths of the worker pools, the connections and the
+    latency of disk writes.
+
+    Scraping takes no lock of the Manager, the downloads or the worker
+    pools, so it does not contend with the slots: the downloads, their
+    loaded bytes, sources and speeds and the statistics of the pools
+    are taken from the last snapshot of the DownloadMeter, which
+    gathers them once per tick. So the values are up to one interval of
+    the meter old. The byte and error counters are counter.Counter
+    objects which are read without locks.
+
+    The server is bound to a TCP address ('host:port', by default only
+    reachable from localhost) or to a unix socket ('unix:/path'), see
+    localserver.create_server. A unix socket of another server is not
+    replaced.
+    """
+
+    def __init__(self, manager, address='127.0.0.1:9464'):
+        """Initialize the MetricsServer.
+
+        manager -- the Manager whose metrics are exposed
+        address -- 'host:port' or 'unix:/path/to/socket'
+        """
+        self._manager = manager
+        self.address = address
+        self._server, self._unix_path = create_server(address,
+                                                      _RequestHandler)
+        self._server.metrics_server = self
+        self._thread = Thread(target=self._server.serve_forever,
+                              name='Metrics Server')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._unix_path is not None and os.path.exists(self._unix_path):
+            os.remove(self._unix_path)
+
+    def get_metrics(self):
+        """Returns the metrics in the text format of Prometheus."""
+        manager = self._manager
+        snapshot = manager.download_meter.last_snapshot
+        if snapshot is None:
+            # the meter has not ticked yet
+            snapshot = MeterSnapshot(0, 0)
+        downloads = snapshot.download_list
+        download_speeds = snapshot.downloads
+        source_speeds = snapshot.sources
+        speed = snapshot.speed
+
+        loaded = []
+        speeds = []
+        sizes = []
+        states = []
+        slots = []
+        max_slots = []
+        retries = []
+        source_errors = []
+        source_bytes = []
+        source_rates = []
+        state_counts = dict((name, 0) for name in state_names.values())
+        for index, download in enumerate(downloads):
+            labels = [('index', index), ('filename', download.filename)]
+            bytes = snapshot.loaded[download]
+            download_speed = download_speeds.get(download, (bytes, 0))[1]
+            loaded.append(('', labels, bytes))
+            speeds.append(('', labels, download_speed))
+            if download.filesize is not None:
+                sizes.append(('', labels, download.filesize))
+            state = state_names.get(download.state, str(download.state))
+            state_counts[state] = state_counts.get(state, 0) + 1
+            states.append(('', labels + [('state', state)], 1))
+            slots.append(('', labels, download.active_slot))
+            max_slots.append(('', labels, download.max_slot))
+            download_retries = 0
+            for source in snapshot.download_sources[download]:
+                download_retries += source.retries
+                source_labels = labels + [('source', source.original_url)]
+                source_errors.append(('', source_labels,
+                                      source.errors.get_value()))
+                source_bytes.append(('', source_labels,
+                                     source.bytes_received.get_value()))
+                source_rates.append(('', source_labels,
+                                     source_speeds.get(source, 0)))
+            retries.append(('', labels, download_retries))
+
+        m = _Metrics()
+        m.add('mkdlm_download_bytes_loaded', 'gauge',
+              'Loaded bytes of the download.', loaded)
+        m.add('mkdlm_download_size_bytes', 'gauge',
+              'File size of the download if known.', sizes)
+        m.add('mkdlm_download_speed_bytes', 'gauge',
+              'Smoothed speed of the download in bytes per second.', speeds)
+        m.add('mkdlm_download_state', 'gauge',
+              'State of the download (always 1).', states)
+        m.add('mkdlm_download_slots_active', 'gauge',
+              'Slots of the download receiving data.', slots)
+        m.add('mkdlm_download_slots_max', 'gauge',
+              'Maximum number of slots of the download.', max_slots)
+        m.add('mkdlm_download_retries', 'gauge',
+              'Retries of all sources of the download.', retries)
+        m.add('mkdlm_source_errors_total', 'counter',
+              'Errors of the source.', source_errors)
+        m.add('mkdlm_source_received_bytes_total', 'counter',
+              'Bytes received from the source.', source_bytes)
+        m.add('mkdlm_source_speed_bytes', 'gauge',
+              'Smoothed speed of the source in bytes per second.',
+              source_rates)
+
+        m.add('mkdlm_speed_bytes', 'gauge',
+              'Smoothed speed of all downloads in bytes per second.',
+              [('', [], speed)])
+        m.add('mkdlm_received_bytes_total', 'counter',
+              'Bytes received by all connections.',
+              [('', [], connection.bytes_received.get_value())])
+        m.add('mkdlm_downloads', 'gauge', 'Downloads in each state.',
+              [('', [('state', name)], count)
+               for name, count in sorted(state_counts.items())])
+        pool_queued = []
+        pool_busy = []
+        for stats in snapshot.pools:
+            pool_queued.append(('', [('pool', stats['name'])],
+                                stats['queued']))
+            pool_busy.append(('', [('pool', stats['name'])], stats['busy']))
+        m.add('mkdlm_pool_queued_tasks', 'gauge',
+              'Tasks waiting for a worker of the pool.', pool_queued)
+        m.add('mkdlm_pool_busy_workers', 'gauge',
+              'Workers of the pool running a task.', pool_busy)
+        budget = manager.connection_budget
+        m.add('mkdlm_connections', 'gauge', 'Data connections in use.',
+              [('', [], budget.used)])
+        m.add('mkdlm_connections_limit', 'gauge',
+              'Maximum number of data connections (0 = unlimited).',
+              [('', [], budget.limit)])
+
+        cumulative, total, count = targetfile.write_latency.get_value()
+        bounds = targetfile.write_latency.buckets
+        samples = [('_bucket', [('le', repr(float(bound)))], c)
+                   for bound, c in zip(bounds, cumulative)]
+        samples.append(('_bucket', [('le', '+Inf')], count))
+        samples.append(('_sum', [], total))
+        samples.append(('_count', [], count))
+        m.add('mkdlm_disk_write_seconds', 'histogram',
+              'Duration of writes to the target files.', samples)
+        return m.get_text()
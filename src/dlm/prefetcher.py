@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The prefetcher-module contains the InfoPrefetcher-class.
+
+The InfoPrefetcher fetches the information (real url, filename, size)
+of ready downloads before the Manager starts them.
+"""
+
+from Queue import Queue
+from threading import Lock, Thread
+
+from clock import monotonic
+from connection import Connection
+from download import DownloadState
+from log import MessageType
+
+
+class InfoPrefetcher:
+    """The InfoPrefetcher fetches the information of the next ready
+    downloads in the background.
+
+    The information is stored in the first Source of the download and
+    is valid for max_age seconds (see Source.has_fresh_infos). If the
+    download is started in this time, it does not need to fetch the
+    information again and starts loading data immediately.
+
+    At most max_parallel requests are running at the same time. The
+    requests take their connections from the connection budget and the
+    host limits of the download, but only if a connection is free.
+
+    Public instance variables:
+    count -- the number of ready downloads to prefetch. 0 disables the
+             prefetcher.
+    max_age -- the number of seconds the fetched information is valid
+    """
+
+    def __init__(self, count=2, max_age=300, max_parallel=2):
+        """Initialize the InfoPrefetcher.
+
+        count -- the number of ready downloads to prefetch
+        max_age -- the number of seconds the information is valid
+        max_parallel -- the maximum number of parallel requests
+        """
+        self.count = count
+        self.max_age = max_age
+        self._max_parallel = max_parallel
+        self._queue = Queue()
+        # downloads which are queued or being fetched
+        self._pending = set()
+        # download --> time until a failed download is not prefetched
+        self._failed = {}
+        self._lock = Lock()
+        self._workers = []
+        self._stopped = False
+
+    def prefetch(self, downloads):
+        """Fetch the information of the downloads in the background.
+
+        Downloads whose information is already known or is being
+        fetched are skipped. If prefetching has failed, the download is
+        skipped for max_age seconds.
+
+        downloads -- a list of ready downloads, the download which will
+                     be started next first
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            now = monotonic()
+            for download in downloads[:self.count]:
+                if download in self._pending or not download.needs_infos():
+                    continue
+                if self._failed.get(download, 0) > now:
+                    continue
+                self._failed.pop(download, None)
+                self._pending.add(download)
+                self._queue.put(download)
+                if len(self._workers) < self._max_parallel:
+                    worker = Thread(target=self._run, name='Info Prefetcher ' +
+                                    str(len(self._workers)))
+                    worker.daemon = True
+                    self._workers.append(worker)
+                    worker.start()
+
+    def stop(self):
+        """Stop the workers after their current request."""
+        with self._lock:
+            self._stopped = True
+            workers = self._workers[:]
+        for worker in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    def _run(self):
+        while True:
+            download = self._queue.get()
+            if download is None:
+                return
+            try:
+                # the download may have been started in the meantime
+                if download.state == DownloadState.ready:
+                    self._fetch(download)
+            except Exception, e:
+                # e.g. httplib.BadStatusLine, the worker must not die
+                download.log.add_log_entry(MessageType.warning, 'Prefetcher',
+                                'Could not prefetch information: {0!r}', e)
+                with self._lock:
+                    self._failed[download] = monotonic() + self.max_age
+            finally:
+                with self._lock:
+                    self._pending.discard(download)
+
+    def _fetch(self, download):
+        source = download.get_copy_of_sources()[0]
+        url = source.url
+        # A prefetch only uses free connections, it never waits. If none
+        # is free, the download is tried again on the next prefetch.
+        host_limits = download.host_limits
+        if host_limits is not None and not host_limits.try_acquire(url):
+            return
+        budget = download.connection_budget
+        if budget is not None and not budget.try_acquire(download):
+            if host_limits is not None:
+                host_limits.release(url)
+            return
+
+        c = Connection(source)
+        try:
+            real_url, filename, filesize = c.fetch_infos()
+        except IOError, e:
+            # not an error yet, the InfoSlot will retry when started
+            download.log.add_log_entry(MessageType.info, 'Prefetcher',
+                            'Could not prefetch information: ' + str(e))
+            with self._lock:
+                self._failed[download] = monotonic() + self.max_age
+            return
+        finally:
+            c.close()
+            if budget is not None:
+                budget.release(download)
+            if host_limits is not None:
+                host_limits.release(url)
+
+        download.set_prefetched_infos(source, real_url, filename, filesize,
+                                      c.ranges_supported,
+                                      monotonic() + self.max_age)
+        download.log.add_log_entry(MessageType.info, 'Prefetcher',
+                                    'Prefetched information')
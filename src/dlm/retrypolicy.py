@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The retrypolicy-module contains the RetryPolicy-class.
+
+A RetryPolicy decides how long a slot waits before it uses a Source
+again after an error.
+
+get_retry_after: returns the delay requested by the server with an error
+"""
+
+from email.utils import mktime_tz, parsedate_tz
+from random import uniform
+from re import search
+from time import time
+from urllib2 import HTTPError
+
+
+def get_retry_after(error):
+    """Returns the number of seconds the server asked to wait before the
+    next request or None.
+
+    HTTP servers send a Retry-After header (seconds or a date) with the
+    status codes 429 (Too Many Requests) and 503 (Service Unavailable).
+    FTP servers reply 421 if they are overloaded. Some of them tell when
+    to try again, e.g. "421 Too many users, try again in 5 minutes". If
+    a 421 reply does not contain a delay, 0 is returned and the normal
+    backoff is used.
+
+    error -- the exception raised by the Connection
+    """
+    if isinstance(error, HTTPError):
+        if error.code not in (429, 503) or error.hdrs is None:
+            return None
+        value = error.hdrs.get('Retry-After')
+        if value is None:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, mktime_tz(date) - time())
+
+    reply = str(getattr(error, 'reason', error))
+    if 'ftp' not in reply.lower() or search(r'\b421\b', reply) is None:
+        return None
+    m = search(r'(\d+)\s*(s|sec|second|m|min|minute)s?\b', reply)
+    if m is None:
+        return 0
+    if m.group(2).startswith('m'):
+        return int(m.group(1)) * 60
+    return int(m.group(1))
+
+
+class RetryPolicy:
+    """A RetryPolicy calculates the time to wait before the next retry.
+
+    The wait time grows exponentially with the number of errors in a
+    row: base * factor ** (errors - 1), but at most max_wait seconds
+    (or base seconds if base is greater). base is the wait_time of the
+    Source.
+
+    With jitter (full jitter), a random time between 0 and the
+    calculated time is used. So slots and downloads which failed at the
+    same time do not retry at the same time again, e.g. when a mirror
+    is recovering from an overload.
+
+    If the server asked to wait (see get_retry_after), the slot waits
+    at least this long, but at most max_retry_after seconds. A random
+    time of up to base seconds is added if jitter is enabled.
+
+    Public instance variables:
+    factor -- the factor the wait time grows with each error. 1 means a
+              constant wait time.
+    max_wait -- the maximum wait time in seconds
+    jitter -- True if a random part of the wait time is used
+    max_retry_after -- the maximum time in seconds a server may ask to
+                       wait
+    """
+
+    @staticmethod
+    def create_from_dict(dict):
+        return RetryPolicy(dict['factor'], dict['max_wait'], dict['jitter'],
+                           dict['max_retry_after'])
+
+    def __init__(self, factor=2, max_wait=300, jitter=True,
+                 max_retry_after=3600):
+        """Initialize the RetryPolicy.
+
+        factor -- the factor the wait time grows with each error
+        max_wait -- the maximum wait time in seconds
+        jitter -- True if a random part of the wait time is used
+        max_retry_after -- the maximum time in seconds a server may ask
+                           to wait
+        """
+        self.factor = factor
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+
+    def get_as_dict(self):
+        return {
+            'factor': self.factor,
+            'max_wait': self.max_wait,
+            'jitter': self.jitter,
+            'max_retry_after': self.max_retry_after
+        }
+
+    def get_wait_time(self, base, errors, retry_after=None):
+        """Returns the time in seconds to wait before the next retry.
+
+        base -- the wait time after the first error
+        errors -- the number of errors in a row (at least 1)
+        retry_after -- the time the server asked to wait or None
+        """
+        if retry_after is not None and retry_after > 0:
+            wait = min(retry_after, self.max_retry_after)
+            if self.jitter:
+                wait += uniform(0, base)
+            return wait
+
+        # avoid huge powers, the result is capped anyway
+        exponent = min(max(errors - 1, 0), 64)
+        wait = min(base * self.factor ** exponent, max(self.max_wait, base))
+        if self.jitter:
+            wait = uniform(0, wait)
+        return wait
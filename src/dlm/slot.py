@@ -24,19 +24,22 @@ download, for example filename and size.
 The DataSlot then can be used to download the file.
 """
 
-from threading import Thread
 from urllib2 import URLError, HTTPError
-from time import time, sleep
-from Queue import Empty
+from time import sleep
 
+from clock import monotonic
 from connection import Connection, ChunkNotFinishedError
 from event.eventlistener import EventListener
+from hostlimits import is_refusal
 from log import Log, MessageType
+from retrypolicy import get_retry_after
 from targetfile import TargetFileIOError
+from tracer import tracer
+from workerpool import Task
 
 
-class InfoSlot(Thread):
-    """The InfoSlot is a subclass of threading.Thread and can be used to
+class InfoSlot(Task):
+    """The InfoSlot is a subclass of workerpool.Task and can be used to
     load the information of a download or more precisely a Source-object
     like filename and size etc..
 
@@ -52,8 +55,7 @@ class InfoSlot(Thread):
     def __init__(self, name, source, download, success_clb, fail_clb):
         """Initialize the InfoSlot-object.
 
-        name -- the name of the slot. It is used as thread-name and when
-                logging messages.
+        name -- the name of the slot. It is used when logging messages.
         source -- the source to fetch the information from
         download -- the download holding this slot
         success_clb -- a parameter less function that will be called
@@ -70,7 +72,7 @@ class InfoSlot(Thread):
         self._success_clb = success_clb
         self._fail_clb = fail_clb
         self.connection = None
-        Thread.__init__(self, name=name)
+        Task.__init__(self, name)
 
     def run(self):
         """Called when the slot-thread is started.
@@ -91,57 +93,72 @@ class InfoSlot(Thread):
                     not self._download.is_fetching_info()):
                 return
 
+            traced = tracer.enabled
+            if traced:
+                trace_args = {'slot': self.getName(),
+                              'source': self._source.url}
+
             # maybe we need to wait some seconds between retries
             wait_until = self._source.is_retry_allowed()
             if wait_until < 0:
                 retry = False
                 continue
-            elif wait_until > 0 and wait_until - time() > 0:
-                self.log.add_log_entry(MessageType.info, self.getName(),
-                        'Retry in {0} seconds!'.format(wait_until - time()))
-                # wait until retry, but still check if state has changed
-                while time() < wait_until:
-                    sleep(0.2)
-                    if (self._download is not None and not
-                            self._download.is_fetching_info()):
-                        return
+            elif wait_until > 0 and wait_until - monotonic() > 0:
+                self.log.add_repeated_log_entry(MessageType.info,
+                        self.getName(),
+                        'Retry in {0:.1f} seconds!', wait_until - monotonic())
+                if traced:
+                    start = monotonic()
+                if self._download is None:
+                    sleep(wait_until - monotonic())
+                # wait until retry, but stop if the state has changed
+                elif not self._download.wait_until(wait_until,
+                                            self._download.is_fetching_info):
+                    return
+                if traced:
+                    tracer.add_span('retry wait', start, monotonic(),
+                                    trace_args)
 
             # Download may be paused --> stop fetching infos
             #if not self._download.is_fetching_info():
             #    return
 
             c = self.connection = Connection(self._source)
+            if traced:
+                c.trace_args = trace_args
             try:
                 real_url, filename, filesize = c.fetch_infos()
                 retry = False
                 success = True
             except HTTPError, e:
-                self._source.add_fail(False)
-                self.log.add_log_entry(MessageType.error, self.getName(),
-                                        'HTTP-Error: ' + str(e))
+                self._source.add_fail(False, get_retry_after(e))
+                self.log.add_repeated_log_entry(MessageType.error,
+                        self.getName(), 'HTTP-Error: {0}', e)
             except URLError, e:
-                self._source.add_fail(False)
-                self.log.add_log_entry(MessageType.error, self.getName(),
-                                        'Error: ' + str(e.reason))
+                self._source.add_fail(False, get_retry_after(e))
+                self.log.add_repeated_log_entry(MessageType.error,
+                        self.getName(), 'Error: {0}', e.reason)
             except IOError, e:
-                self._source.add_fail(False)
-                self.log.add_log_entry(MessageType.error, self.getName(),
-                                        'IOError: ' + str(e))
+                self._source.add_fail(False, get_retry_after(e))
+                self.log.add_repeated_log_entry(MessageType.error,
+                        self.getName(), 'IOError: {0}', e)
 
         if success:
+            self._source.add_success()
             self._source.set_url(real_url)
             if filename is not None:
                 self._source.filename = filename
             if filesize is not None:
                 self._source.filesize = filesize
+            self._source.ranges_supported = self.connection.ranges_supported
             self._success_clb()
         else:
             self._fail_clb()
 
 
 
-class DataSlot(Thread):
-    """The DataSlot is a subclass of threading.Thread and can be used to
+class DataSlot(Task):
+    """The DataSlot is a subclass of workerpool.Task and can be used to
     load the data of a download.
 
     The download will be informed about events using listeners, e.g. when
@@ -150,6 +167,7 @@ class DataSlot(Thread):
     Public instance variables:
     connection -- the connection used to load the data. Note that it will
                   be closed automatically.
+    bytes_received -- the number of bytes loaded by the slot
 
     chunk_started_event  -- An event.eventlistener.EventListener object.
                             The event is signalled when some data of a
@@ -176,8 +194,7 @@ class DataSlot(Thread):
                  chunk=None, connection=None):
         """Initialize the DataSlot-object.
 
-        name -- the name of the slot. It is used as thread-name and when
-                logging messages.
+        name -- the name of the slot. It is used when logging messages.
         download -- the download holding this slot
         target_file -- the TargetFile-object where the received bytes
                        will be written to
@@ -196,7 +213,8 @@ class DataSlot(Thread):
         self._chunk = chunk
         self.connection = connection
         self.data_received = False
-        Thread.__init__(self, name=name)
+        self.bytes_received = 0
+        Task.__init__(self, name)
 
     def run(self):
         """Called when the slot-thread is started.
@@ -209,36 +227,49 @@ class DataSlot(Thread):
         """
         while self._download.is_loading():
             self.data_received = False
+            # the phases are recorded as spans while tracing is enabled
+            traced = tracer.enabled
 
-            while self._chunk is None:
-                try:
-                    self._chunk = self._download.chunk_queue.get(True, 0.2)
-                except Empty, e:
-                    self._chunk = None
-
-                # Download may be paused --> stop downloading
-                if not self._download.is_loading():
+            if self._chunk is None:
+                # the number of slots may have been reduced
+                if self._download.retire_slot():
+                    self._log.add_log_entry(MessageType.info, self.getName(),
+                                            'Retired')
                     return
+                if traced:
+                    start = monotonic()
+                self._chunk = self._download.get_chunk_job()
+                if traced:
+                    tracer.add_span('wait for chunk', start, monotonic(),
+                                    {'slot': self.getName()})
+                # Download may be paused --> stop downloading
+                # or a slot has to retire --> check again
+                if self._chunk is None:
+                    continue
 
             if self._chunk.length is None:
-                self._log.add_log_entry(MessageType.info, self.getName(),
-                        'Got new chunk-job (offset={0})!'.format(
-                                    self._chunk.offset + self._chunk.loaded))
+                self._log.add_log_entry(MessageType.debug, self.getName(),
+                        'Got new chunk-job (offset={0})!',
+                        self._chunk.offset + self._chunk.loaded)
             else:
-                self._log.add_log_entry(MessageType.info, self.getName(),
-                        'Got new chunk-job (offset={0}, length={1})!'.format(
-                                    self._chunk.offset + self._chunk.loaded,
-                                    self._chunk.length - self._chunk.loaded))
+                self._log.add_log_entry(MessageType.debug, self.getName(),
+                        'Got new chunk-job (offset={0}, length={1})!',
+                        self._chunk.offset + self._chunk.loaded,
+                        self._chunk.length - self._chunk.loaded)
 
             source, wait_until = None, 0
+            if traced:
+                trace_args = {'slot': self.getName(),
+                              'offset': self._chunk.offset + self._chunk.loaded}
+                start = monotonic()
             if self.connection is None:
                 # request source
                 source, wait_until = self._download.get_next_source()
 
                 self._download.source_condition.acquire()
                 while source is None and self._download.is_loading():
-                    self._log.add_log_entry(MessageType.info, self.getName(),
-                                            'Waiting for a source!')
+                    self._log.add_repeated_log_entry(MessageType.info,
+                            self.getName(), 'Waiting for a source!')
                     self._download.source_condition.wait()
                     if self._download.is_loading():
                         source, wait_until = self._download.get_next_source()
@@ -257,19 +288,27 @@ class DataSlot(Thread):
                                             data_received=self.data_received)
                 return
 
-            self._log.add_log_entry(MessageType.info, self.getName(),
-                                    'Using the source {0}'.format(source.url))
+            self._log.add_log_entry(MessageType.debug, self.getName(),
+                                    'Using the source {0}', source.url)
+            if traced:
+                trace_args['source'] = source.url
+                tracer.add_span('wait for source', start, monotonic(),
+                                trace_args)
 
             # maybe we need to wait some seconds between retries
-            to_wait = wait_until - time()
+            to_wait = wait_until - monotonic()
             if to_wait > 0:
-                self._log.add_log_entry(MessageType.info, self.getName(),
-                                    'Retry in {0} seconds!'.format(to_wait))
-                # wait until retry, but still check if state has changed
-                while time() < wait_until:
-                    sleep(0.2)
-                    if not self._download.is_loading():
-                        return
+                self._log.add_repeated_log_entry(MessageType.info,
+                        self.getName(), 'Retry in {0:.1f} seconds!', to_wait)
+                if traced:
+                    start = monotonic()
+                # wait until retry, but stop if the state has changed
+                if not self._download.wait_until(wait_until,
+                                                 self._download.is_loading):
+                    return
+                if traced:
+                    tracer.add_span('retry wait', start, monotonic(),
+                                    trace_args)
 
             # Download may be paused --> stop downloading
             #if not self._download.is_loading():
@@ -282,10 +321,37 @@ class DataSlot(Thread):
                 self.chunk_finished_event.signal(source, data_received=self.data_received)
                 return
 
+            # wait until the host accepts another connection
+            url = source.url
+            if traced:
+                start = monotonic()
+            host_limits = self._download.host_limits
+            if (host_limits is not None and
+                    not host_limits.acquire(url, self._download)):
+                # Download was stopped while waiting
+                self.chunk_failed_event.signal(self._chunk, source, ioerror=False,
+                                            data_received=self.data_received)
+                return
+
+            # wait for a free connection of the global budget
+            budget = self._download.connection_budget
+            if budget is not None and not budget.acquire(self._download):
+                # Download was stopped while waiting
+                if host_limits is not None:
+                    host_limits.release(url)
+                self.chunk_failed_event.signal(self._chunk, source, ioerror=False,
+                                            data_received=self.data_received)
+                return
+            if traced:
+                tracer.add_span('wait for connection', start, monotonic(),
+                                trace_args)
+
             # use already opened connection (from InfoSlot)
             c = self.connection
             if c is None:
                 c = Connection(source)
+            if traced:
+                c.trace_args = trace_args
 
             def received_listener():
                 source.inc_active_slots()
@@ -297,55 +363,115 @@ class DataSlot(Thread):
                     source.inc_active_slots(decrement=True)
 
             c.data_received_event.add_listener(received_listener)
+            retired = False
             try:
-                c.fetch_data(self._chunk, self._target_file, self._download)
+                c.fetch_data(self._chunk, self._target_file, self._download,
+                             self)
             except HTTPError, e:
                 on_fetch_stopped()
-                source.add_fail(self.data_received)
-                self._log.add_log_entry(MessageType.error, self.getName(),
-                                        'HTTP-Error: ' + str(e))
+                self._add_fail(source, url, e)
+                self._log.add_repeated_log_entry(MessageType.error,
+                        self.getName(), 'HTTP-Error: {0}', e)
                 self.chunk_failed_event.signal(self._chunk, source, ioerror=False,
                                             data_received=self.data_received)
             except ChunkNotFinishedError, e:
                 on_fetch_stopped()
                 if e.critical:
-                    source.add_fail(self.data_received)
-                    self._log.add_log_entry(MessageType.error, self.getName(),
-                                            str(e.reason))
+                    self._add_fail(source, url, e)
+                    self._log.add_repeated_log_entry(MessageType.error,
+                            self.getName(), str(e.reason))
                     self.chunk_failed_event.signal(self._chunk, source, ioerror=False,
                                             data_received=self.data_received)
                 else:
-                    # Chunk not finished, because download was paused
-                    # etc.
+                    # Chunk not finished, because download was paused,
+                    # the slot retired etc.
+                    retired = e.retired
                     self._log.add_log_entry(MessageType.info, self.getName(),
                                             str(e.reason))
                     self.chunk_failed_event.signal(self._chunk, source, ioerror=False,
                                             data_received=self.data_received)
             except URLError, e:
                 on_fetch_stopped()
-                source.add_fail(self.data_received)
-                self._log.add_log_entry(MessageType.error, self.getName(),
-                                        'Error: ' + str(e.reason))
+                self._add_fail(source, url, e)
+                self._log.add_repeated_log_entry(MessageType.error,
+                        self.getName(), 'Error: {0}', e.reason)
                 self.chunk_failed_event.signal(self._chunk, source, ioerror=False,
                                             data_received=self.data_received)
             except TargetFileIOError, e:
                 on_fetch_stopped()
                 self._log.add_log_entry(MessageType.error, self.getName(),
-                                        'IOError: ' + str(e))
+                                        'IOError: {0}', e)
                 self.chunk_failed_event.signal(self._chunk, source, ioerror=True,
                                             data_received=self.data_received)
             except IOError, e:
                 on_fetch_stopped()
-                source.add_fail(self.data_received)
-                self._log.add_log_entry(MessageType.error, self.getName(),
-                                        'IOError: ' + str(e))
+                self._add_fail(source, url, e)
+                self._log.add_repeated_log_entry(MessageType.error,
+                        self.getName(), 'IOError: {0}', e)
                 self.chunk_failed_event.signal(self._chunk, source, ioerror=False,
                                             data_received=self.data_received)
             else:
                 on_fetch_stopped()
+                source.add_success()
                 self.chunk_finished_event.signal(source,
                                             data_received=self.data_received)
 
+            if budget is not None:
+                budget.release(self._download)
+            if host_limits is not None:
+                host_limits.release(url)
+
             # Do not use connection/chunk multiple times!
             self.connection = None
             self._chunk = None
+
+            if retired:
+                return
+
+        # the download stopped before the connection was used
+        self._release_connection()
+
+    def _on_cancel(self):
+        # the slot will never run
+        self._release_connection()
+
+    def _release_connection(self):
+        """Close the connection given to the slot if it was not used.
+
+        The first slot of a download may get the open connection of the
+        InfoSlot together with a running slot of its source (see
+        Download._resume).
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection.source.inc_running_slots(decrement=True)
+            self.connection = None
+
+    def _add_fail(self, source, url, error):
+        """Tell the source that loading has failed.
+
+        If the host refused the connection (see hostlimits.is_refusal)
+        because of its connection limit, the host limits learn the limit
+        instead. Then no retry is counted and the slot will wait for the
+        host next time. A delay the server asked for is still respected,
+        which counts a retry.
+
+        source -- the Source which was used
+        url -- the url which was loaded
+        error -- the exception raised by the Connection. The server may
+                 have asked to wait before the next request.
+        """
+        host_limits = self._download.host_limits
+        retry_after = get_retry_after(error)
+        if (not self.data_received and host_limits is not None and
+                is_refusal(error) and host_limits.report_refusal(url)):
+            self._log.add_log_entry(MessageType.info, self.getName(),
+                    'The host refused another connection. Limited to ' +
+                    '{0} connections!', host_limits.get_limit(url))
+            if not retry_after:
+                return
+        if retry_after:
+            self._log.add_repeated_log_entry(MessageType.info,
+                    self.getName(),
+                    'The server asked to wait {0} seconds!', retry_after)
+        source.add_fail(self.data_received, retry_after)
@@ -25,10 +25,12 @@ loaded from.
 from cookielib import Cookie
 from re import match
 from threading import Lock
-from time import time
 from urlparse import urlparse
 
+from clock import monotonic
+from counter import Counter
 from event.eventlistener import EventListener
+from retrypolicy import RetryPolicy
 
 
 class Source:
@@ -50,7 +52,10 @@ class Source:
                      means infinity.
     max_retries -- the maximum number of retries on errors. A negative
                    value means infinity.
-    wait_time -- the time in seconds to wait between retries on errors
+    wait_time -- the time in seconds to wait after the first error. It
+                 grows with each error in a row (see retry_policy).
+    retry_policy -- the retrypolicy.RetryPolicy which calculates the
+                    time to wait before the next retry
     filename -- the filename of the Source. It is simply extracted from
                 the URL and may be changed by a slot.InfoSlot.
     filesize -- the filesize may be set by an InfoSlot or is None.
@@ -60,6 +65,16 @@ class Source:
     cookies --
     timeout --
     valid --
+    ranges_supported -- True if the server supports partial requests,
+                        False if not and None if unknown
+    bytes_received -- a counter.Counter of the bytes loaded from the
+                      Source since the program was started
+    errors -- a counter.Counter of the errors since the program was
+              started
+    infos_valid_until -- the time (see clock.monotonic) until the
+                         fetched information (url, filename, filesize)
+                         is valid, e.g. when it was prefetched. None if
+                         there is no such information.
 
     url_changed_event -- An event.eventlistener.EventListener object.
                          The event is signalled when the url has
@@ -110,9 +125,14 @@ class Source:
         self.cookie_objects = None
 
         self.valid = True
-        # TODO: better use monotonic time
-        # contains timestamps which each specify when retry is allowed
+        self.ranges_supported = None
+        self.infos_valid_until = None
+        self.retry_policy = RetryPolicy()
+        # contains the times (see clock.monotonic) when a retry is
+        # allowed
         self._failed = []
+        # the number of errors since the last success
+        self._errors = 0
         self._retry_lock = Lock()
 
         # Active slots are slots, which started receiving data and are
@@ -125,6 +145,8 @@ class Source:
 
         self._active_slot_lock = Lock()
         self.active_slots = 0
+        self.bytes_received = Counter()
+        self.errors = Counter()
         self.max_active_slots = 0
         self.max_slots_determined = False
 
@@ -142,6 +164,9 @@ class Source:
         source.valid = dict['valid']
         source.max_active_slots = dict['max_active_slots']
         source.max_slots_determined = dict['max_slots_determined']
+        if 'retry_policy' in dict and dict['retry_policy'] is not None:
+            source.retry_policy = RetryPolicy.create_from_dict(
+                                                        dict['retry_policy'])
         
         source.set_cookie_string(dict['cookie_string'])
         
@@ -202,6 +227,7 @@ class Source:
             'max_redirects': self.max_redirects,
             'max_retries': self.max_retries,
             'wait_time': self.wait_time,
+            'retry_policy': self.retry_policy.get_as_dict(),
             'filename': self.filename,
             'filesize': self.filesize,
             'retries': self.retries,
@@ -236,6 +262,13 @@ class Source:
         self.url = url
         self.url_changed_event.signal(self)
 
+    def has_fresh_infos(self):
+        """Returns True if the information of the Source was fetched
+        and is still valid (see infos_valid_until), otherwise False.
+        """
+        return (self.infos_valid_until is not None and
+                monotonic() < self.infos_valid_until)
+
     def set_max_retries(self, max_retries):
         self.max_retries = max_retries
         self.retries_changed_event.signal(self)
@@ -256,13 +289,19 @@ class Source:
             else:
                 self.running_slots += 1
 
-    def add_fail(self, data_received):
+    def add_fail(self, data_received, retry_after=None):
         """Tell the source, that an error occurred while using the
         Source.
 
         For example the connection to the Source-Server timed out or the
         file does not exist etc.. The next slot using this source may
-        wait some time before retrying.
+        wait some time before retrying. The time is calculated by
+        retry_policy.
+
+        data_received -- True if some data was loaded before the error.
+                         Then the previous errors are forgotten.
+        retry_after -- the time in seconds the server asked to wait or
+                       None (see retrypolicy.get_retry_after)
         """
         # If there was a slot loading using this source at any time
         # then self.max_active_slots is the max. number of parallel
@@ -272,10 +311,24 @@ class Source:
         # slots using this source are allowed.
         if self.max_active_slots > 0 and not data_received:
             self.max_slots_determined = True
+        self.errors.add()
 
         with self._retry_lock:
+            if data_received:
+                self._errors = 0
+            self._errors += 1
+            wait = self.retry_policy.get_wait_time(self.wait_time,
+                                                   self._errors, retry_after)
             # the next slot needs to wait before retrying
-            self._failed.append(time() + self.wait_time)
+            self._failed.append(monotonic() + wait)
+
+    def add_success(self):
+        """Tell the source, that loading from the Source succeeded.
+
+        The wait time of the next error starts at wait_time again.
+        """
+        with self._retry_lock:
+            self._errors = 0
 
     def is_retry_allowed(self):
         """Checks if its allowed to use this Source to load data.
@@ -287,8 +340,8 @@ class Source:
         reached. If max_retries is reached, the value -1 is returned
         indicating that this Source should not be used to load data. If
         max_retries is not reached, the Source can be used to load data
-        but the Slot should wait some seconds. The time until the slot
-        should wait is returned.
+        but the Slot should wait some seconds. The time (see
+        clock.monotonic) until the slot should wait is returned.
         """
         ret = 0  # allowed, no retry
         retries_changed = False
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The splitstrategy-module contains the strategies which decide how a
+Download splits up its chunks.
+
+Whenever a slot is idle, Download._new_chunk asks the split strategy of
+the download which chunk should be split and how many bytes at the end
+of this chunk should be moved to a new chunk.
+
+HalveStrategy: Halve the chunk with the most bytes left (default).
+FixedSizeStrategy: Split off pieces of chunk_size bytes.
+SequentialStrategy: Split near the front of the file, so the file is
+                    loaded from the beginning to the end.
+ProportionalStrategy: Split the chunk which will finish last
+                      proportional to the speed of the slots.
+"""
+
+from clock import monotonic
+
+
+class SplitStrategy:
+    """The base class of all split strategies.
+
+    Subclasses must set name (used in settings and when saving a
+    download) and title (shown in the GUI) and implement split.
+    """
+
+    name = None
+    title = None
+
+    def __init__(self, clock=monotonic):
+        """Initialize the strategy.
+
+        clock -- a parameter less function returning the current time in
+                 seconds, clock.monotonic by default. It may be
+                 replaced, e.g. for simulations.
+        """
+        self._clock = clock
+
+    def split(self, download):
+        """Decide which chunk of the download should be split.
+
+        The method is called while the download's chunk lock is held.
+        A tuple is returned containing the chunk to split and the number
+        of bytes at the end of the chunk which should be moved to a new
+        chunk. If no chunk should be split, None is returned.
+
+        download -- the Download whose chunks should be split
+        """
+        raise NotImplementedError()
+
+    def _unfinished_chunks(self, download):
+        """Returns a list of (chunk, bytes left)-tuples of all unfinished
+        chunks of the download with at least chunk_size bytes left.
+        """
+        chunks = []
+        for chunk in download.chunks:
+            if not chunk.is_finished(download.slots_supported):
+                bytes = chunk.bytes_left(download.slots_supported)
+                if bytes >= download.chunk_size:
+                    chunks.append((chunk, bytes))
+        return chunks
+
+    def _largest_chunk(self, download):
+        """Returns a (chunk, bytes left)-tuple of the unfinished chunk with
+        the most bytes left or (None, 0) if there is no such chunk.
+        """
+        chunk_to_split = None
+        chunk_to_load = 0
+        for chunk, bytes in self._unfinished_chunks(download):
+            if bytes > chunk_to_load:
+                chunk_to_split = chunk
+                chunk_to_load = bytes
+        return (chunk_to_split, chunk_to_load)
+
+
+class HalveStrategy(SplitStrategy):
+    """Halve the unfinished chunk with the most bytes left."""
+
+    name = 'halve'
+    title = 'Halve largest chunk'
+
+    def split(self, download):
+        chunk_to_split, chunk_to_load = self._largest_chunk(download)
+        if chunk_to_split is None:
+            return None
+        return (chunk_to_split, chunk_to_load / 2)
+
+
+class FixedSizeStrategy(SplitStrategy):
+    """Split off a piece of chunk_size bytes from the end of the chunk with
+    the most bytes left.
+
+    Small pieces are finished fast, so the next piece may be loaded from
+    another Source. If the chunk is smaller than two pieces it is halved.
+    """
+
+    name = 'fixed'
+    title = 'Fixed size pieces'
+
+    def split(self, download):
+        chunk_to_split, chunk_to_load = self._largest_chunk(download)
+        if chunk_to_split is None:
+            return None
+        return (chunk_to_split, min(download.chunk_size, chunk_to_load / 2))
+
+
+class SequentialStrategy(SplitStrategy):
+    """Split the unfinished chunk with the lowest offset.
+
+    The chunk keeps chunk_size bytes and the rest is moved to the new
+    chunk. So all slots are loading near the front of the file, which is
+    useful for media files which should be played while loading.
+    """
+
+    name = 'sequential'
+    title = 'Sequential (front first)'
+
+    def split(self, download):
+        chunk_to_split = None
+        chunk_to_load = 0
+        for chunk, bytes in self._unfinished_chunks(download):
+            if chunk_to_split is None or chunk.offset < chunk_to_split.offset:
+                chunk_to_split = chunk
+                chunk_to_load = bytes
+
+        if chunk_to_split is None:
+            return None
+        keep = min(download.chunk_size, chunk_to_load - chunk_to_load / 2)
+        return (chunk_to_split, chunk_to_load - keep)
+
+
+class ProportionalStrategy(SplitStrategy):
+    """Split the chunk which is expected to finish last. The bytes are
+    divided proportional to the speed of the chunk and the average speed
+    of all loading chunks (the expected speed of the new slot).
+
+    The speed of a chunk is measured from the first time the strategy
+    has seen the chunk. If no speed is known yet, the chunk with the most
+    bytes left is halved.
+    """
+
+    name = 'proportional'
+    title = 'Proportional to slot speed'
+
+    def __init__(self, clock=monotonic):
+        SplitStrategy.__init__(self, clock)
+        # chunk --> (time, loaded) when the chunk was seen the first time
+        self._first_seen = {}
+
+    def split(self, download):
+        now = self._clock()
+        first_seen = {}
+        speeds = {}
+        for chunk in download.chunks:
+            if chunk.is_finished(download.slots_supported):
+                continue
+            t, loaded = self._first_seen.get(chunk, (now, chunk.loaded))
+            first_seen[chunk] = (t, loaded)
+            if now > t and chunk.loaded > loaded:
+                speeds[chunk] = (chunk.loaded - loaded) / (now - t)
+        # forget finished/merged chunks
+        self._first_seen = first_seen
+
+        if len(speeds) == 0:
+            chunk_to_split, chunk_to_load = self._largest_chunk(download)
+            if chunk_to_split is None:
+                return None
+            return (chunk_to_split, chunk_to_load / 2)
+        avg_speed = sum(speeds.values()) / len(speeds)
+
+        chunk_to_split = None
+        chunk_to_load = 0
+        max_time_left = -1
+        for chunk, bytes in self._unfinished_chunks(download):
+            time_left = bytes / speeds.get(chunk, avg_speed)
+            if time_left > max_time_left:
+                chunk_to_split = chunk
+                chunk_to_load = bytes
+                max_time_left = time_left
+
+        if chunk_to_split is None:
+            return None
+        speed = speeds.get(chunk_to_split, avg_speed)
+        length = long(chunk_to_load * avg_speed / (speed + avg_speed))
+        if length <= 0:
+            return None
+        return (chunk_to_split, length)
+
+
+split_strategies = [HalveStrategy, FixedSizeStrategy, SequentialStrategy,
+                    ProportionalStrategy]
+
+default_split_strategy = HalveStrategy.name
+
+
+def create_split_strategy(name):
+    """Create a new split strategy by its name.
+
+    If there is no strategy with the name, the default strategy is
+    created.
+    """
+    for strategy in split_strategies:
+        if strategy.name == name:
+            return strategy()
+    return HalveStrategy()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The timerwheel-module contains the classes TimerWheel and Timer.
+
+A TimerWheel calls functions at given deadlines using a single thread.
+
+timer_wheel: the TimerWheel used for the retry deadlines of the slots
+"""
+
+from threading import Condition, Lock, Thread, current_thread
+from time import sleep
+import sys
+import traceback
+
+from clock import monotonic
+
+
+class Timer:
+    """A Timer is returned by TimerWheel.schedule and can be cancelled.
+
+    Public instance variables:
+    deadline -- the time (see clock.monotonic) when the function is
+                called
+    """
+
+    def __init__(self, deadline, function, args):
+        self.deadline = deadline
+        self._function = function
+        self._args = args
+        self._lock = Lock()
+        self._cancelled = False
+        self._fired = False
+
+    def cancel(self):
+        """Cancel the timer.
+
+        Returns True if the function has not been called and will never
+        be called, otherwise False.
+        """
+        with self._lock:
+            if self._fired:
+                return False
+            self._cancelled = True
+            return True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def _fire(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._fired = True
+        self._function(*self._args)
+
+
+class TimerWheel:
+    """A TimerWheel is a hashed timing wheel.
+
+    The wheel is an array of buckets. Each bucket covers one tick and
+    the timers are put into the bucket of their deadline, so scheduling
+    and cancelling a timer do not depend on the number of timers.
+    Deadlines further away than one turn of the wheel stay in their
+    bucket for more turns.
+
+    The thread of the wheel is started with the first timer. It only
+    ticks while timers are scheduled; without timers it waits without
+    using the CPU. stop ends the thread, e.g. before the interpreter
+    shuts down.
+
+    The functions are called by the thread of the wheel, so they should
+    return quickly, e.g. by notifying a Condition. They are called at
+    most one tick after their deadline.
+    """
+
+    def __init__(self, tick=0.05, size=512):
+        """Initialize the TimerWheel.
+
+        tick -- the resolution of the wheel in seconds
+        size -- the number of buckets
+        """
+        self._tick = tick
+        self._condition = Condition()
+        self._buckets = [[] for i in range(size)]
+        # the time of the first tick and the number of processed ticks
+        self._start = None
+        self._ticks = 0
+        self._count = 0
+        self._thread = None
+
+    def schedule(self, deadline, function, *args):
+        """Call the function with the arguments at the deadline.
+
+        deadline -- the time (see clock.monotonic) when the function is
+                    called. Changes of the system time do not delay
+                    the timer.
+
+        Returns the Timer, which can be cancelled.
+        """
+        timer = Timer(deadline, function, args)
+        with self._condition:
+            if self._count == 0:
+                # the wheel was idle, so it starts turning now
+                self._start = monotonic()
+                self._ticks = 0
+            self._put(timer)
+            self._count += 1
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='Timer Wheel')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return timer
+
+    def stop(self):
+        """Stop the thread of the wheel and wait until it has ended.
+
+        The scheduled timers are kept. If another timer is scheduled,
+        the thread is started again.
+        """
+        with self._condition:
+            thread = self._thread
+            self._thread = None
+            self._condition.notifyAll()
+        if thread is not None and thread is not current_thread():
+            thread.join()
+
+    def get_count(self):
+        """Returns the number of scheduled timers (including cancelled
+        timers which have not been removed yet).
+        """
+        return self._count
+
+    def _put(self, timer):
+        """Put the timer into the bucket of its deadline.
+
+        Must be called while self._condition is held.
+        """
+        tick = int((timer.deadline - self._start) / self._tick) + 1
+        tick = max(tick, self._ticks + 1)
+        self._buckets[tick % len(self._buckets)].append((tick, timer))
+
+    def _run(self):
+        thread = current_thread()
+        while True:
+            with self._condition:
+                while self._count == 0 and self._thread is thread:
+                    self._condition.wait()
+                if self._thread is not thread:
+                    # stopped
+                    return
+                next_tick = self._start + (self._ticks + 1) * self._tick
+
+            to_sleep = next_tick - monotonic()
+            if to_sleep > 0:
+                sleep(to_sleep)
+
+            expired = []
+            with self._condition:
+                if self._thread is not thread:
+                    return
+                self._ticks += 1
+                bucket = self._buckets[self._ticks % len(self._buckets)]
+                later = []
+                now = monotonic()
+                for tick, timer in bucket:
+                    if timer.is_cancelled():
+                        self._count -= 1
+                    elif tick <= self._ticks and timer.deadline <= now:
+                        self._count -= 1
+                        expired.append(timer)
+                    elif tick <= self._ticks:
+                        # the tick ended before the deadline, try again
+                        later.append((self._ticks + 1, timer))
+                    else:
+                        # more turns of the wheel are needed
+                        later.append((tick, timer))
+                del bucket[:]
+                for tick, timer in later:
+                    self._buckets[tick % len(self._buckets)].append(
+                                                                (tick, timer))
+
+            for timer in expired:
+                try:
+                    timer._fire()
+                except Exception:
+                    sys.stderr.write('Exception in timer:\n')
+                    traceback.print_exc()
+
+
+timer_wheel = TimerWheel()
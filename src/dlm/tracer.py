@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The tracer-module contains the Tracer-class.
+
+The Tracer records the phases of the slots (waiting for a chunk, DNS,
+connecting, waiting for the first byte, transferring etc.) as spans. The
+spans can be saved as Chrome trace-event JSON and viewed in a timeline
+viewer like chrome://tracing or Perfetto.
+
+tracer: the Tracer used by the slots and connections
+"""
+
+from collections import deque
+import json
+from threading import current_thread
+
+
+class Tracer:
+    """The Tracer collects spans while it is enabled.
+
+    Tracing is disabled by default. Code which records spans checks
+    enabled before taking any time, so a disabled Tracer costs only an
+    attribute lookup per phase:
+
+        if tracer.enabled:
+            start = monotonic()
+        ...
+        if tracer.enabled:
+            tracer.add_span('connect', start, monotonic(), args)
+
+    The times are taken from clock.monotonic. At most max_spans spans
+    are kept, older spans are dropped.
+
+    Public instance variables:
+    enabled -- True if spans are recorded
+    max_spans -- the maximum number of spans kept
+    """
+
+    def __init__(self, max_spans=1000000):
+        self.enabled = False
+        self.max_spans = max_spans
+        self._spans = deque(maxlen=max_spans)
+        # thread identifier --> thread name
+        self._threads = {}
+
+    def start(self):
+        """Drop the recorded spans and start recording."""
+        self._spans = deque(maxlen=self.max_spans)
+        self._threads = {}
+        self.enabled = True
+
+    def stop(self):
+        """Stop recording. The recorded spans are kept."""
+        self.enabled = False
+
+    def add_span(self, name, start, end, args=None):
+        """Record a span of the current thread.
+
+        name -- the name of the phase
+        start -- the start time (see clock.monotonic)
+        end -- the end time
+        args -- a dict with further information, e.g. the chunk offset
+                and the source url, or None
+        """
+        thread = current_thread()
+        ident = thread.ident
+        if ident not in self._threads:
+            self._threads[ident] = thread.name
+        # deque.append is atomic, so no lock is needed
+        self._spans.append((name, start, end, ident, args))
+
+    def get_span_count(self):
+        return len(self._spans)
+
+    def get_trace_events(self):
+        """Returns the recorded spans as a list of trace events."""
+        spans = list(self._spans)
+        if not spans:
+            return []
+        origin = min(span[1] for span in spans)
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': ident,
+                   'args': {'name': name}}
+                  for ident, name in self._threads.items()]
+        for name, start, end, ident, args in spans:
+            event = {
+                'name': name,
+                'cat': 'slot',
+                'ph': 'X',
+                'pid': 1,
+                'tid': ident,
+                # microseconds
+                'ts': (start - origin) * 1000000,
+                'dur': (end - start) * 1000000
+            }
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+    def save(self, path):
+        """Save the recorded spans as Chrome trace-event JSON."""
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.get_trace_events(),
+                       'displayTimeUnit': 'ms'}, f)
+
+
+tracer = Tracer()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The workerpool-module contains the classes WorkerPool and Task.
+
+A WorkerPool runs Tasks in reused worker threads, so no thread needs to
+be created for each slot or clean-up.
+
+slot_pool: the pool running the InfoSlots and DataSlots. It is not
+           bounded: a DataSlot holds its worker while its download is
+           loading, so a bound would limit the connections behind the
+           back of the ConnectionBudget and let InfoSlots wait for idle
+           DataSlots.
+clean_up_pool: the pool running the clean-up of stopped downloads
+
+The two pools are separated, because a clean-up waits for the slots of
+its download.
+"""
+
+from collections import deque
+from threading import Condition, Event, Lock, Thread, current_thread
+import sys
+import traceback
+
+
+class Task:
+    """A Task is run by a WorkerPool.
+
+    It can be used like threading.Thread: subclasses override run and
+    call start and join. Instead of creating a thread, start puts the
+    task into the queue of its pool.
+    """
+
+    def __init__(self, name, pool=None):
+        """Initialize the Task.
+
+        name -- the name of the task. It is used when logging messages.
+        pool -- the WorkerPool which runs the task. slot_pool is used by
+                default.
+        """
+        self._name = name
+        self._pool = pool
+        self._done = Event()
+        self._state_lock = Lock()
+        self._started = False
+        self._cancelled = False
+
+    def getName(self):
+        """Returns the name of the task."""
+        return self._name
+
+    def run(self):
+        """The work of the task. Subclasses override this method."""
+        pass
+
+    def start(self):
+        """Put the task into the queue of its pool."""
+        pool = self._pool
+        if pool is None:
+            pool = slot_pool
+        pool.submit(self)
+
+    def cancel(self):
+        """Cancel the task if it has not been started by a worker yet.
+
+        Returns True if the task was cancelled. Then it will never run,
+        _on_cancel is called and join returns immediately.
+        """
+        with self._state_lock:
+            if self._started:
+                return False
+            self._cancelled = True
+        self._on_cancel()
+        self._done.set()
+        return True
+
+    def _on_cancel(self):
+        """Called when the task was cancelled before it has run.
+        Subclasses override this method to release what run would have
+        released.
+        """
+        pass
+
+    def join(self, timeout=None):
+        """Wait until the task is done or cancelled."""
+        self._done.wait(timeout)
+
+    def is_done(self):
+        """Returns True if the task is done or cancelled."""
+        return self._done.is_set()
+
+    def _begin(self):
+        """Called by the worker. Returns False if the task is cancelled."""
+        with self._state_lock:
+            if self._cancelled:
+                return False
+            self._started = True
+            return True
+
+
+class FunctionTask(Task):
+    """A Task which calls a function with the given arguments."""
+
+    def __init__(self, name, function, args=(), pool=None):
+        Task.__init__(self, name, pool)
+        self._function = function
+        self._args = args
+
+    def run(self):
+        self._function(*self._args)
+
+
+class WorkerPool:
+    """A WorkerPool runs Tasks in at most size worker threads.
+
+    The workers are created when they are needed and then wait for the
+    next task. If all workers are busy, the tasks are queued and a
+    warning is written to stderr, because queued tasks of long-running
+    tasks may wait for a long time.
+
+    Public instance variables:
+    name -- the name of the pool. The workers are named
+            "<name> Worker <number>".
+    size -- the maximum number of worker threads. 0 means unlimited.
+    """
+
+    def __init__(self, name, size):
+        """Initialize the WorkerPool.
+
+        name -- the name of the pool
+        size -- the maximum number of worker threads (0 = unlimited)
+        """
+        self.name = name
+        self.size = size
+        self._condition = Condition()
+        self._queue = deque()
+        self._workers = []
+        self._idle = 0
+        # statistics
+        self._created = 0
+        self._submitted = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._max_queued = 0
+        # True if the warning about queued tasks was written and the
+        # queue has not been empty since
+        self._warned = False
+
+    def set_size(self, size):
+        """Change the maximum number of worker threads.
+
+        If the size is reduced, workers exit after their current task.
+        0 means unlimited.
+        """
+        with self._condition:
+            self.size = max(0, int(size))
+            self._start_workers()
+            self._condition.notifyAll()
+
+    def submit(self, task):
+        """Put the task into the queue. It will be run by a worker."""
+        with self._condition:
+            self._queue.append(task)
+            self._submitted += 1
+            if len(self._queue) > self._max_queued:
+                self._max_queued = len(self._queue)
+            self._start_workers()
+            if self._idle < len(self._queue) and not self._warned:
+                self._warned = True
+                sys.stderr.write('{0} pool: all {1} workers are busy, tasks '
+                                 'are queued\n'.format(self.name, self.size))
+            self._condition.notify()
+
+    def run(self, name, function, *args):
+        """Run the function with the arguments in the pool.
+
+        Returns the FunctionTask, which can be joined.
+        """
+        task = FunctionTask(name, function, args, self)
+        self.submit(task)
+        return task
+
+    def get_stats(self):
+        """Returns a dict with the statistics of the pool.
+
+        name -- the name of the pool
+        size -- the maximum number of workers
+        workers -- the number of worker threads
+        created -- the number of worker threads created so far
+        busy -- the number of workers running a task
+        queued -- the number of tasks waiting for a worker
+        max_queued -- the maximum number of waiting tasks so far
+        submitted -- the number of submitted tasks
+        completed -- the number of finished tasks
+        cancelled -- the number of cancelled tasks
+        """
+        with self._condition:
+            return {
+                'name': self.name,
+                'size': self.size,
+                'workers': len(self._workers),
+                'created': self._created,
+                'busy': len(self._workers) - self._idle,
+                'queued': len(self._queue),
+                'max_queued': self._max_queued,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'cancelled': self._cancelled
+            }
+
+    def _start_workers(self):
+        """Start workers for the queued tasks as long as size allows.
+
+        Must be called while self._condition is held.
+        """
+        while (self._idle < len(self._queue) and
+                (self.size <= 0 or len(self._workers) < self.size)):
+            worker = Thread(target=self._work, name='{0} Worker {1}'.format(
+                                                    self.name, self._created))
+            worker.daemon = True
+            self._created += 1
+            # new workers are idle until they take a task
+            self._idle += 1
+            self._workers.append(worker)
+            worker.start()
+
+    def _work(self):
+        worker = current_thread()
+        while True:
+            with self._condition:
+                while len(self._queue) == 0:
+                    self._warned = False
+                    if self.size > 0 and len(self._workers) > self.size:
+                        # the pool was made smaller
+                        self._workers.remove(worker)
+                        self._idle -= 1
+                        return
+                    self._condition.wait()
+                task = self._queue.popleft()
+                self._idle -= 1
+
+            if task._begin():
+                try:
+                    task.run()
+                except Exception:
+                    sys.stderr.write('Exception in task {0}:\n'.format(
+                                                            task.getName()))
+                    traceback.print_exc()
+                finally:
+                    task._done.set()
+                with self._condition:
+                    self._completed += 1
+                    self._idle += 1
+            else:
+                with self._condition:
+                    self._cancelled += 1
+                    self._idle += 1
+
+
+slot_pool = WorkerPool('Slot', 0)
+clean_up_pool = WorkerPool('Clean-up', 16)
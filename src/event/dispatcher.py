@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""The dispatcher-module contains the Dispatcher-class.
+
+A Dispatcher calls the listeners of events (see
+eventlistener.EventListener) in its own thread.
+
+dispatcher: the Dispatcher used for the listeners of the user interface
+"""
+
+from collections import deque
+from threading import Condition, Thread
+import sys
+import traceback
+
+
+class Dispatcher:
+    """A Dispatcher calls listeners in its own thread in the order in
+    which they were posted.
+
+    The signalling thread only appends the call to a queue, so a slow
+    listener does not stall it, e.g. a slot which reports its progress.
+
+    Calls may be coalesced: if a listener is posted again with the same
+    first argument before the pending call was made, only one call with
+    the latest arguments is made at the position of the first one. This
+    bounds the queue for events which are signalled very often, but
+    only the last state matters, e.g. the state of a download.
+
+    The thread is started with the first call. It is a daemon thread, so
+    it does not need to be stopped.
+    """
+
+    def __init__(self, name='Event Dispatcher'):
+        self._name = name
+        self._condition = Condition()
+        # (listener, [args, kwargs], key)-tuples
+        self._queue = deque()
+        # key --> [args, kwargs] of the pending coalesced calls
+        self._pending = {}
+        self._thread = None
+
+    def post(self, listener, args, kwargs, coalesce=False):
+        """Call the listener with the arguments in the thread of the
+        dispatcher.
+
+        coalesce -- True if the call may be merged with a pending call
+                    of the listener with the same first argument
+        """
+        with self._condition:
+            if coalesce:
+                key = (listener, args[0] if args else None)
+                call = self._pending.get(key)
+                if call is not None:
+                    call[0] = args
+                    call[1] = kwargs
+                    return
+                call = self._pending[key] = [args, kwargs]
+            else:
+                key = None
+                call = [args, kwargs]
+            self._queue.append((listener, call, key))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self._name)
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def get_count(self):
+        """Returns the number of pending calls."""
+        return len(self._queue)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                listener, call, key = self._queue.popleft()
+                if key is not None:
+                    del self._pending[key]
+            args, kwargs = call
+            try:
+                listener(*args, **kwargs)
+            except Exception:
+                sys.stderr.write('Exception in listener:\n')
+                traceback.print_exc()
+
+
+dispatcher = Dispatcher()
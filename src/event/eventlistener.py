@@ -15,22 +15,60 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
-from threading import RLock
+from threading import Lock
 
 class EventListener:
+    """Calls the added listeners when the event is signalled.
+
+    The listeners are kept in a tuple which is replaced when a listener
+    is added or removed, so signal does not need a lock. A listener
+    which is removed while the event is signalled may still be called
+    once.
+
+    Listeners which are added with a dispatcher (see
+    event.dispatcher.Dispatcher) are called by the thread of the
+    dispatcher instead of the signalling thread.
+    """
+
     def __init__(self):
-        self._listener_lock = RLock()
-        self._listener = []
+        self._listener_lock = Lock()
+        self._listener = ()
+        # (listener, dispatcher, coalesce)-tuples
+        self._async_listener = ()
 
-    def add_listener(self, listener):
+    def add_listener(self, listener, dispatcher=None, coalesce=False):
+        """Add a listener.
+
+        dispatcher -- the event.dispatcher.Dispatcher which calls the
+                      listener or None to call it at once
+        coalesce -- True if the dispatcher may drop a pending call when
+                    the event is signalled again with the same first
+                    argument. Only the latest arguments are passed.
+        """
         with self._listener_lock:
-            self._listener.append(listener)
+            if dispatcher is None:
+                self._listener = self._listener + (listener,)
+            else:
+                self._async_listener = (self._async_listener +
+                                        ((listener, dispatcher, coalesce),))
 
     def remove_listener(self, listener):
         with self._listener_lock:
-            self._listener.remove(listener)
+            if listener in self._listener:
+                listeners = list(self._listener)
+                listeners.remove(listener)
+                self._listener = tuple(listeners)
+                return
+            for entry in self._async_listener:
+                if entry[0] == listener:
+                    listeners = list(self._async_listener)
+                    listeners.remove(entry)
+                    self._async_listener = tuple(listeners)
+                    return
+            raise ValueError('listener not found')
 
     def signal(self, *args, **kwargs):
-        with self._listener_lock:
-            for listener in self._listener:
-                listener(*args, **kwargs)
+        for listener in self._listener:
+            listener(*args, **kwargs)
+        for listener, dispatcher, coalesce in self._async_listener:
+            dispatcher.post(listener, args, kwargs, coalesce)
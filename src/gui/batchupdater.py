@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+from threading import Lock
+
+import gobject
+
+from dlm.clock import monotonic
+
+
+class BatchUpdater:
+    """Collects changes of rows from any thread and applies them in the
+    main loop, at most frame_rate times per second.
+
+    Changes of the same row are merged, later values replace earlier
+    ones. So the main loop does the same amount of work per frame,
+    however often the rows change.
+
+    The changes are passed to the apply function as a dict
+    row key --> dict column --> value.
+    """
+
+    def __init__(self, apply, frame_rate=20):
+        self._apply = apply
+        self._lock = Lock()
+        self._pending = {}
+        self._scheduled = False
+        self._last_frame = 0
+        self.set_frame_rate(frame_rate)
+
+    def set_frame_rate(self, frame_rate):
+        self._frame_time = 1.0 / max(frame_rate, 1)
+
+    def update(self, key, changes):
+        """Merge the changes (a dict column --> value) of the row key
+        into the next frame.
+        """
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = changes.copy()
+            else:
+                pending.update(changes)
+            if not self._scheduled:
+                self._scheduled = True
+                delay = self._last_frame + self._frame_time - monotonic()
+                if delay > 0:
+                    gobject.timeout_add(int(delay * 1000) + 1, self._flush)
+                else:
+                    gobject.idle_add(self._flush)
+
+    def discard(self, key):
+        """Forget the pending changes of the row key, e.g. when the row
+        was removed.
+        """
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def flush(self):
+        """Apply the pending changes at once. Must be called by the main
+        loop.
+        """
+        self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._scheduled = False
+            self._last_frame = monotonic()
+        if pending:
+            self._apply(pending)
+        return False  # do not call again
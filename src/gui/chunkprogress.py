@@ -20,35 +20,70 @@ from threading import Lock
 import cairo
 import gtk
 
+from dlm.chunk import ChunkState
 from gui.simpledrawingarea import SimpleDrawingArea
 
 
 class ChunkProgress(SimpleDrawingArea):
+    """ChunkProgress shows which parts of a download are loaded.
+
+    The chunks are aggregated into the coverage of each pixel column
+    when they or the width change. Adjacent columns with the same state
+    and coverage are merged into spans, so a redraw costs a few
+    rectangles no matter how many chunks a download has. A partly
+    covered column is drawn with an alpha of its coverage, rounded to
+    1 / coverage_levels.
+
+    Finished ranges are drawn with the gradient, active and stolen
+    ranges (see dlm.chunk.ChunkState) with active_color and
+    stolen_color.
+    """
+
+    coverage_levels = 8
+
     def __init__(self):
         self.background_color = gtk.gdk.Color('#fff')
         self.gradient1_color = gtk.gdk.Color('#739ECE')
         self.gradient2_color = gtk.gdk.Color('#ADC7E5')
+        self.active_color = gtk.gdk.Color('#E8A94F')
+        self.stolen_color = gtk.gdk.Color('#8CBF6E')
         self.border_color = gtk.gdk.Color('#333333')
 
         self.background_alpha = 65535
         self.gradient1_alpha = 65535
         self.gradient2_alpha = 65535
+        self.active_alpha = 65535
+        self.stolen_alpha = 65535
         self.border_alpha = 65535
 
         self._chunks = []
         self._size = 0.0
+        # (state, level) --> list of (x, width)-tuples or None if the
+        # chunks have changed
+        self._spans = None
+        self._spans_width = None
         self._lock = Lock()
         SimpleDrawingArea.__init__(self)
         self.connect("expose-event", self.expose)
         self.set_size_request(100, 15)
 
     def set_chunks(self, chunks, size):
+        """Set the chunks to show.
+
+        chunks -- a list of (offset, loaded bytes, dlm.chunk.ChunkState)-
+                  tuples (see dlm.download.Download.get_chunk_data)
+        size -- the filesize or None if it is unknown
+        """
+        if size is None:
+            size = 0.0
+        else:
+            size = float(size)
         with self._lock:
+            if chunks == self._chunks and size == self._size:
+                return
             self._chunks = chunks
-            if size is None:
-                self._size = 0.0
-            else:
-                self._size = float(size)
+            self._size = size
+            self._spans = None
         self.queue_draw()
 
     def expose(self, widget, event):
@@ -61,6 +96,84 @@ class ChunkProgress(SimpleDrawingArea):
         self._redraw(self.context)
         return False
 
+    def _get_spans(self, width):
+        """Returns a dict (state, level) --> list of (x, width)-tuples.
+
+        level is the coverage of the columns in 1 / coverage_levels. The
+        spans are cached until the chunks or the width change.
+        """
+        if self._spans is not None and self._spans_width == width:
+            return self._spans
+
+        states = (ChunkState.active, ChunkState.stolen, ChunkState.finished)
+        # partly covered columns and the differences of the number of
+        # completely covered columns, for each state
+        partial = dict((state, [0.0] * (width + 1)) for state in states)
+        full = dict((state, [0] * (width + 1)) for state in states)
+        factor = width / self._size
+        for (offset, length, state) in self._chunks:
+            if length <= 0:
+                continue
+            start = offset * factor
+            end = min((offset + length) * factor, width)
+            first = int(start)
+            last = int(end)
+            if first >= width:
+                continue
+            if first == last:
+                partial[state][first] += end - start
+                continue
+            partial[state][first] += first + 1 - start
+            if last > first + 1:
+                full[state][first + 1] += 1
+                full[state][last] -= 1
+            partial[state][last] += end - last
+
+        levels = self.coverage_levels
+        spans = {}
+        running = dict((state, 0) for state in states)
+        current = None
+        span_start = 0
+        for x in xrange(width + 1):
+            key = None
+            if x < width:
+                total = 0.0
+                best = 0.0
+                for state in states:
+                    running[state] += full[state][x]
+                    coverage = running[state] + partial[state][x]
+                    total += coverage
+                    if coverage > best:
+                        best = coverage
+                        key_state = state
+                level = int(round(min(total, 1.0) * levels))
+                if level > 0:
+                    key = (key_state, level)
+            if key != current:
+                if current is not None:
+                    spans.setdefault(current, []).append(
+                                                (span_start, x - span_start))
+                current = key
+                span_start = x
+
+        self._spans = spans
+        self._spans_width = width
+        return spans
+
+    def _get_source(self, state, height):
+        if state == ChunkState.active:
+            return cairo.SolidPattern(*self.get_rgba(self.active_color,
+                                                     self.active_alpha))
+        elif state == ChunkState.stolen:
+            return cairo.SolidPattern(*self.get_rgba(self.stolen_color,
+                                                     self.stolen_alpha))
+        g = cairo.LinearGradient(0, 0, 0, height)
+        g.add_color_stop_rgba(1, *self.get_rgba(self.gradient1_color,
+                                                self.gradient1_alpha))
+        g.add_color_stop_rgba(0, *self.get_rgba(self.gradient2_color,
+                                                self.gradient2_alpha))
+        return g
+
     def _redraw(self, context):
         with self._lock:
             x, y, width, height = self.get_allocation()
@@ -72,20 +185,19 @@ class ChunkProgress(SimpleDrawingArea):
             context.fill_preserve()
             context.clip()
 
-            if self._size > 0.0:
-                factor = width / self._size
-                for (offset, length) in self._chunks:
-                    x = offset * factor
-                    w = length * factor
-                    context.rectangle(x, 0, w, height)
-
-                g = cairo.LinearGradient(0, 0, 0, height)
-                g.add_color_stop_rgba(1, *self.get_rgba(self.gradient1_color,
-                                                    self.gradient1_alpha))
-                g.add_color_stop_rgba(0, *self.get_rgba(self.gradient2_color,
-                                                    self.gradient2_alpha))
-                context.set_source(g)
-                context.fill()
+            if self._size > 0.0 and width > 0:
+                levels = self.coverage_levels
+                for ((state, level), spans) in self._get_spans(width).items():
+                    for (x, w) in spans:
+                        context.rectangle(x, 0, w, height)
+                    context.set_source(self._get_source(state, height))
+                    if level == levels:
+                        context.fill()
+                    else:
+                        context.save()
+                        context.clip()
+                        context.paint_with_alpha(float(level) / levels)
+                        context.restore()
 
             # border
             self.round_rectangle(context, 0.5, 0.5, width, height, 3)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+from bisect import bisect_left
+from itertools import count
+
+import gtk
+
+from dlm.download import DownloadState
+
+
+class DownloadListModel(gtk.GenericTreeModel):
+    """The model of the download list of the main window.
+
+    The values of the rows are kept in plain lists. GTK asks for the
+    values of the visible rows only, so nothing is done for the rows
+    which are scrolled out of view. The texts shown in the cells are
+    formatted when they are needed first and cached until a value they
+    depend on changes.
+
+    The rows are in the order in which the downloads were added. A
+    filter (see FILTERS) shows only the downloads in some states. The
+    downloads of each state are indexed, so the filtered rows and the
+    number of downloads of each filter are known without iterating over
+    all downloads.
+
+    Columns (the first 12 are the values, the others are texts):
+    0:download 1:filename 2:loaded 3:size 4:progress 5:state 6:retries
+    7:max_retries 8:slots 9:max_slots 10:speed 11:priority
+    12:progress text 13:slots text 14:retries text 15:speed text
+    16:time left text 17:priority text
+    """
+
+    # name --> the states of the shown downloads (None means all)
+    FILTERS = {'all': None,
+               'active': (DownloadState.ready, DownloadState.fetching_info,
+                          DownloadState.loading, DownloadState.stopping),
+               'paused': (DownloadState.paused,),
+               'failed': (DownloadState.failed, DownloadState.cancelled),
+               'finished': (DownloadState.finished,)}
+
+    _types = (object, str, long, object, int, int, int, int, int, int, int,
+              int, str, str, str, str, str, str)
+
+    # text column --> the value columns it depends on
+    _text_depends = {12: (2, 3, 4), 13: (8, 9), 14: (6, 7), 15: (5, 10),
+                     16: (2, 3, 5, 10), 17: (11,)}
+
+    def __init__(self, format_bytes):
+        """Initialize the DownloadListModel.
+
+        format_bytes -- a function returning the text of a number of
+                        bytes
+        """
+        gtk.GenericTreeModel.__init__(self)
+        # the downloads are the references of the rows. They are kept
+        # alive by self._values.
+        self.props.leak_references = False
+        self._format_bytes = format_bytes
+
+        # download --> list of the values of the columns 0-11
+        self._values = {}
+        # download --> dict text column --> text
+        self._texts = {}
+        # download --> sequence number, which gives the order of the rows
+        self._seq = {}
+        self._next_seq = count()
+        # state --> set of downloads
+        self._by_state = {}
+
+        self._filter = None
+        # the shown downloads and their sequence numbers, both ordered
+        self._rows = []
+        self._row_seqs = []
+
+        # value column --> text columns which depend on it
+        self._invalidates = {}
+        for text_column, columns in self._text_depends.iteritems():
+            for column in columns:
+                self._invalidates.setdefault(column, []).append(text_column)
+
+    def add_download(self, values):
+        """Add a row. values is the list of the values of the columns
+        0-11.
+        """
+        download = values[0]
+        self._values[download] = [self._coerce(column, value)
+                                  for column, value in enumerate(values)]
+        self._texts[download] = {}
+        self._seq[download] = self._next_seq.next()
+        self._by_state.setdefault(values[5], set()).add(download)
+        if self._is_shown(values[5]):
+            self._show(download)
+
+    def remove_download(self, download):
+        values = self._values.get(download)
+        if values is None:
+            return
+        if self._is_shown(values[5]):
+            self._hide(download)
+        self._by_state[values[5]].discard(download)
+        del self._values[download]
+        del self._texts[download]
+        del self._seq[download]
+
+    def set_values(self, download, changes):
+        """Change the values of the row of the download.
+
+        changes -- a dict column --> value of the columns 0-11
+        """
+        values = self._values.get(download)
+        if values is None:
+            return  # the download was removed
+        texts = self._texts[download]
+        old_state = values[5]
+        for column, value in changes.iteritems():
+            values[column] = self._coerce(column, value)
+            for text_column in self._invalidates.get(column, ()):
+                texts.pop(text_column, None)
+
+        state = values[5]
+        if state != old_state:
+            self._by_state[old_state].discard(download)
+            self._by_state.setdefault(state, set()).add(download)
+            shown, was_shown = self._is_shown(state), self._is_shown(old_state)
+            if shown and not was_shown:
+                self._show(download)
+                return
+            elif was_shown and not shown:
+                self._hide(download)
+                return
+            elif not shown:
+                return
+        elif not self._is_shown(state):
+            return
+        path = (self._get_position(download),)
+        self.row_changed(path, self.get_iter(path))
+
+    def get_filter(self):
+        return self._filter
+
+    def set_filter(self, name):
+        """Show only the downloads of the filter name (see FILTERS).
+
+        The model must not be used by a view while the filter is
+        changed, because no signals are emitted.
+        """
+        self._filter = self.FILTERS[name]
+        if self._filter is None:
+            downloads = self._values.keys()
+        else:
+            downloads = []
+            for state in self._filter:
+                downloads.extend(self._by_state.get(state, ()))
+        seq = self._seq
+        downloads.sort(key=seq.__getitem__)
+        self._rows = downloads
+        self._row_seqs = [seq[download] for download in downloads]
+        self.invalidate_iters()
+
+    def get_filter_count(self, name):
+        """Returns the number of downloads of the filter name."""
+        states = self.FILTERS[name]
+        if states is None:
+            return len(self._values)
+        return sum(len(self._by_state.get(state, ())) for state in states)
+
+    def _coerce(self, column, value):
+        """Returns the value converted to the type of the column, e.g.
+        the speeds and progresses are floats but shown as integers.
+        """
+        column_type = self._types[column]
+        if value is not None and column_type in (int, long):
+            return column_type(value)
+        return value
+
+    def _is_shown(self, state):
+        return self._filter is None or state in self._filter
+
+    def _get_position(self, download):
+        return bisect_left(self._row_seqs, self._seq[download])
+
+    def _show(self, download):
+        seq = self._seq[download]
+        i = bisect_left(self._row_seqs, seq)
+        self._rows.insert(i, download)
+        self._row_seqs.insert(i, seq)
+        self.row_inserted((i,), self.get_iter((i,)))
+
+    def _hide(self, download):
+        i = self._get_position(download)
+        del self._rows[i]
+        del self._row_seqs[i]
+        self.row_deleted((i,))
+
+    def _get_text(self, download, column):
+        texts = self._texts[download]
+        text = texts.get(column)
+        if text is None:
+            text = texts[column] = self._format(self._values[download],
+                                                column)
+        return text
+
+    def _format(self, values, column):
+        if column == 12:
+            loaded, size, progress = values[2], values[3], values[4]
+            if size is None:
+                return self._format_bytes(loaded)
+            return '{0}% - {1} / {2}'.format(progress,
+                                             self._format_bytes(loaded),
+                                             self._format_bytes(size))
+        elif column == 13:
+            return '{0}/{1}'.format(values[8], values[9])
+        elif column == 14:
+            if values[7] < 0:
+                return u'{0}/\u221E'.format(values[6]).encode('utf-8')
+            return '{0}/{1}'.format(values[6], values[7])
+        elif column == 15:
+            state, speed = values[5], values[10]
+            if state != DownloadState.loading and speed == 0:
+                return ''
+            return self._format_bytes(speed) + '/s'
+        elif column == 16:
+            return self._format_time_left(values)
+        elif column == 17:
+            return str(values[11])
+
+    def _format_time_left(self, values):
+        state, speed = values[5], values[10]
+        if state != DownloadState.loading or speed == 0:
+            return ''
+        loaded, size = values[2], values[3]
+        if size is None:
+            return 'Unknown'
+        time_left = (size - loaded) / speed
+
+        hours = time_left / 3600
+        if hours > 0:
+            time_left = time_left % (hours * 3600)
+
+        minutes = time_left / 60
+        if minutes > 0:
+            time_left = time_left % (minutes * 60)
+
+        return '{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes, time_left)
+
+    # gtk.GenericTreeModel
+
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY | gtk.TREE_MODEL_ITERS_PERSIST
+
+    def on_get_n_columns(self):
+        return len(self._types)
+
+    def on_get_column_type(self, index):
+        return self._types[index]
+
+    def on_get_iter(self, path):
+        if path[0] < len(self._rows):
+            return self._rows[path[0]]
+        return None
+
+    def on_get_path(self, download):
+        return (self._get_position(download),)
+
+    def on_get_value(self, download, column):
+        if column < 12:
+            return self._values[download][column]
+        return self._get_text(download, column)
+
+    def on_iter_next(self, download):
+        i = self._get_position(download) + 1
+        if i < len(self._rows):
+            return self._rows[i]
+        return None
+
+    def on_iter_children(self, download):
+        if download is None and self._rows:
+            return self._rows[0]
+        return None
+
+    def on_iter_has_child(self, download):
+        return False
+
+    def on_iter_n_children(self, download):
+        if download is None:
+            return len(self._rows)
+        return 0
+
+    def on_iter_nth_child(self, download, n):
+        if download is None and n < len(self._rows):
+            return self._rows[n]
+        return None
+
+    def on_iter_parent(self, download):
+        return None
@@ -19,17 +19,23 @@ import ctypes
 from os.path import realpath, dirname, join
 from threading import Lock, RLock
 from urlparse import urlparse
+import socket
 
 import pygtk
 pygtk.require("2.0")
 import gtk
 import gobject
 
+import core
 from dlm.download import Download, DownloadState
 from dlm.source import Source
+from dlm.splitstrategy import create_split_strategy
 from dlm.log import MessageType
+from event.dispatcher import dispatcher
 from globals import settings, downloads_file
+from gui.batchupdater import BatchUpdater
 from gui.chunkprogress import ChunkProgress
+from gui.downloadlistmodel import DownloadListModel
 from gui.meter import ToolMeter
 from gui.new_download_window import NewDownloadWindow
 from gui.new_source_window import NewSourceWindow
@@ -45,20 +51,27 @@ class MainWindow:
         self.window = builder.get_object("main_window")
         self.aboutdialog = builder.get_object("aboutdialog")
 
-        # 0:download 1:filename 2:loaded 3:size 4:progress
-        # 5:state 6:retries 7:max_retries 8:slots 9:max_slots 10:speed
-        self.download_store = gtk.ListStore(object, str, long, object, int,
-                                            int, int, int, int, int, int)
+        # see DownloadListModel for the columns
+        self.download_store = DownloadListModel(self._format_bytes)
+        download_filter = settings.get('gui.main_window.filter', 'all')
+        if download_filter not in DownloadListModel.FILTERS:
+            download_filter = 'all'
+        self.download_store.set_filter(download_filter)
         self.download_view = builder.get_object("download_view")
         self.download_view.set_model(model=self.download_store)
+        # all columns have a fixed width, so the height of the rows
+        # does not need to be measured
+        self.download_view.set_fixed_height_mode(True)
+        # the changes of the rows are applied once per frame
+        # (frame rate see _apply_manager_settings)
+        self._row_updater = BatchUpdater(self._apply_download_changes)
 
         # using Glade the progressbar will not be expanded in its cell
         # so we define our own CellRendererProgress
         progress_cell = gtk.CellRendererProgress()
         self.progress_column = builder.get_object("progress_column")
         self.progress_column.pack_start(progress_cell, True)
-        self.progress_column.set_cell_data_func(progress_cell,
-                                            self._get_download_progress)
+        self.progress_column.set_attributes(progress_cell, value=4, text=12)
 
         stateicon_cell = builder.get_object("state_cellrendererpixbuf")
         self.filename_column = builder.get_object("filename_column")
@@ -71,21 +84,23 @@ class MainWindow:
 
         slots_cell = builder.get_object("slots_cellrenderertext")
         self.slots_column = builder.get_object("slots_column")
-        self.slots_column.set_cell_data_func(slots_cell, self._get_download_slots)
+        self.slots_column.set_attributes(slots_cell, text=13)
 
         retries_cell = builder.get_object("retries_cellrenderertext")
         self.retries_column = builder.get_object("retries_column")
-        self.retries_column.set_cell_data_func(retries_cell,
-                                            self._get_download_retries)
+        self.retries_column.set_attributes(retries_cell, text=14)
 
         speed_cell = builder.get_object("speed_cellrenderertext")
         self.speed_column = builder.get_object("speed_column")
-        self.speed_column.set_cell_data_func(speed_cell, self._get_download_speed)
+        self.speed_column.set_attributes(speed_cell, text=15)
+
+        priority_cell = builder.get_object("priority_cellrenderertext")
+        self.priority_column = builder.get_object("priority_column")
+        self.priority_column.set_attributes(priority_cell, text=17)
 
         timeleft_cell = builder.get_object("timeleft_cellrenderertext")
         self.timeleft_column = builder.get_object("timeleft_column")
-        self.timeleft_column.set_cell_data_func(timeleft_cell,
-                                                self._get_download_time_left)
+        self.timeleft_column.set_attributes(timeleft_cell, text=16)
 
         # toolbar
         toolbar = builder.get_object("toolbar")
@@ -97,9 +112,28 @@ class MainWindow:
                                             self._format_bytes(avg_speed),
                                             self._format_bytes(speed)))
         self.speed_meter.text_callback = speed_text
-        toolbar.insert(toolmeter, 7)
+        toolbar.insert(toolmeter, 10)
         toolmeter.show_all()
 
+        # filter of the download list: name, title, shown text
+        self.filter_store = gtk.ListStore(str, str, str)
+        for name, title in (('all', 'All'), ('active', 'Active'),
+                            ('paused', 'Paused'), ('failed', 'Failed'),
+                            ('finished', 'Finished')):
+            self.filter_store.append([name, title, title])
+        self.filter_combo = gtk.ComboBox(self.filter_store)
+        filter_cell = gtk.CellRendererText()
+        self.filter_combo.pack_start(filter_cell, True)
+        self.filter_combo.add_attribute(filter_cell, 'text', 2)
+        for row in self.filter_store:
+            if row[0] == download_filter:
+                self.filter_combo.set_active_iter(row.iter)
+        self.filter_combo.connect('changed', self._on_filter_combo_changed)
+        filter_item = gtk.ToolItem()
+        filter_item.add(self.filter_combo)
+        toolbar.insert(filter_item, 10)
+        filter_item.show_all()
+
         # chunk progress
         general_table = builder.get_object("general_table")
         self.chunk_progress = ChunkProgress()
@@ -112,6 +146,16 @@ class MainWindow:
         self.log_scrolled = builder.get_object('log_scrolled')
         self.log_view = builder.get_object("log_view")
         self.log_view.set_model(model=self.log_store)
+        # the log is shown in pages, see _show_log_page
+        self.log_older_button = builder.get_object('log_older_button')
+        self.log_newer_button = builder.get_object('log_newer_button')
+        self.log_page_label = builder.get_object('log_page_label')
+        self._log_page_size = max(settings.get_int(
+                                    'gui.main_window.log_page_size', 200), 1)
+        # the index of the first shown message
+        self._log_first = 0
+        # True if the last page is shown and new messages are appended
+        self._log_follow = True
 
         message_cell = builder.get_object("message_cellrenderertext")
         entry_column = builder.get_object("entry_column")
@@ -131,7 +175,9 @@ class MainWindow:
         self.filesize_label = builder.get_object("filesize_label")
         self.folder_label = builder.get_object("folder_label")
         self.slots_label = builder.get_object("slots_label")
-        self.maxslot_label = builder.get_object("maxslot_label")
+        self.maxslot_spin = builder.get_object("maxslot_spin")
+        # True while the spin shows the value of the current download
+        self._updating_maxslot_spin = False
 
         self.source_url_label = builder.get_object("source_url_label")
         self.source_realurl_label = builder.get_object("source_realurl_label")
@@ -143,6 +189,8 @@ class MainWindow:
                                                     "source_referrer_label")
         self.source_cookie_label = builder.get_object("source_cookie_label")
 
+        self.connections_label = builder.get_object('connections_label')
+
         self.parallel_spin = builder.get_object('parallel_spin')
         def parallel_spin_output(spin):
             digits = int(spin.props.digits)
@@ -183,17 +231,19 @@ class MainWindow:
         self.current_source = None
 
         self.manager = manager
-        manager.download_added_event.add_listener(self._on_download_added)
+        manager.downloads_added_event.add_listener(self._on_downloads_added)
         manager.max_parallel_downloads_changed_event.add_listener(
                                     self._on_max_parallel_downloads_changed)
+        # The listeners which are called by the threads of the downloads
+        # are called by the dispatcher, so a busy main loop does not
+        # stall the downloads. Listeners which only show the current
+        # state are coalesced.
+        manager.connection_budget.changed_event.add_listener(
+                        self._on_connection_budget_changed, dispatcher, True)
 
         # DownloadMeter for speed and progress
-        manager.download_meter.download_bytes_changed_event.add_listener(
-                                            self._on_download_bytes_changed)
-        manager.download_meter.download_speed_changed_event.add_listener(
-                                            self._on_download_speed_changed)
-        manager.download_meter.speed_changed_event.add_listener(
-                                            self._on_speed_changed)
+        manager.download_meter.snapshot_event.add_listener(
+                                        self._on_meter_snapshot, dispatcher)
 
         # default values
         self.parallel_spin.set_value(self.manager.max_parallel_downloads)
@@ -232,9 +282,13 @@ class MainWindow:
         tw = settings.get_int('gui.main_window.timeleft_width')
         if tw is not None:
             self.timeleft_column.set_fixed_width(tw)
+        prw = settings.get_int('gui.main_window.priority_width')
+        if prw is not None:
+            self.priority_column.set_fixed_width(prw)
 
         parallel_dls = settings.get_int('core.manager.parallel_downloads', 1)
         self.manager.set_max_parallel_downloads(parallel_dls)
+        self._apply_manager_settings()
 
         self._update_colors()
 
@@ -244,25 +298,16 @@ class MainWindow:
         self.window.show()
 
         # load/add saved downloads
-        downloads = self.manager.create_downloads_from_list(
-                                        downloads_file.get('downloads', []))
+        downloads = core.load_downloads(self.manager)
         for d in downloads:
             for s in d.get_copy_of_sources():
-                s.url_changed_event.add_listener(self._update_cur_source_labels)
-                s.retries_changed_event.add_listener(self._update_cur_source_labels)
-
-            d.log.message_added_event.add_listener(
-                                                self._on_downloadlog_message_added)
-            d.status_changed_event.add_listener(self._on_download_state_changed)
-            d.filename_changed_event.add_listener(
-                                                self._on_download_filename_changed)
-            d.filesize_changed_event.add_listener(
-                                                self._on_download_filesize_changed)
-            d.slots_changed_event.add_listener(self._on_download_slots_changed)
-            d.retries_changed_event.add_listener(self._on_download_retries_changed)
-            d.source_added_event.add_listener(self._on_download_source_added)
-
-            self.manager.add_download(d)
+                s.url_changed_event.add_listener(
+                            self._update_cur_source_labels, dispatcher, True)
+                s.retries_changed_event.add_listener(
+                            self._update_cur_source_labels, dispatcher, True)
+            self._add_download_listeners(d)
+
+        self.manager.add_downloads(downloads)
 
         gtk.main()
 
@@ -281,24 +326,6 @@ class MainWindow:
         else:
             return False  # quit
 
-    def _get_download_progress(self, column, cell, model, iter):
-        loaded = model.get_value(iter, 2)
-        size = model.get_value(iter, 3)
-        progress = model.get_value(iter, 4)
-
-        loaded_str = self._format_bytes(loaded)
-
-        if size is not None:
-            size_str = self._format_bytes(size)
-            cell.set_property('value', progress)
-            cell.set_property('text',
-                                str(progress) + '% - ' +
-                                loaded_str + ' / ' +
-                                size_str)
-        else:
-            cell.set_property('value', 0)
-            cell.set_property('text', loaded_str)
-
     def _get_download_state(self, column, cell, model, iter):
         state_val = model.get_value(iter, 5)
         states = {DownloadState.ready: 'Ready',
@@ -325,54 +352,6 @@ class MainWindow:
 
         cell.set_property('stock-id', states[state_val])
 
-    def _get_download_slots(self, column, cell, model, iter):
-        cell.set_property('text',
-                            str(model.get_value(iter, 8)) + "/" +
-                            str(model.get_value(iter, 9)))
-
-    def _get_download_retries(self, column, cell, model, iter):
-        retries_str = str(model.get_value(iter, 6))
-        max_retries = model.get_value(iter, 7)
-        if max_retries < 0:
-            max_retries_str = u"\u221E"
-        else:
-            max_retries_str = str(max_retries)
-        cell.set_property('text',
-                            retries_str + "/" + max_retries_str)
-
-    def _get_download_speed(self, column, cell, model, iter):
-        state, speed = model.get_value(iter, 5), model.get_value(iter, 10)
-        speed_str = self._format_bytes(speed)
-        if state != DownloadState.loading and speed == 0:
-            cell.set_property('text', '')
-        else:
-            cell.set_property('text', speed_str + '/s')
-
-    def _get_download_time_left(self, column, cell, model, iter):
-        state, speed = model.get_value(iter, 5), model.get_value(iter, 10)
-        if state != DownloadState.loading or speed == 0:
-            cell.set_property('text', '')
-            return
-
-        loaded, size = model.get_value(iter, 2), model.get_value(iter, 3)
-        if size is None:
-            cell.set_property('text', 'Unknown')
-        else:
-            bytes_left = size - loaded
-            time_left = bytes_left / speed
-
-            hours = time_left / 3600
-            if hours > 0:
-                time_left = time_left % (hours * 3600)
-
-            minutes = time_left / 60
-            if minutes > 0:
-                time_left = time_left % (minutes * 60)
-
-            time_str = '{0:02d}:{1:02d}:{2:02d}'.format(hours, minutes,
-                                                                    time_left)
-            cell.set_property('text', time_str)
-
     def _get_message_text(self, column, cell, model, iter):
         name, message = model.get_value(iter, 2), model.get_value(iter, 3)
         time =  model.get_value(iter, 1)
@@ -384,11 +363,14 @@ class MainWindow:
         server = model.get_value(iter, 1)
         cell.set_property('text', server)
 
-    def _get_download_row(self, download):
-        for row in self.download_store:
-            if row[0] is download:
-                return row
-        return None
+    def _apply_download_changes(self, changes):
+        """Apply the changes collected by the row updater (see
+        BatchUpdater) to the download store.
+        """
+        with self._download_list_lock:
+            for download, columns in changes.iteritems():
+                self.download_store.set_values(download, columns)
+            self._update_filter_counts()
 
     def _download_progress(self, download, bytes=None):
         if download.filesize is None:
@@ -415,7 +397,8 @@ class MainWindow:
 
     def _add_log_message(self, message):
         type, time, name, text = message
-        icon = {MessageType.info: 'gtk-dialog-info',
+        icon = {MessageType.debug: 'gtk-info',
+                MessageType.info: 'gtk-dialog-info',
                 MessageType.error: 'gtk-dialog-error',
                 MessageType.warning: 'gtk-dialog-warning'}
         self.log_store.append([icon[type], time, name, text])
@@ -424,28 +407,108 @@ class MainWindow:
         server = urlparse(source.original_url).netloc.strip()
         self.sources_store.append([source, server])
 
-    def _on_download_added(self, download):
-        def download_added():
+    def _add_download_listeners(self, download):
+        download.log.message_added_event.add_listener(
+                            self._on_downloadlog_message_added, dispatcher)
+        download.status_changed_event.add_listener(
+                            self._on_download_state_changed, dispatcher, True)
+        download.filename_changed_event.add_listener(
+                        self._on_download_filename_changed, dispatcher, True)
+        download.filesize_changed_event.add_listener(
+                        self._on_download_filesize_changed, dispatcher, True)
+        download.slots_changed_event.add_listener(
+                            self._on_download_slots_changed, dispatcher, True)
+        download.retries_changed_event.add_listener(
+                        self._on_download_retries_changed, dispatcher, True)
+        download.source_added_event.add_listener(
+                                self._on_download_source_added, dispatcher)
+        download.priority_changed_event.add_listener(
+                        self._on_download_priority_changed, dispatcher, True)
+
+    def _update_filter_counts(self):
+        """Show the number of downloads of each filter. The download
+        list lock must be held.
+        """
+        for row in self.filter_store:
+            text = '{0} ({1})'.format(row[1],
+                                self.download_store.get_filter_count(row[0]))
+            if row[2] != text:
+                row[2] = text
+
+    def _on_filter_combo_changed(self, widget, data=None):
+        iter = self.filter_combo.get_active_iter()
+        if iter is None:
+            return
+        name = self.filter_store.get_value(iter, 0)
+        with self._download_list_lock:
+            # no signals are emitted when the filter is changed
+            self.download_view.set_model(None)
+            self.download_store.set_filter(name)
+            self.download_view.set_model(self.download_store)
+        self._on_download_view_cursor_changed()
+
+    def _get_download_store_row(self, download):
+        retries, max_retries = download.get_retries()
+        return [download,
+                download.filename,
+                download.get_bytes_loaded(),
+                download.filesize,
+                self._download_progress(download),
+                download.state,
+                retries,
+                max_retries,
+                download.active_slot,
+                download.max_slot,
+                0,
+                download.priority]
+
+    def _on_downloads_added(self, downloads):
+        def downloads_added():
             with self._download_list_lock:
-                retries, max_retries = download.get_retries()
-                d = [download,
-                        download.filename,
-                        download.get_bytes_loaded(),
-                        download.filesize,
-                        self._download_progress(download),
-                        download.state,
-                        retries,
-                        max_retries,
-                        download.active_slot,
-                        download.max_slot,
-                        0]
-            self.download_store.append(d)
-
-        gobject.idle_add(download_added)
+                rows = [self._get_download_store_row(download)
+                        for download in downloads]
+                # Detach the model while filling it. Otherwise the view is
+                # updated for each row.
+                if len(rows) > 1:
+                    self.download_view.freeze_child_notify()
+                    self.download_view.set_model(None)
+                for row in rows:
+                    self.download_store.add_download(row)
+                if len(rows) > 1:
+                    self.download_view.set_model(self.download_store)
+                    self.download_view.thaw_child_notify()
+                self._update_filter_counts()
+
+        gobject.idle_add(downloads_added)
 
     def _on_max_parallel_downloads_changed(self):
         self.parallel_spin.set_value(self.manager.max_parallel_downloads)
 
+    def _apply_manager_settings(self):
+        self._row_updater.set_frame_rate(
+                        settings.get_int('gui.main_window.frame_rate', 20))
+
+        try:
+            core.apply_settings(self.manager)
+        except (socket.error, ValueError), e:
+            dlg = gtk.MessageDialog(parent=self.window,
+                    type=gtk.MESSAGE_ERROR,
+                    buttons=gtk.BUTTONS_OK,
+                    message_format='Could not start the metrics server: ' +
+                                   str(e))
+            dlg.run()
+            dlg.destroy()
+
+    def _on_connection_budget_changed(self, budget):
+        def update_connections_label():
+            if budget.limit > 0:
+                text = 'Connections: {0}/{1}'.format(budget.used, budget.limit)
+            else:
+                text = 'Connections: {0}'.format(budget.used)
+            self.connections_label.set_text(text)
+
+        gobject.idle_add(update_connections_label)
+
     def _update_cur_download_filename(self, download):
         def update_cur_download():
             with self._current_download_lock:
@@ -490,10 +553,13 @@ class MainWindow:
                 if download is self.current_download:
                     if download is None:
                         self.slots_label.set_text('')
-                        self.maxslot_label.set_text('')
+                        self.maxslot_spin.set_sensitive(False)
                     else:
                         self.slots_label.set_text(str(download.active_slot))
-                        self.maxslot_label.set_text(str(download.max_slot))
+                        self._updating_maxslot_spin = True
+                        self.maxslot_spin.set_value(download.max_slot)
+                        self._updating_maxslot_spin = False
+                        self.maxslot_spin.set_sensitive(True)
         gobject.idle_add(update_cur_download)
 
     def _update_cur_source_labels(self, source):
@@ -527,65 +593,37 @@ class MainWindow:
         gobject.idle_add(update_cur_source)
 
     def _on_download_filename_changed(self, download):
-        def update_download_list():
-            with self._download_list_lock:
-                row = self._get_download_row(download)
-                if row is not None:
-                    row[1] = download.filename
-
-        gobject.idle_add(update_download_list)
+        self._row_updater.update(download, {1: download.filename})
         self._update_cur_download_filename(download)
 
     def _on_download_filesize_changed(self, download):
-        def update_download_list():
-            with self._download_list_lock:
-                row = self._get_download_row(download)
-                if row is not None:
-                    row[3] = download.filesize
-
-        gobject.idle_add(update_download_list)
+        self._row_updater.update(download, {3: download.filesize})
         self._update_cur_download_filesize(download)
 
     def _on_download_state_changed(self, download):
-        def state_changed():
-            with self._download_list_lock:
-                row = self._get_download_row(download)
-                if row is not None:
-                    row[5] = download.state
-                    # if download is not loading anymore, the
-                    # DownloadMeter will not check if the progress has
-                    # changed. So we need to update manually.
-                    if (download.state == DownloadState.paused or
-                            download.state == DownloadState.cancelled or
-                            download.state == DownloadState.failed or
-                            download.state == DownloadState.finished):
-                        self._on_download_bytes_changed(download,
-                                                download.get_bytes_loaded())
-                        self._on_download_speed_changed(download, 0)
-
-        gobject.idle_add(state_changed)
+        self._row_updater.update(download, {5: download.state})
+        # if download is not loading anymore, the DownloadMeter will not
+        # check if the progress has changed. So we need to update
+        # manually.
+        if (download.state == DownloadState.paused or
+                download.state == DownloadState.cancelled or
+                download.state == DownloadState.failed or
+                download.state == DownloadState.finished):
+            self._on_download_bytes_changed(download,
+                                            download.get_bytes_loaded())
+            self._on_download_speed_changed(download, 0)
 
     def _on_download_slots_changed(self, download):
-        def update_download_list():
-            with self._download_list_lock:
-                row = self._get_download_row(download)
-                if row is not None:
-                    row[8] = download.active_slot
-                    row[9] = download.max_slot
-
-        gobject.idle_add(update_download_list)
+        self._row_updater.update(download, {8: download.active_slot,
+                                            9: download.max_slot})
         self._update_cur_download_slots(download)
 
     def _on_download_retries_changed(self, download):
-        def retries_changed():
-            with self._download_list_lock:
-                row = self._get_download_row(download)
-                if row is not None:
-                    retries, max_retries = download.get_retries()
-                    row[6] = retries
-                    row[7] = max_retries
+        retries, max_retries = download.get_retries()
+        self._row_updater.update(download, {6: retries, 7: max_retries})
 
-        gobject.idle_add(retries_changed)
+    def _on_download_priority_changed(self, download):
+        self._row_updater.update(download, {11: download.priority})
 
     def _on_download_source_added(self, download, source):
         def update_cur_download():
@@ -593,45 +631,105 @@ class MainWindow:
                 if download is self.current_download:
                     with self._sources_lock:
                         self._add_source(source)
-        source.url_changed_event.add_listener(self._update_cur_source_labels)
+        source.url_changed_event.add_listener(self._update_cur_source_labels,
+                                              dispatcher, True)
         source.retries_changed_event.add_listener(
-                                                self._update_cur_source_labels)
+                            self._update_cur_source_labels, dispatcher, True)
         gobject.idle_add(update_cur_download)
 
     def _on_download_bytes_changed(self, download, bytes):
-        def download_bytes_changed():
-            with self._download_list_lock:
-                row = self._get_download_row(download)
-                if row is not None:
-                    row[2] = bytes
-                    if download.filesize is not None:
-                        row[4] = self._download_progress(download, bytes)
-
-        gobject.idle_add(download_bytes_changed)
+        changes = {2: bytes}
+        if download.filesize is not None:
+            changes[4] = self._download_progress(download, bytes)
+        self._row_updater.update(download, changes)
         self._update_cur_download_progress(download)
 
     def _on_download_speed_changed(self, download, speed):
-        def download_bytes_changed():
-            with self._download_list_lock:
-                row = self._get_download_row(download)
-                if row is not None:
-                    row[10] = speed
+        self._row_updater.update(download, {10: speed})
+
+    def _show_log_page(self, start=None):
+        """Show the messages of the current download from the index
+        start on. None shows the last page, which is then kept up to date.
+        The current download lock must be held.
+        """
+        with self._log_lock:
+            self.log_store.clear()
+            if self.current_download is None:
+                self._log_first = 0
+                self._log_follow = True
+                self._update_log_page_widgets(None)
+                return
+            log = self.current_download.log
+            count = log.get_message_count()
+            first = log.get_first_index()
+            if start is None or start + self._log_page_size >= count:
+                start = max(count - self._log_page_size, first)
+                self._log_follow = True
+            else:
+                start = max(start, first)
+                self._log_follow = False
+            self._log_first = start
+            for message in log.get_messages(start, self._log_page_size):
+                self._add_log_message(message)
+            self._update_log_page_widgets(log)
+
+    def _update_log_page_widgets(self, log):
+        """The log lock must be held."""
+        if log is None:
+            self.log_page_label.set_text('')
+            self.log_older_button.set_sensitive(False)
+            self.log_newer_button.set_sensitive(False)
+            return
+        count = log.get_message_count()
+        shown = len(self.log_store)
+        if shown > 0:
+            text = 'Messages {0}-{1} of {2}'.format(self._log_first + 1,
+                                                   self._log_first + shown,
+                                                   count)
+        else:
+            text = 'No messages'
+        self.log_page_label.set_text(text)
+        self.log_older_button.set_sensitive(
+                                    self._log_first > log.get_first_index())
+        self.log_newer_button.set_sensitive(not self._log_follow)
+
+    def _on_log_older_button_clicked(self, widget, data=None):
+        with self._current_download_lock:
+            self._show_log_page(max(self._log_first - self._log_page_size,
+                                    0))
 
-        gobject.idle_add(download_bytes_changed)
+    def _on_log_newer_button_clicked(self, widget, data=None):
+        with self._current_download_lock:
+            self._show_log_page(self._log_first + self._log_page_size)
 
     def _on_downloadlog_message_added(self, log, message):
         def downloadlog_message_added():
             with self._current_download_lock:
                 if (self.current_download is not None and
                         self.current_download.log is log):
-                    self._log_lock.acquire()
-                    self._add_log_message(message)
-                    self._log_lock.release()
+                    with self._log_lock:
+                        if self._log_follow:
+                            self._add_log_message(message)
+                            # keep only one page in the store
+                            if len(self.log_store) > self._log_page_size:
+                                self.log_store.remove(
+                                            self.log_store.get_iter_first())
+                                self._log_first += 1
+                        self._update_log_page_widgets(log)
 
         gobject.idle_add(downloadlog_message_added)
 
-    def _on_speed_changed(self, speed):
-        self.speed_meter.add_value(speed)
+    def _on_meter_snapshot(self, snapshot):
+        for download, (bytes, speed) in snapshot.downloads.iteritems():
+            changes = {2: bytes, 10: speed}
+            if download.filesize is not None:
+                changes[4] = self._download_progress(download, bytes)
+            self._row_updater.update(download, changes)
+        with self._current_download_lock:
+            current = self.current_download
+        if current in snapshot.downloads:
+            self._update_cur_download_progress(current)
+        self.speed_meter.add_value(snapshot.speed)
 
     def _on_log_view_size_allocate(self, widget, event, data=None):
         # auto-scroll download log
@@ -657,12 +755,7 @@ class MainWindow:
             with self._current_download_lock:
                 self.current_download = self._get_selected_download()
 
-                with self._log_lock:
-                    self.log_store.clear()
-                    if self.current_download is not None:
-                        for message in (self.current_download.
-                                        log.get_copy_of_messages()):
-                            self._add_log_message(message)
+                self._show_log_page()
 
                 with self._current_source_lock:
                     self.current_source = None
@@ -693,27 +786,23 @@ class MainWindow:
     def _on_add_download(self, ndw):
         s = Source(url=ndw.url, max_redirects=ndw.redirects,
                         max_retries=ndw.retries, wait_time=ndw.wait_retries)
-        s.url_changed_event.add_listener(self._update_cur_source_labels)
-        s.retries_changed_event.add_listener(self._update_cur_source_labels)
+        s.url_changed_event.add_listener(self._update_cur_source_labels,
+                                         dispatcher, True)
+        s.retries_changed_event.add_listener(self._update_cur_source_labels,
+                                             dispatcher, True)
 
         s.timeout = ndw.timeout
         s.user_agent = ndw.user_agent
         s.referrer = ndw.referrer
         s.set_cookie_string(ndw.cookie)
+        s.retry_policy = core.create_retry_policy()
 
         d = Download(ndw.slots, s, ndw.target_folder)
-        d.log.message_added_event.add_listener(
-                                            self._on_downloadlog_message_added)
-        d.status_changed_event.add_listener(self._on_download_state_changed)
-        d.filename_changed_event.add_listener(
-                                            self._on_download_filename_changed)
-        d.filesize_changed_event.add_listener(
-                                            self._on_download_filesize_changed)
-        d.slots_changed_event.add_listener(self._on_download_slots_changed)
-        d.retries_changed_event.add_listener(self._on_download_retries_changed)
-        d.source_added_event.add_listener(self._on_download_source_added)
+        self._add_download_listeners(d)
 
         d.chunk_size = ndw.chunk_size
+        d.split_strategy = create_split_strategy(ndw.split_strategy)
+        d.set_priority(ndw.priority)
 
         if ndw.state_paused:
             d.pause()
@@ -736,10 +825,10 @@ class MainWindow:
                 removed = self.manager.remove_download(self.current_download)
                 if removed:
                     # remove download from store
-                    for row in self.download_store:
-                        if row[0] is self.current_download:
-                            self.download_store.remove(row.iter)
-                            break
+                    self.download_store.remove_download(
+                                                        self.current_download)
+                    self._row_updater.discard(self.current_download)
+                    self._update_filter_counts()
                     # remove listener
                     (self.current_download.log.message_added_event.
                         remove_listener(self._on_downloadlog_message_added))
@@ -755,6 +844,8 @@ class MainWindow:
                         remove_listener(self._on_download_retries_changed))
                     self.current_download.source_added_event.remove_listener(
                                                 self._on_download_source_added)
+                    (self.current_download.priority_changed_event.
+                        remove_listener(self._on_download_priority_changed))
                     self._on_download_view_cursor_changed()
                 else:
                     dlg = gtk.MessageDialog(parent=self.window,
@@ -800,6 +891,18 @@ class MainWindow:
         if result == gtk.RESPONSE_YES:
             download.cancel()
 
+    def on_raise_priority_action_activate(self, widget):
+        download = self._get_selected_download()
+        if download is None:
+                return
+        download.set_priority(download.priority + 1)
+
+    def on_lower_priority_action_activate(self, widget):
+        download = self._get_selected_download()
+        if download is None:
+                return
+        download.set_priority(download.priority - 1)
+
     def on_add_source_action_activate(self, widget):
         with self._current_download_lock:
             if self.current_download is not None:
@@ -869,11 +972,15 @@ class MainWindow:
         self.chunk_progress.background_color = gtk.gdk.Color(settings.get('gui.main_window.chunk_progress.background', '#ffffff'))
         self.chunk_progress.gradient1_color = gtk.gdk.Color(settings.get('gui.main_window.chunk_progress.gradient1', '#739ECE'))
         self.chunk_progress.gradient2_color = gtk.gdk.Color(settings.get('gui.main_window.chunk_progress.gradient2', '#ADC7E5'))
+        self.chunk_progress.active_color = gtk.gdk.Color(settings.get('gui.main_window.chunk_progress.active', '#E8A94F'))
+        self.chunk_progress.stolen_color = gtk.gdk.Color(settings.get('gui.main_window.chunk_progress.stolen', '#8CBF6E'))
         self.chunk_progress.border_color = gtk.gdk.Color(settings.get('gui.main_window.chunk_progress.border', '#333333'))
 
         self.chunk_progress.background_alpha = settings.get_int('gui.main_window.chunk_progress.background_alpha', 65535)
         self.chunk_progress.gradient1_alpha = settings.get_int('gui.main_window.chunk_progress.gradient1_alpha', 65535)
         self.chunk_progress.gradient2_alpha = settings.get_int('gui.main_window.chunk_progress.gradient2_alpha', 65535)
+        self.chunk_progress.active_alpha = settings.get_int('gui.main_window.chunk_progress.active_alpha', 65535)
+        self.chunk_progress.stolen_alpha = settings.get_int('gui.main_window.chunk_progress.stolen_alpha', 65535)
         self.chunk_progress.border_alpha = settings.get_int('gui.main_window.chunk_progress.border_alpha', 65535)
 
         self.chunk_progress.queue_draw()
@@ -881,6 +988,7 @@ class MainWindow:
     def on_settings_action_activate(self, widget):
         SettingsDialog().run()
         self._update_colors()
+        self._apply_manager_settings()
 
     def on_quit_action_activate(self, widget):
         if not self._quit():
@@ -889,12 +997,23 @@ class MainWindow:
     def on_parallel_spin_value_changed(self, widget):
         self.manager.set_max_parallel_downloads(self.parallel_spin.get_value())
 
+    def on_maxslot_spin_value_changed(self, widget):
+        if self._updating_maxslot_spin:
+            return
+        # slots are started or retired while the download is loading
+        with self._current_download_lock:
+            if self.current_download is not None:
+                self.current_download.set_max_slot(
+                                                self.maxslot_spin.get_value())
+
     def on_main_window_delete_event(self, widget, event, data=None):
         return self._quit()  # on_main_window_hide will be called
 
     def on_main_window_hide(self, widget, data=None):
         self.manager.quit()
 
+        core.save_trace()
+
         # save window settings
         x, y = self.window.window.get_root_origin()
         w, h = self.window.get_size()
@@ -910,6 +1029,9 @@ class MainWindow:
         settings.set('gui.main_window.retries_width', self.retries_column.get_width())
         settings.set('gui.main_window.speed_width', self.speed_column.get_width())
         settings.set('gui.main_window.timeleft_width', self.timeleft_column.get_width())
+        settings.set('gui.main_window.priority_width', self.priority_column.get_width())
+        settings.set('gui.main_window.filter', self.filter_store.get_value(
+                                    self.filter_combo.get_active_iter(), 0))
 
         # save downloads
         downloads_file.set('downloads', self.manager.get_downloads_as_list())
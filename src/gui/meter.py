@@ -33,6 +33,16 @@ class ToolMeter(gtk.ToolItem):
 
 
 class Meter(SimpleDrawingArea):
+    """Draws a diagram of the last values, e.g. of the speed.
+
+    The diagram is rendered into an off-screen surface. When values are
+    added, the surface is scrolled and only the new part at the right
+    is drawn. The whole diagram is only rendered again if the size, the
+    colors or the scale (the maximum value) have changed.
+    If a value does not change anything visible, e.g. the speed stays 0
+    while nothing is loaded, the meter is not redrawn at all.
+    """
+
     def __init__(self):
         self.background_color = gtk.gdk.Color('#fff')
         self.gradient1_color = gtk.gdk.Color('#FFE359')
@@ -57,19 +67,63 @@ class Meter(SimpleDrawingArea):
 
         self._values = deque([])
         self._max_value = 0
+        # the sum of the first _avg_count values
+        self._avg_sum = 0
+        self._avg_count = 0
+        # the number of values in a row which are equal to the first one
+        self._same_values = 0
         self._lock = Lock()
 
+        # the rendered diagram, the surface it is scrolled into and the
+        # size, colors and scale it was rendered with
+        self._surface = None
+        self._spare_surface = None
+        self._surface_key = None
+        # the number of values which were added after the diagram was
+        # rendered
+        self._new_values = 0
+        self._width = 0
+
         SimpleDrawingArea.__init__(self)
         self.connect("expose-event", self.expose)
         self.set_size_request(100, 40)
 
     def add_value(self, value):
         with self._lock:
+            same = len(self._values) > 0 and value == self._values[0]
+            old_avg = self._get_avg()
+
             self._values.appendleft(value)
             if value > self._max_value:
                 self._max_value = float(value)
             if len(self._values) > self.max_values:
                 self._values.pop()
+
+            if self._avg_count != min(self.avg_steps, len(self._values) - 1):
+                # avg_steps was changed
+                self._avg_sum = sum(self._values[i]
+                        for i in range(min(self.avg_steps, len(self._values))))
+                self._avg_count = min(self.avg_steps, len(self._values))
+            else:
+                self._avg_sum += value
+                if self._avg_count < self.avg_steps:
+                    self._avg_count += 1
+                else:
+                    self._avg_sum -= self._values[self._avg_count]
+
+            if same:
+                self._same_values += 1
+                if self._same_values >= self._avg_count:
+                    # avoid rounding errors of the running sum
+                    self._avg_sum = value * self._avg_count
+            else:
+                self._same_values = 0
+            # Nothing visible changes if the diagram shows the same value
+            # everywhere and the texts are the same.
+            if (same and self._same_values * self.x_step > self._width and
+                    self._get_avg() == old_avg):
+                return
+            self._new_values += 1
         self.queue_draw()
 
     def expose(self, widget, event):
@@ -82,61 +136,112 @@ class Meter(SimpleDrawingArea):
         self._redraw(self.context)
         return False
 
+    def _get_avg(self):
+        if self._avg_count == 0:
+            return 0
+        return self._avg_sum / self._avg_count
+
+    def _update_surface(self, width, height):
+        """Scroll the diagram by the new values or render it again."""
+        if self._max_value == 0:
+            factor = 0
+        else:
+            factor = height / self._max_value
+        key = (width, height, factor, self.x_step,
+               self.get_rgba(self.background_color, self.background_alpha),
+               self.get_rgba(self.gradient1_color, self.gradient1_alpha),
+               self.get_rgba(self.gradient2_color, self.gradient2_alpha),
+               self.get_rgba(self.border_color, self.border_alpha))
+
+        if (key != self._surface_key or
+                self._new_values * self.x_step >= width):
+            self._surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                               width, height)
+            self._spare_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                                     width, height)
+            self._surface_key = key
+            self._draw_values(cairo.Context(self._surface), width, height,
+                              factor, None)
+        elif self._new_values > 0:
+            shift = self._new_values * self.x_step
+            context = cairo.Context(self._spare_surface)
+            context.set_operator(cairo.OPERATOR_SOURCE)
+            context.set_source_surface(self._surface, -shift, 0)
+            context.paint()
+            context.set_operator(cairo.OPERATOR_OVER)
+            context.rectangle(width - shift, 0, shift, height)
+            context.clip()
+            self._draw_values(context, width, height, factor,
+                              self._new_values)
+            self._surface, self._spare_surface = (self._spare_surface,
+                                                  self._surface)
+        self._new_values = 0
+        self._width = width
+
+    def _draw_values(self, context, width, height, factor, count):
+        """Draw the first count values (all visible values if count is
+        None) at the right of the diagram. The area must be clipped.
+        """
+        context.set_line_width(1)
+
+        # background
+        context.set_operator(cairo.OPERATOR_SOURCE)
+        context.set_source_rgba(*self.get_rgba(self.background_color,
+                                               self.background_alpha))
+        context.paint()
+        context.set_operator(cairo.OPERATOR_OVER)
+
+        if not self._values:
+            return
+        # the value left of the new values is needed for the first line
+        if count is None:
+            count = len(self._values) - 1
+        count = min(count, len(self._values) - 1, width // self.x_step + 1)
+        cx = width
+        points = []
+        for i in range(count + 1):
+            points.append((cx, height - factor * self._values[i]))
+            cx -= self.x_step
+
+        context.move_to(width, height)
+        for point in points:
+            context.line_to(*point)
+        context.line_to(points[-1][0], height)
+        context.close_path()
+        g = cairo.LinearGradient(0, 0, 0, height)
+        g.add_color_stop_rgba(0, *self.get_rgba(self.gradient1_color,
+                                                self.gradient1_alpha))
+        g.add_color_stop_rgba(1, *self.get_rgba(self.gradient2_color,
+                                                self.gradient2_alpha))
+        context.set_source(g)
+        context.fill()
+
+        # only the line of the values is stroked, a vertical line at the
+        # right would be scrolled into the diagram
+        context.move_to(*points[0])
+        for point in points[1:]:
+            context.line_to(*point)
+        context.set_source_rgba(*self.get_rgba(self.border_color,
+                                               self.border_alpha))
+        context.set_line_join(cairo.LINE_JOIN_ROUND)
+        context.stroke()
+
     def _redraw(self, context):
         with self._lock:
             x, y, width, height = self.get_allocation()
+            self._update_surface(width, height)
 
             context.set_line_width(1)
 
-            # background
+            # diagram with round corners
             self.round_rectangle(context, 0, 0, width, height, 3)
-            context.set_source_rgba(*self.get_rgba(self.background_color,
-                                                    self.background_alpha))
-            context.fill_preserve()
             context.clip()
-
-            if self._max_value == 0:
-                factor = 0
-            else:
-                factor = height / self._max_value
-
-            # diagram
-            cx = width
-            context.move_to(cx, height)
-
-            for value in self._values:
-                context.line_to(cx, height - factor * value)
-                if cx <= 0:
-                    break
-                cx -= self.x_step
-
-            context.line_to(cx, height)
-            context.close_path()
-
-            g = cairo.LinearGradient(0, 0, 0, height)
-            g.add_color_stop_rgba(0, *self.get_rgba(self.gradient1_color,
-                                                    self.gradient1_alpha))
-            g.add_color_stop_rgba(1, *self.get_rgba(self.gradient2_color,
-                                                    self.gradient2_alpha))
-            context.set_source(g)
-            context.fill_preserve()
-
-            context.set_source_rgba(*self.get_rgba(self.border_color,
-                                                    self.border_alpha))
-            context.set_line_join(cairo.LINE_JOIN_ROUND)
-            context.stroke()
-
-            steps = min(len(self._values), self.avg_steps)
-            tmp = 0
-            for i in range(steps):
-                tmp += self._values[i]
-            if steps > 0:
-                avg = tmp / steps
-            else:
-                avg = 0
+            context.set_source_surface(self._surface, 0, 0)
+            context.paint()
 
             if len(self._values) > 0:
-                text = self.text_callback(self._values[0], self._max_value, avg)
+                text = self.text_callback(self._values[0], self._max_value,
+                                          self._get_avg())
             else:
                 text = self.text_callback(0, 0, 0)
 
@@ -156,4 +261,3 @@ class Meter(SimpleDrawingArea):
             #    cairo.FONT_WEIGHT_NORMAL)
             context.set_font_size(11)
             self.show_right_aligned_text(context, width, height, text)
-
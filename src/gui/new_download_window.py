@@ -26,6 +26,8 @@ import gtk
 from dlm.source import Source
 from event.eventlistener import EventListener
 from globals import settings
+from gui.splitstrategycombo import (init_split_strategy_combo,
+                                    get_split_strategy)
 
 class NewDownloadWindow:
     def __init__(self, url=''):
@@ -47,6 +49,9 @@ class NewDownloadWindow:
         self.cookie_entry = builder.get_object("cookie_entry")
         self.chunksize_spin = builder.get_object("chunksize_spin")
         self.timeout_spin = builder.get_object('timeout_spin')
+        self.priority_spin = builder.get_object('priority_spin')
+        self.split_strategy_combo = builder.get_object(
+                                                    'split_strategy_combo')
 
         def spin_output(spin):
             digits = int(spin.props.digits)
@@ -91,6 +96,8 @@ class NewDownloadWindow:
                         'Mozilla/5.0 (X11; U; Linux i686; de; rv:1.9.2.13) ' +
                         'Gecko/20101203 Firefox/3.6.13'))
 
+        init_split_strategy_combo(self.split_strategy_combo)
+
         folder = settings.get('core.new_download.target_folder')
         if folder is not None:
             self.target_folder_button.set_current_folder(folder)
@@ -116,6 +123,8 @@ class NewDownloadWindow:
         self.cookie = self.cookie_entry.get_text()
         self.chunk_size = self.chunksize_spin.get_value()
         self.timeout = self.timeout_spin.get_value()
+        self.priority = self.priority_spin.get_value()
+        self.split_strategy = get_split_strategy(self.split_strategy_combo)
 
     def show(self):
         self.window.show()
@@ -24,6 +24,7 @@ pygtk.require("2.0")
 import gtk
 import gobject
 
+import core
 from event.eventlistener import EventListener
 from dlm.slot import InfoSlot
 from dlm.source import Source
@@ -142,6 +143,7 @@ class NewSourceWindow:
         self.source.user_agent = self.user_agent
         self.source.referrer = self.referrer
         self.source.set_cookie_string(self.cookie)
+        self.source.retry_policy = core.create_retry_policy()
 
         self.infoslot = InfoSlot('Info Slot', self.source, None,
                             self._on_infos_fetched, self._on_infos_failed)
@@ -169,6 +171,7 @@ class NewSourceWindow:
 
             self.progressbar.hide()
             self.window.set_sensitive(True)
+            self.infoslot.log.flush()
             messages = self.infoslot.log.get_copy_of_messages()
             messages_str = ''
             for (type, time, name, message) in messages:
@@ -22,9 +22,13 @@ import pygtk
 pygtk.require("2.0")
 import gtk
 
+from dlm.chunk import ChunkState
+from dlm.hostlimits import HostLimits
 from globals import settings
 from gui.chunkprogress import ChunkProgress
 from gui.meter import Meter
+from gui.splitstrategycombo import (init_split_strategy_combo,
+                                    get_split_strategy)
 
 
 class SettingsDialog:
@@ -43,6 +47,14 @@ class SettingsDialog:
         self.chunksize_spin = builder.get_object("chunksize_spin")
         self.timeout_spin = builder.get_object('timeout_spin')
         self.parallel_spin = builder.get_object('parallel_spin')
+        self.preemption_check = builder.get_object('preemption_check')
+        self.connections_spin = builder.get_object('connections_spin')
+        self.weighted_connections_check = builder.get_object(
+                                                'weighted_connections_check')
+        self.host_limits_entry = builder.get_object('host_limits_entry')
+        self.prefetch_spin = builder.get_object('prefetch_spin')
+        self.split_strategy_combo = builder.get_object(
+                                                    'split_strategy_combo')
 
         def spin_output(spin):
             digits = int(spin.props.digits)
@@ -91,6 +103,8 @@ class SettingsDialog:
             p.value = value
             return True
         self.parallel_spin.connect('input', parallel_spin_input)
+        self.connections_spin.connect('output', parallel_spin_output)
+        self.connections_spin.connect('input', parallel_spin_input)
 
         # For color-previews
         self.preview_box = builder.get_object("preview_box")
@@ -118,7 +132,9 @@ class SettingsDialog:
 
         # Chunk Progress Preview
         self.chunk_progress = ChunkProgress()
-        self.chunk_progress.set_chunks([(0, 10), (25, 25), (85, 15)], 100)
+        self.chunk_progress.set_chunks([(0, 10, ChunkState.finished),
+                                        (25, 25, ChunkState.stolen),
+                                        (85, 10, ChunkState.active)], 100)
         self.preview_box.pack_start(self.chunk_progress, True, True, 0)
         self.chunk_progress.show_all()
 
@@ -151,11 +167,23 @@ class SettingsDialog:
                     settings.get_float('core.new_source.timeout', 5))
         self.parallel_spin.set_value(
                     settings.get_int('core.manager.parallel_downloads', 1))
+        self.preemption_check.set_active(
+                    settings.get('core.manager.preemption', False))
+        self.connections_spin.set_value(
+                    settings.get_int('core.manager.max_connections', 0))
+        self.weighted_connections_check.set_active(
+                    settings.get('core.manager.weighted_connections', False))
+        self.host_limits_entry.set_text(
+                    settings.get('core.manager.host_limits', ''))
+        self.prefetch_spin.set_value(
+                    settings.get_int('core.manager.prefetch_downloads', 2))
         self.useragent_entry.set_text(
                     settings.get('core.new_source.user_agent',
                         'Mozilla/5.0 (X11; U; Linux i686; de; rv:1.9.2.13) ' +
                         'Gecko/20101203 Firefox/3.6.13'))
 
+        init_split_strategy_combo(self.split_strategy_combo)
+
         folder = settings.get('core.new_download.target_folder')
         if folder is not None:
             self.target_folder_button.set_current_folder(folder)
@@ -299,6 +327,12 @@ class SettingsDialog:
         self.chunk_size = self.chunksize_spin.get_value()
         self.timeout = self.timeout_spin.get_value()
         self.parallel_downloads = self.parallel_spin.get_value()
+        self.preemption = self.preemption_check.get_active()
+        self.max_connections = self.connections_spin.get_value()
+        self.weighted_connections = self.weighted_connections_check.get_active()
+        self.host_limits = self.host_limits_entry.get_text()
+        self.prefetch_downloads = self.prefetch_spin.get_value()
+        self.split_strategy = get_split_strategy(self.split_strategy_combo)
         self._update_colors()
 
     def run(self):
@@ -311,11 +345,22 @@ class SettingsDialog:
             settings.set('core.new_source.wait', self.wait_retries)
             settings.set('core.new_source.redirects', self.redirects)
             settings.set('core.new_download.chunksize', self.chunk_size)
+            settings.set('core.new_download.split_strategy',
+                            self.split_strategy)
             settings.set('core.new_source.timeout', self.timeout)
             settings.set('core.new_source.user_agent', self.user_agent)
             settings.set('core.new_download.target_folder', self.target_folder)
             settings.set('core.manager.parallel_downloads',
                             self.parallel_downloads)
+            settings.set('core.manager.preemption', self.preemption)
+            settings.set('core.manager.max_connections', self.max_connections)
+            settings.set('core.manager.weighted_connections',
+                            self.weighted_connections)
+            if (self.host_limits.strip() == '' or
+                    HostLimits.is_limit_string_valid(self.host_limits)):
+                settings.set('core.manager.host_limits', self.host_limits)
+            settings.set('core.manager.prefetch_downloads',
+                            self.prefetch_downloads)
 
             # Speed Meter Colors/Alphas
             settings.set('gui.main_window.speed_meter.background',
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Helpers for the split strategy combo boxes of the new download window
+and the settings dialog.
+"""
+
+import gtk
+
+from dlm.splitstrategy import split_strategies, default_split_strategy
+from globals import settings
+
+
+def init_split_strategy_combo(combo):
+    """Fill the combo box with the split strategies and select the
+    strategy of the settings (core.new_download.split_strategy).
+
+    combo -- a gtk.ComboBox without model, e.g. from a glade file
+    """
+    # split strategies: name, title
+    strategy_store = gtk.ListStore(str, str)
+    for strategy in split_strategies:
+        strategy_store.append([strategy.name, strategy.title])
+    combo.set_model(strategy_store)
+    strategy_cell = gtk.CellRendererText()
+    combo.pack_start(strategy_cell, True)
+    combo.add_attribute(strategy_cell, 'text', 1)
+
+    strategy = settings.get('core.new_download.split_strategy',
+                            default_split_strategy)
+    combo.set_active(0)
+    for row in strategy_store:
+        if row[0] == strategy:
+            combo.set_active_iter(row.iter)
+
+
+def get_split_strategy(combo):
+    """Returns the name of the strategy selected in the combo box."""
+    return combo.get_model()[combo.get_active()][0]
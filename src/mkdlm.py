@@ -15,12 +15,39 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
+
+"""Start mkdlm.
+
+$ python mkdlm.py
+starts the GTK user interface.
+$ python mkdlm.py --daemon [--control ADDRESS]
+starts the daemon without a user interface (see daemon.py). ADDRESS is
+the address of the control API ('host:port' or 'unix:/path'), by
+default core.control.address.
+"""
+
+import sys
+
+import core
 from dlm.manager import Manager
 from globals import settings, downloads_file
-from gui.main_window import MainWindow
+
 
 class MKDLM:
     def start(self):
+        # GTK is only imported if the user interface is used
+        import gtk
+        from gui.main_window import MainWindow
+
+        if not core.lock_downloads_file():
+            dlg = gtk.MessageDialog(type=gtk.MESSAGE_ERROR,
+                    buttons=gtk.BUTTONS_OK,
+                    message_format='mkdlm is already running, e.g. as a ' +
+                                   'daemon. Use mkdlmctl.py to control it.')
+            dlg.run()
+            dlg.destroy()
+            return 1
+
         self._manager = Manager()
         settings.load()
         downloads_file.load()
@@ -28,7 +55,18 @@ class MKDLM:
         self._main_window.start()
         downloads_file.save()
         settings.save()
+        return 0
+
+
+def main(args):
+    if '--daemon' in args:
+        from daemon import Daemon
+        address = None
+        if '--control' in args:
+            address = args[args.index('--control') + 1]
+        return Daemon(address).start()
+    return MKDLM().start()
 
 
 if __name__ == '__main__':
-    MKDLM().start()
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+'''
+Copyright (C) 2011-2013  MKay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+"""Control the mkdlm daemon (see daemon.py) from the command line.
+
+Usage:
+$ python mkdlmctl.py [--control ADDRESS] COMMAND [ARGUMENTS]
+
+Commands:
+status -- the number of downloads in each state and the speed
+list -- all downloads
+show ID -- one download
+log ID [COUNT] -- the last COUNT messages of the log of a download
+add URL [--folder FOLDER] [--slots N] [--priority N] [--paused]
+start ID, pause ID, cancel ID, remove ID
+priority ID N -- set the priority of a download
+parallel N -- set the number of parallel downloads
+quit -- pause and save all downloads and stop the daemon
+
+ADDRESS is the address of the control API ('host:port' or 'unix:/path'),
+by default core.control.address. The results are printed as JSON.
+"""
+
+import json
+import socket
+import sys
+
+import core
+from control import ControlClient
+from globals import settings
+
+
+def _pop_option(args, name, has_value=True):
+    """Remove the option name (and its value) from args and return the
+    value, True if the option has no value or None if it is missing.
+    """
+    if name not in args:
+        return None
+    i = args.index(name)
+    if not has_value:
+        del args[i]
+        return True
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+
+
+def _get_request(args):
+    """Returns the (method, path, body)-tuple of the command in args."""
+    command = args[0]
+    if command == 'status':
+        return ('GET', '/status', None)
+    elif command == 'list':
+        return ('GET', '/downloads', None)
+    elif command == 'show':
+        return ('GET', '/downloads/' + args[1], None)
+    elif command == 'log':
+        count = args[2] if len(args) > 2 else 100
+        return ('GET', '/downloads/{0}/log?count={1}'.format(args[1], count),
+                None)
+    elif command == 'add':
+        body = {'url': args[1],
+                'paused': _pop_option(args, '--paused', False) is True}
+        for option, name in (('--folder', 'target_folder'),
+                             ('--slots', 'slots'),
+                             ('--priority', 'priority')):
+            value = _pop_option(args, option)
+            if value is not None:
+                body[name] = value
+        return ('POST', '/downloads', body)
+    elif command in ('start', 'pause', 'cancel', 'remove'):
+        return ('POST', '/downloads/{0}/{1}'.format(args[1], command), None)
+    elif command == 'priority':
+        return ('POST', '/downloads/{0}/priority'.format(args[1]),
+                {'priority': args[2]})
+    elif command == 'parallel':
+        return ('POST', '/parallel_downloads', {'value': args[1]})
+    elif command == 'quit':
+        return ('POST', '/quit', None)
+    raise ValueError('Unknown command: ' + command)
+
+
+def main(args):
+    address = _pop_option(args, '--control')
+    if address is None:
+        settings.load()
+        address = core.get_control_address()
+    try:
+        method, path, body = _get_request(args)
+    except (IndexError, ValueError):
+        sys.stderr.write(__doc__)
+        return 2
+
+    try:
+        status, result = ControlClient(address).request(method, path, body)
+    except socket.error, e:
+        sys.stderr.write('Could not connect to {0}: {1}\n'.format(address, e))
+        return 1
+    if status >= 400:
+        sys.stderr.write(result.get('error', str(status)) + '\n')
+        return 1
+    print(json.dumps(result, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))